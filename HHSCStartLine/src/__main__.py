@@ -8,8 +8,13 @@ facilitates "running" the zip file, e.g. python startline.zip.
 '''
 from screenui.raceview import StartLineFrame,AddFleetDialog
 from model.race import RaceManager
+from model.lightpattern import compileLightPattern, DEFAULT_PATTERN, DEFAULT_FLASH
+from model.scheduler import RealTimeScheduler
 from screenui.audio import AudioManager
-from persistence.recovery import RaceRecoveryManager
+from persistence.recovery import RaceRecoveryManager, RecoveryWriter, FSYNC_POLICIES
+from persistence.raceformat import RaceFormatException
+from persistence.archive import RaceArchive, RaceArchiver
+from persistence.export import ResultsExporter
 
 import threading 
 import logging
@@ -20,7 +25,8 @@ import os
 import tkMessageBox
 import pickle
 from controllers.controllers import ScreenController, GunController,\
-    LightsController
+    LightsController, CoursesController
+from Tkinter import Toplevel
 from logging.handlers import TimedRotatingFileHandler
 
 #
@@ -39,6 +45,148 @@ def create_timed_rotating_log(path):
                                        backupCount=5)
     logger.addHandler(handler)
 
+#
+# Return a setting for a course. A course section, e.g. [Course Inner], can override the
+# lights, persistence and default fleet names settings. Anything it doesn't set is read
+# from the usual section, or if that doesn't have it either, is the default.
+#
+def courseSetting(config, courseName, section, option, courseOption, default=None):
+    if courseName:
+        courseSection = "Course %s" % courseName
+        if config.has_option(courseSection, courseOption):
+            return config.get(courseSection, courseOption)
+    if default is not None and not config.has_option(section, option):
+        return default
+    return config.get(section, option)
+
+#
+# Return the COM port of a course's lights, or None if its lights aren't enabled
+#
+def courseComPort(config, courseName):
+    if courseSetting(config, courseName, "Lights", "enabled", "lightsEnabled") == 'Y':
+        return courseSetting(config, courseName, "Lights", "comPort", "comPort")
+    return None
+
+#
+# Return the recovery filename of a course, or None if we don't recover. A course that
+# doesn't set its own recovery file gets the usual one with its name added, e.g.
+# currentRace-Inner.dmp, so that the courses don't recover each other's races.
+#
+def courseRecoveryFilename(config, courseName):
+    if courseName and config.has_option("Course %s" % courseName, "recoveryFilename"):
+        return config.get("Course %s" % courseName, "recoveryFilename")
+    recoveryFilename = config.get("Persistence", "recoveryFilename")
+    if courseName and recoveryFilename:
+        (root, extension) = os.path.splitext(recoveryFilename)
+        recoveryFilename = "%s-%s%s" % (root, courseName, extension)
+    return recoveryFilename
+
+#
+# Check that no two courses share the lights' COM port or a recovery file. Returns a
+# description of the first clash, or None if there isn't one.
+#
+def findSharedCourseSetting(config, courseNames):
+    for (description, settingFor) in [("COM port", courseComPort), ("recovery file", courseRecoveryFilename)]:
+        coursesBySetting = {}
+        for courseName in courseNames:
+            setting = settingFor(config, courseName)
+            if not setting:
+                continue
+            key = os.path.normcase(setting)
+            if key in coursesBySetting:
+                return "Courses %s and %s both use %s %s" % (coursesBySetting[key], courseName, description, setting)
+            coursesBySetting[key] = courseName
+    return None
+
+#
+# Create the race manager, window and controllers for one start line. The first course
+# gets the main window; any others get a Toplevel window of their own.
+#
+def createCourse(config, courseName, master, audioManager, scheduler, recoveryWriter, raceArchive, resultsExporter, backgroundColour, fullScreen, fontSize):
+    
+    app = StartLineFrame(master=master,backgroundColour=backgroundColour,fullScreen=fullScreen,fontSize=fontSize)
+    
+    comPort = courseComPort(config, courseName)
+    if comPort:
+        lightsEnabled = True
+        logging.info("Lights enabled on COM port %s" % comPort)
+    else:
+        lightsEnabled = False
+        logging.info("Lights not enabled")
+    
+    # the light pattern is compiled once, here, into relay bitmasks
+    lightPattern = compileLightPattern(
+        courseSetting(config, courseName, "Lights", "pattern", "lightPattern", DEFAULT_PATTERN),
+        courseSetting(config, courseName, "Lights", "flash", "lightFlash", DEFAULT_FLASH))
+      
+    #
+    # Check for a recovery file. If we have one, ask if we want to recover our race manager
+    #
+    recoveryFilename = courseRecoveryFilename(config, courseName)
+    raceManager = RaceManager()
+    recoveryManager = None
+    if recoveryFilename:
+        recoveryManager = RaceRecoveryManager(recoveryFilename,None,recoveryWriter)
+        if config.has_option("Persistence","compactAfterRecords"):
+            recoveryManager.compactAfterRecords = config.getint("Persistence","compactAfterRecords")
+        if recoveryManager.hasRecoveryFile():
+            if courseName:
+                question = "Do you want to recover the %s course?" % courseName
+            else:
+                question = "Do you want to recover?"
+            if tkMessageBox.askyesno("Crash detected",question, icon="warning"):
+                try:
+                    raceManager = recoveryManager.recoverRaceManager()
+                except RaceFormatException as e:
+                    # e.g. a recovery file pickled by an earlier version, which we won't load
+                    logging.error("Cannot recover from %s: %s" % (recoveryFilename, e))
+                    tkMessageBox.showerror("Cannot recover", str(e))
+                    exit(1)
+    raceManager.setLightPattern(lightPattern)
+    
+    easyDaqRelay = None
+    relayThread = None
+    if lightsEnabled:     
+        from lightsui.hardware import EasyDaqUSBRelay
+        
+        easyDaqRelay = EasyDaqUSBRelay(comPort)
+        relayThread = threading.Thread(target = easyDaqRelay.run)
+        # run as a background thread. Allow application to end even if this thread is still running.
+        relayThread.daemon = True
+    
+    # the recovery manager and the archive run after the guns, lights and screen, when Tk is idle
+    raceManager.changed.setBackgroundScheduler(app.after_idle)
+    if recoveryManager:
+        recoveryManager.setRaceManager(raceManager)
+    if raceArchive:
+        RaceArchiver(raceArchive, raceManager, courseName)
+        
+    defaultFleetNames = courseSetting(config, courseName, "UserInterface", "defaultfleetNames", "defaultfleetNames")
+    if defaultFleetNames:
+        # the names of the fleets are split by "," in the config file
+        defaultFleetNames = defaultFleetNames.split(",")
+    else:
+        defaultFleetNames= []
+    
+    screenController = ScreenController(app,raceManager,audioManager,easyDaqRelay, recoveryManager,defaultFleetNames,fontSize,resultsExporter)
+    gunController = GunController(app, audioManager, raceManager, courseName, scheduler)
+    # check if a recovered raceManager has a started sequence. If so, schedule guns.
+    # note, this does not recover the F flag up beeps and gun nor F flag down beeps
+    if raceManager.hasSequenceStarted():
+        gunController.scheduleGunsForFutureFleetStarts()
+    
+    if lightsEnabled:
+        lightsController = LightsController(app, easyDaqRelay, raceManager, scheduler)
+        logging.info("Starting lights controller") 
+        relayThread.start()
+        
+    if courseName:
+        app.master.title('Startline - %s' % courseName)
+    else:
+        app.master.title('Startline')
+    
+    return screenController
+
 if __name__ == '__main__':
     
     if not len(sys.argv) == 2:
@@ -61,22 +209,34 @@ if __name__ == '__main__':
     
     logging.config.fileConfig(logConfigFilename)            
     
-    if config.get("Lights","enabled") == 'Y':
-        lightsEnabled = True
-        comPort = config.get("Lights","comPort")
-        logging.info("Lights enabled on COM port %s" % comPort)
-    else:
-        lightsEnabled = False
-        logging.info("Lights not enabled")
-        
-    
     if config.get("Training","trainingMode") =='Y':
         testSpeedRatio = config.getint("Training","trainingSpeed")
         logging.info("Running in training mode at speed %i" % testSpeedRatio)
     else:
         testSpeedRatio = 1
         logging.info("Running in race mode at standard speed")
-        
+    
+    if testSpeedRatio:
+        RaceManager.testSpeedRatio = testSpeedRatio
+    logging.info("Setting test speed ratio to %d" % testSpeedRatio)
+    
+    #
+    # We can run more than one start line, e.g. an inner and an outer course. The names of
+    # the courses are split by "," in the Courses section. Without a Courses section we run
+    # a single start line.
+    #
+    if config.has_option("Courses","names") and config.get("Courses","names"):
+        courseNames = [name.strip() for name in config.get("Courses","names").split(",")]
+    else:
+        courseNames = [None]
+    logging.info("Running courses %s" % courseNames)
+    
+    # two courses can't drive the same lights or recover from the same file
+    sharedCourseSetting = findSharedCourseSetting(config, courseNames)
+    if sharedCourseSetting:
+        logging.error(sharedCourseSetting)
+        sys.stderr.write("%s\n" % sharedCourseSetting)
+        exit(1)
     
     #
     # config.items returns a list of (name,value) pairs.
@@ -96,71 +256,67 @@ if __name__ == '__main__':
         fontSize = int(config.get("UserInterface","fontSize"))
     else:
         fontSize = 10
-    app = StartLineFrame(backgroundColour=backgroundColour,fullScreen=fullScreen,fontSize=fontSize)
-    
-      
-    #
-    # Check for a recovery file. If we have one, ask if we want to recover our race manager
-    #
-    recoveryFilename = config.get("Persistence","recoveryFilename") 
-    if recoveryFilename:
-        if os.path.exists(config.get("Persistence","recoveryFilename")):
-            if tkMessageBox.askyesno("Crash detected","Do you want to recover?", icon="warning"):
-                raceManager = pickle.load(open(recoveryFilename))
-            else:
-                raceManager = RaceManager()
-        else:
-            raceManager = RaceManager()
-    else:
-        raceManager = RaceManager()
-    
-    if testSpeedRatio:
-        RaceManager.testSpeedRatio = testSpeedRatio
-    logging.info("Setting test speed ratio to %d" % testSpeedRatio)
-    easyDaqRelay = None
-    
-    if lightsEnabled:     
-        from lightsui.hardware import LIGHT_OFF, LIGHT_ON, EasyDaqUSBRelay
         
-        easyDaqRelay = EasyDaqUSBRelay(comPort)
-        relayThread = threading.Thread(target = easyDaqRelay.run)
-        # run as a background thread. Allow application to end even if this thread is still running.
-        relayThread.daemon = True
-        
-    # the audio manager runs in its own thread    
+    # the audio manager runs in its own thread and is shared by all of the courses   
     audioManager = AudioManager(audioClips)  
     audioThread = threading.Thread(target = audioManager.run)
     audioThread.daemon = True
     
+    # the guns and lights of every course are timed by the real time scheduler, in its own
+    # thread, so that they don't wait for Tk
+    scheduler = RealTimeScheduler()
+    schedulerThread = threading.Thread(target = scheduler.run)
+    schedulerThread.daemon = True
     
-    recoveryManager = None
-    if config.get("Persistence","recoveryFilename"):
-        recoveryManager = RaceRecoveryManager(config.get("Persistence","recoveryFilename"),raceManager)
-        raceManager.changed.connect(None,recoveryManager.handleRaceManagerChanged)
-        recoveryThread = threading.Thread(target = recoveryManager.run)
-        recoveryThread.daemon = True
-        recoveryThread.start()
-    if config.get("UserInterface","defaultfleetNames"):
-        # the names of the fleets are split by "," in the config file
-        defaultFleetNames = config.get("UserInterface","defaultfleetNames").split(",")
-    else:
-        defaultFleetNames= []
+    # as is the recovery writer
+    recoveryWriter = RecoveryWriter()
+    if config.has_option("Persistence","maxStalenessSeconds"):
+        recoveryWriter.maxStalenessSeconds = config.getfloat("Persistence","maxStalenessSeconds")
+    if config.has_option("Persistence","fsyncPolicy"):
+        fsyncPolicy = config.get("Persistence","fsyncPolicy")
+        if fsyncPolicy in FSYNC_POLICIES:
+            recoveryWriter.fsyncPolicy = fsyncPolicy
+        else:
+            logging.warning("Unknown fsync policy %s, using %s" % (fsyncPolicy,recoveryWriter.fsyncPolicy))
+    if config.has_option("Persistence","fsyncIntervalMillis"):
+        recoveryWriter.fsyncIntervalMillis = config.getint("Persistence","fsyncIntervalMillis")
+    logging.info("Recovery fsync policy %s" % recoveryWriter.fsyncPolicy)
+    recoveryThread = threading.Thread(target = recoveryWriter.run)
+    recoveryThread.daemon = True
+    recoveryThread.start()
     
-    screenController = ScreenController(app,raceManager,audioManager,easyDaqRelay, recoveryManager,defaultFleetNames,fontSize)
-    gunController = GunController(app, audioManager, raceManager)
-    # check if a recovered raceManager has a started sequence. If so, schedule guns.
-    # note, this does not recover the F flag up beeps and gun nor F flag down beeps
-    if raceManager.hasSequenceStarted():
-        gunController.scheduleGunsForFutureFleetStarts()
+    # the race archive keeps every race in a database, and is shared by all of the courses
+    raceArchive = None
+    if config.has_option("Persistence","archiveFilename") and config.get("Persistence","archiveFilename"):
+        raceArchive = RaceArchive(config.get("Persistence","archiveFilename"))
+        logging.info("Archiving races to %s" % raceArchive.databaseFilename)
+        archiveThread = threading.Thread(target = raceArchive.run)
+        archiveThread.daemon = True
+        archiveThread.start()
     
+    # the results exporter writes results files in its own thread, for all of the courses
+    resultsExporter = ResultsExporter()
+    exportThread = threading.Thread(target = resultsExporter.run)
+    exportThread.daemon = True
+    exportThread.start()
     
-    logging.info("Starting screen controller")             
-    screenController.start()
+    screenControllers = []
+    for courseName in courseNames:
+        # the first course owns the Tk root, whose event loop runs every course's screen
+        if screenControllers:
+            master = Toplevel(app.master)
+        else:
+            master = None
+        screenController = createCourse(config, courseName, master, audioManager, scheduler, recoveryWriter, raceArchive, resultsExporter, backgroundColour, fullScreen, fontSize)
+        screenControllers.append(screenController)
+        if master is None:
+            app = screenController.startLineFrame
+    
+    coursesController = CoursesController(app.master, screenControllers, recoveryWriter, raceArchive, resultsExporter, scheduler)
+    
+    logging.info("Starting screen controllers")             
+    coursesController.start()
     
-    if lightsEnabled:
-        lightsController = LightsController(app, easyDaqRelay, raceManager)
-        logging.info("Starting lights controller") 
-        relayThread.start()
     audioThread.start()
-    app.master.title('Startline')    
+    schedulerThread.start()
     app.mainloop()  
\ No newline at end of file
@@ -5,9 +5,9 @@ Created on 23 Jan 2014
 '''
 from screenui.raceview import StartLineFrame,AddFleetDialog
 from model.race import RaceManager
-from screenui.audio import AudioManager
 from persistence.recovery import RaceRecoveryManager
-from lightsui.hardware import LIGHT_OFF, LIGHT_ON
+from model.lightpattern import LIGHTS_OFF
+from model.utils import PRIORITY_CRITICAL
 
 import threading 
 import logging
@@ -15,113 +15,113 @@ import sys
 
 import datetime
 import tkMessageBox
+import tkFileDialog
 import Tkinter
 import Queue
 import ConfigParser
 import os
 import pickle
+import math
 
 
 
 
 #
-# LightsController uses the EasyDaqUSBRelay to control the hardware lights. It refreshes the lights every
-# 500 milliseconds until all fleets have started. 
+# LightsController uses the EasyDaqUSBRelay to control the hardware lights. The race manager's start
+# timeline knows the time of every change of the lights, including each flash in the last thirty
+# seconds, so we schedule an update for the next change rather than refreshing the lights on a timer.
+# When all fleets have started, there are no more changes and we stop scheduling updates. The lights
+# are a relay bitmask, compiled from the race manager's light pattern.
+#
+# The scheduler runs our updates. By default this is the Tk root, but it is usually the real time
+# scheduler, so that the lights don't wait for Tk. The updates then run on the scheduler's thread,
+# so we take the start timeline on the Tk thread, when the sequence changes, and the updates only
+# read that. The lock stops an update rescheduling itself while the sequence changes.
 #
 class LightsController():
     
-    def __init__(self, tkRoot,easyDaqRelay,raceManager):
+    def __init__(self, tkRoot,easyDaqRelay,raceManager,scheduler=None):
         self.tkRoot = tkRoot
         self.easyDaqRelay = easyDaqRelay
         self.raceManager = raceManager
+        self.scheduler = scheduler or tkRoot
         # we start assuming that our lights are off
-        self.currentLights = [LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF]
+        self.currentLights = LIGHTS_OFF
+        self.startTimeline = raceManager.timeline()
+        self.lock = threading.RLock()
         self.wireController()
         
         self.updateTimer = None
+        # each scheduled update carries the generation it was scheduled in. Cancelling the
+        # update timer moves us on a generation, so an update the scheduler had already taken
+        # when we cancelled it does nothing when it runs.
+        self.updateGeneration = 0
         
     def wireController(self):
         
         
-        self.raceManager.changed.connect("generalRecall",self.handleGeneralRecall)
-        self.raceManager.changed.connect("sequenceStartedWithWarning",self.handleSequenceStarted)
-        self.raceManager.changed.connect("sequenceStartedWithoutWarning",self.handleSequenceStarted)
-        self.raceManager.changed.connect("startSequenceReset",self.handleStartSequenceReset)
+        self.raceManager.changed.connect("generalRecall",self.handleGeneralRecall,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("sequenceStartedWithWarning",self.handleSequenceStarted,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("sequenceStartedWithoutWarning",self.handleSequenceStarted,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("startSequenceReset",self.handleStartSequenceReset,PRIORITY_CRITICAL)
         
         
         
     
     def handleGeneralRecall(self,fleet):
-        self.cancelUpdateTimer()
-        self.updateLights()
+        self.restartLights()
     
     def handleSequenceStarted(self):
-        self.cancelUpdateTimer()
-        self.updateLights()
+        self.restartLights()
         
     def handleStartSequenceReset(self):
-        self.cancelUpdateTimer()
-        self.updateLights()
+        self.restartLights()
+    
+    #
+    # Called on the Tk thread when the sequence changes
+    #
+    def restartLights(self):
+        with self.lock:
+            self.cancelUpdateTimer()
+            self.startTimeline = self.raceManager.timeline()
+            self.updateLightsFrom(self.startTimeline)
         
     def cancelUpdateTimer(self):
         # if we have an update timer, cancel it. Note that if the update timer
         # has has already executed, the cancel has no effect and does not fail.
         if self.updateTimer:
-            self.tkRoot.after_cancel(self.updateTimer)
+            self.scheduler.after_cancel(self.updateTimer)
+            self.updateTimer = None
+        self.updateGeneration = self.updateGeneration + 1
         
+
+    #
+    # Called by the scheduler, on its thread, when the lights are due to change
+    #
+    def updateLights(self, generation):
+        with self.lock:
+            if generation != self.updateGeneration:
+                logging.debug("Ignoring a cancelled lights update")
+                return
+            self.updateTimer = None
+            self.updateLightsFrom(self.startTimeline)
     
-    def calculateLightsDisplay(self):
-        #
-        # out default is no lights
-        lights = [LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF]
-        
-        # ask for the next fleet to start
-        nextFleetToStart = self.raceManager.nextFleetToStart()
-        
-        # if we have a fleet to start
-        if nextFleetToStart:
-            secondsToStart = -1 * nextFleetToStart.adjustedDeltaSecondsToStartTime()
-            
-            if secondsToStart <=300 and secondsToStart > 240:
-                lights = [LIGHT_ON, LIGHT_ON, LIGHT_ON, LIGHT_ON, LIGHT_ON]
-            elif secondsToStart <= 240 and secondsToStart > 180:
-                lights = [LIGHT_ON, LIGHT_ON, LIGHT_ON, LIGHT_ON, LIGHT_OFF]
-            elif secondsToStart <= 180 and secondsToStart > 120: 
-                lights = [LIGHT_ON, LIGHT_ON, LIGHT_ON, LIGHT_OFF, LIGHT_OFF]
-            elif secondsToStart <= 120 and secondsToStart > 60: 
-                lights = [LIGHT_ON, LIGHT_ON, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF]
-            elif secondsToStart <= 60 and secondsToStart > 30: 
-                lights = [LIGHT_ON, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF]
-            elif secondsToStart <= 30 and (int(secondsToStart * 2) % 2 == 0):
-                lights = [LIGHT_ON, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF]
-            else:
-                lights = [LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF]
-            
-        return lights
-    
-    
-                 
-    
-    def updateLights(self):
+    def updateLightsFrom(self,timeline):
+        now = self.raceManager.clock.now()
         
-        newLights = self.calculateLightsDisplay()
+        newLights = timeline.lightsAt(now)
         
         if newLights != self.currentLights:
             self.easyDaqRelay.sendRelayCommand(newLights)
             self.currentLights = newLights
         
-        # check that we still have a fleet to start, if so,
-        # calculate the time until our next change
-        
-        if self.raceManager.nextFleetToStart():
-            # make sure we update idle tasks so that the screen updates. This is particularly important in speedy mode
-            self.tkRoot.update_idletasks()
-            
-            self.updateTimer = self.tkRoot.after(500, self.updateLights)
-            
-        # if we don't have a race to start any more, set our lights to 0 and don't update ourselves again
-        else:
-            self.easyDaqRelay.sendRelayCommand([LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF])
+        # if the lights will change again, schedule an update for the change. We round up
+        # to the next millisecond so that we never wake before the change; if we do, the
+        # lights haven't changed yet and we schedule ourselves again.
+        nextLightChange = timeline.nextLightChange(now)
+        if nextLightChange:
+            millis = int(math.ceil((nextLightChange.changeTime - now).total_seconds() * 1000))
+            self.updateTimer = self.scheduler.after(max(millis, 0), self.updateLights, self.updateGeneration)
         
            
         
@@ -137,15 +137,19 @@ class LightsController():
 #
 # GunController uses the AudioManager to play a Wav file as the race "gun".
 # It does this in response to events from the race manager when races change
-# during the start sequence or when boats finish. It uses the Tk root
-# to provide an event scheduler. 
+# during the start sequence or when boats finish. It uses the scheduler, by default
+# the Tk root, to provide an event scheduler. With the real time scheduler, the
+# guns are on time whatever Tk is doing, and are fired on the scheduler's thread.
 #
 class GunController():
     
-    def __init__(self, tkRoot, audioManager, raceManager):
+    def __init__(self, tkRoot, audioManager, raceManager, courseName=None, scheduler=None):
         self.tkRoot = tkRoot
         self.audioManager = audioManager
         self.raceManager = raceManager
+        self.scheduler = scheduler or tkRoot
+        # the name of our start line, if the audio manager is shared by more than one
+        self.courseName = courseName
         self.scheduledGuns = []
         self.wireController()
         
@@ -154,11 +158,12 @@ class GunController():
     # for the events we are interested in
     #   
     def wireController(self):
-        self.raceManager.changed.connect("sequenceStartedWithWarning",self.handleSequenceStartedWithWarning)
-        self.raceManager.changed.connect("sequenceStartedWithoutWarning",self.handleSequenceStartedWithoutWarning)
-        self.raceManager.changed.connect("generalRecall",self.handleGeneralRecall)
-        self.raceManager.changed.connect("startSequenceReset",self.handleStartSequenceReset)
-        self.raceManager.changed.connect("finishAdded", self.handleFinishAdded)
+        self.raceManager.changed.connect("sequenceStartedWithWarning",self.handleSequenceStartedWithWarning,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("sequenceStartedWithoutWarning",self.handleSequenceStartedWithoutWarning,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("generalRecall",self.handleGeneralRecall,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("startSequenceReset",self.handleStartSequenceReset,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("finishAdded", self.handleFinishAdded,PRIORITY_CRITICAL)
+        self.raceManager.changed.connect("finishesAdded", self.handleFinishesAdded,PRIORITY_CRITICAL)
         
     # issue #38
     # modified to separate single gun into start, finish and general gun. This allows us to have
@@ -166,18 +171,18 @@ class GunController():
     #
         
     def fireStartGun(self):
-        self.audioManager.queueClip("startgun")
+        self.audioManager.queueClip("startgun",self.courseName)
         
     def fireFinishGun(self):
-        self.audioManager.queueClip("finishgun")
+        self.audioManager.queueClip("finishgun",self.courseName)
         
     def fireGun(self):
-        self.audioManager.queueClip("gun")
+        self.audioManager.queueClip("gun",self.courseName)
         
         
  
     def soundWarning(self):
-        self.audioManager.queueClip("warning")
+        self.audioManager.queueClip("warning",self.courseName)
     
     #
     # millis is the time of the gun. The warning beeps are for the ten seconds prior to the gun
@@ -187,15 +192,15 @@ class GunController():
         # note, there is no logic here to check that there is enough time for all of the warning beeps.
         #
         for warningMillis in range(gunMillis-10000, gunMillis, 1000):
-            self.addSchedule(self.tkRoot.after(warningMillis, self.soundWarning))
+            self.addSchedule(self.scheduler.after(warningMillis, self.soundWarning))
         # if we give a final warning instead of a gun, schedule this
         if finalWarning:
-            self.addSchedule(self.tkRoot.after(gunMillis, self.soundWarning))
+            self.addSchedule(self.scheduler.after(gunMillis, self.soundWarning))
     
  
     def scheduleStartGun(self,millis):
         logging.log(logging.DEBUG,"Scheduling gun for %d " % millis)
-        scheduleId = self.tkRoot.after(millis, self.fireStartGun)
+        scheduleId = self.scheduler.after(millis, self.fireStartGun)
         
         self.addSchedule(scheduleId)
         
@@ -204,7 +209,7 @@ class GunController():
         
     def cancelSchedules(self):
         for aSchedule in self.scheduledGuns:
-            self.tkRoot.after_cancel(aSchedule)
+            self.scheduler.after_cancel(aSchedule)
         self.scheduledGuns = []
     
     
@@ -272,6 +277,13 @@ class GunController():
         
     def handleFinishAdded(self,aFinish):
         self.fireFinishGun()
+        
+    #
+    # A burst of finishes gets one finish gun, rather than a queue of guns that
+    # sound long after the boats have crossed the line
+    #
+    def handleFinishesAdded(self,finishes):
+        self.fireFinishGun()
     
     def handleSequenceStartedWithoutWarning(self):
         # schedule ten second countdown
@@ -284,7 +296,7 @@ class GunController():
     def handleGeneralRecall(self,aFleet):
         self.fireStartGun()
         # we can't use our built in scheduleGun function because we then immediately cancel our schedules.
-        self.tkRoot.after(2000,self.fireStartGun)
+        self.scheduler.after(2000,self.fireStartGun)
         self.cancelSchedules()
         self.scheduleGunsForFutureFleetStarts()
         
@@ -293,8 +305,10 @@ class GunController():
     def handleStartSequenceReset(self):
         self.cancelSchedules()
     
-    def convertTimeToMillis(self, aTime):
-        timeDelta =  aTime - datetime.datetime.now()
+    def convertTimeToMillis(self, aTime, now=None):
+        if now is None:
+            now = self.raceManager.clock.now()
+        timeDelta =  aTime - now
         return  int(timeDelta.total_seconds() * 1000)
     
     def scheduleGunsForFutureFleetStarts(self):
@@ -305,8 +319,10 @@ class GunController():
         # note the this can result in a negative time for guns. We have logic below to ignore guns
         # in the past.
         gunScheduleTimes = set()
-        for aFleet in self.raceManager.fleets:
-            if not aFleet.isStarted() :
+        snapshot = self.raceManager.snapshot()
+        for aFleetState in snapshot.fleetStates:
+            aFleet = aFleetState.fleet
+            if not aFleetState.status == "Started":
                 gunScheduleTimes.add(aFleet.adjustedTimeBeforeStart(300))
                 gunScheduleTimes.add(aFleet.adjustedTimeBeforeStart(240))
                 gunScheduleTimes.add(aFleet.adjustedTimeBeforeStart(60))
@@ -316,7 +332,7 @@ class GunController():
         logging.debug("millis in schedule: " + str(gunScheduleTimes))
         for gunScheduleTime in gunScheduleTimes:
                 # only schedule guns for the future, not the past. 
-                gunMillis = self.convertTimeToMillis(gunScheduleTime)
+                gunMillis = self.convertTimeToMillis(gunScheduleTime, snapshot.at)
                 if gunMillis > 0:
                     self.scheduleWarningBeeps(gunMillis)
                 
@@ -324,14 +340,18 @@ class GunController():
             
         
 class ScreenController():
-    pass
+    
+    # the number of finishes we add to the finish view at a time when we build it
+    finishViewChunkSize = 200
 
-    def __init__(self,startLineFrame,raceManager,audioManager,easyDaqRelay,recoveryManager,defaultFleetNames,fontSize):
+    def __init__(self,startLineFrame,raceManager,audioManager,easyDaqRelay,recoveryManager,defaultFleetNames,fontSize,resultsExporter=None):
         self.startLineFrame = startLineFrame
         self.raceManager = raceManager
         self.audioManager = audioManager
         self.easyDaqRelay = easyDaqRelay
         self.recoveryManager = recoveryManager
+        # writes the results in its own thread when we export them
+        self.resultsExporter = resultsExporter
         # needed to pass to add fleet dialog
         self.defaultFleetNames = defaultFleetNames
         # needed to pass to add fleet dialog
@@ -340,6 +360,12 @@ class ScreenController():
         self.selectedFleet = None    
         self.selectedFinish = None
         
+        # the finishes still to be added to the finish view, when we are building it
+        self.pendingFinishViewFinishes = []
+        
+        # if we are one of several start lines, the courses controller shuts us all down together
+        self.coursesController = None
+        
         self.fleetButtons=[]
         self.buildFleetManagerView()
         
@@ -360,6 +386,7 @@ class ScreenController():
         self.raceManager.changed.connect("fleetRemoved",self.handleFleetRemoved)
         self.raceManager.changed.connect("fleetChanged",self.handleFleetChanged)
         self.raceManager.changed.connect("finishAdded",self.handleFinishAdded)
+        self.raceManager.changed.connect("finishesAdded",self.handleFinishesAdded)
         self.raceManager.changed.connect("finishRemoved",self.handleFinishRemoved)
         self.raceManager.changed.connect("finishChanged",self.handleFinishChanged)
         self.raceManager.changed.connect("sequenceStartedWithWarning",self.handleSequenceStarted)
@@ -382,15 +409,17 @@ class ScreenController():
         self.startLineFrame.gunAndFinishButton.config(command=self.gunAndFinishClicked)
         self.startLineFrame.resetStartRaceSequenceButton.config(command=self.resetStartRaceSequenceClicked)
         self.startLineFrame.removeFinishButton.config(command=self.removeFinishClicked)
+        self.startLineFrame.exportResultsButton.config(command=self.exportResultsClicked)
         self.startLineFrame.exitButton.config(command=self.exitClicked)
         self.startLineFrame.master.protocol("WM_DELETE_WINDOW",self.exitClicked)
         # bind F1 to gun and finish clicked. 
         # bind F2 to gun clicked
         # This is a useful keyboard shortcut and also provides support for additional HID
-        # devices that are configured to keyboard events
+        # devices that are configured to keyboard events. We bind to our own window so that
+        # each start line has its own keys when we run more than one.
         
-        self.startLineFrame.bind_all("<F1>",self.f1Pressed)
-        self.startLineFrame.bind_all("<F2>",self.f2Pressed)
+        self.startLineFrame.winfo_toplevel().bind("<F1>",self.f1Pressed)
+        self.startLineFrame.winfo_toplevel().bind("<F2>",self.f2Pressed)
         
         
         
@@ -402,12 +431,13 @@ class ScreenController():
     
     
     def appendFleetToTreeView(self,aFleet):
+        aFleetState = aFleet.state(self.raceManager.clock.now())
         self.startLineFrame.fleetsTreeView.insert(
              parent="",
              index="end",
              iid = aFleet.fleetId,
              text = aFleet.name,
-             values=(self.renderDeltaToStartTime(aFleet),aFleet.status()))  
+             values=(self.renderDeltaToStartTime(aFleetState),aFleetState.status))  
             
     def showAddFleetDialog(self):
         addFleetDialog = AddFleetDialog(self.startLineFrame,self.defaultFleetNames)
@@ -490,6 +520,16 @@ class ScreenController():
     def removeFinishClicked(self):
         self.raceManager.removeFinish(self.selectedFinish)
         self.selectedFinish = None
+        
+    #
+    # We only copy the race here. The results exporter calculates and writes the results in its own thread.
+    #
+    def exportResultsClicked(self):
+        filename = tkFileDialog.asksaveasfilename(parent=self.startLineFrame,title="Export results",
+            defaultextension=".csv",
+            filetypes=[("CSV","*.csv"),("JSON lines","*.jsonl"),("HTML","*.html")])
+        if filename:
+            self.resultsExporter.exportRace(self.raceManager,filename,title=self.startLineFrame.master.title())
     
     def handleFleetAdded(self,aFleet):
         self.appendFleetToTreeView(aFleet)
@@ -508,20 +548,46 @@ class ScreenController():
     def handleFinishAdded(self,aFinish):
         self.appendFinishToFinishTreeView(aFinish)
         
+    def handleFinishesAdded(self,finishes):
+        self.appendFinishesToFinishTreeView(finishes)
+        
+    #
+    # A finish may not be in the finish view yet if we are still building it
+    #
     def handleFinishRemoved(self,aFinish):
-        self.startLineFrame.finishTreeView.delete(aFinish.finishId)
+        if self.startLineFrame.finishTreeView.exists(aFinish.finishId):
+            self.startLineFrame.finishTreeView.delete(aFinish.finishId)
         
     
     def handleFinishChanged(self,aFinish):
         # update the GUI for a finish
-        self.startLineFrame.finishTreeView.item(aFinish.finishId,
-            values=(self.renderFinishFleet(aFinish),self.renderFinishElapsedTime(aFinish)))
+        if self.startLineFrame.finishTreeView.exists(aFinish.finishId):
+            self.startLineFrame.finishTreeView.item(aFinish.finishId,
+                values=(self.renderFinishFleet(aFinish),self.renderFinishElapsedTime(aFinish)))
     
+    #
+    # We build our tree a chunk at a time. The most recent finishes go in first, so that the
+    # window appears quickly after recovering a long race day, and the older finishes are
+    # added above them when Tk is idle.
+    #
     def buildFinishView(self):
-        # we build our tree
-           
-        for finish in self.raceManager.finishes:
-            self.appendFinishToFinishTreeView(finish)
+        finishes = list(self.raceManager.finishes)
+        if not finishes:
+            return
+        self.pendingFinishViewFinishes = finishes[:-self.finishViewChunkSize]
+        self.appendFinishesToFinishTreeView(finishes[-self.finishViewChunkSize:])
+        if self.pendingFinishViewFinishes:
+            self.startLineFrame.after_idle(self.buildFinishViewChunk)
+            
+    def buildFinishViewChunk(self):
+        chunk = self.pendingFinishViewFinishes[-self.finishViewChunkSize:]
+        del self.pendingFinishViewFinishes[-self.finishViewChunkSize:]
+        # insert at the top of the view, newest first, skipping any removed in the meantime
+        for aFinish in reversed(chunk):
+            if aFinish in self.raceManager.finishes:
+                self.insertFinishInFinishTreeView(aFinish,0)
+        if self.pendingFinishViewFinishes:
+            self.startLineFrame.after(1,self.buildFinishViewChunk)
             
     #
     # When the sequence starts, we create our fleet buttons
@@ -561,20 +627,17 @@ class ScreenController():
             self.selectFinishInTreeView(self.nextFinishWithoutFleetAfter(self.selectedFinish))
     
     def nextFinishWithoutFleetAfter(self,finish):
-        indexOfFinish = self.raceManager.finishes.index(finish)
-        for i in range(indexOfFinish+1,len(self.raceManager.finishes)):
-            if not self.raceManager.finishes[i].hasFleet():
-                return self.raceManager.finishes[i]
-            
-        return None
+        return self.raceManager.nextFinishWithoutFleetAfter(finish)
     #
     def appendFinishToFinishTreeView(self,aFinish):
-        finishItem = self.startLineFrame.finishTreeView.insert(
-             parent="",
-             index="end",
-             iid = aFinish.finishId,
-             text = self.renderFinishTime(aFinish),
-             values=(self.renderFinishFleet(aFinish),self.renderFinishElapsedTime(aFinish)))
+        self.appendFinishesToFinishTreeView([aFinish])
+        
+    #
+    # Append a list of finishes to the tree view, scrolling to the bottom once
+    #
+    def appendFinishesToFinishTreeView(self,finishes):
+        for aFinish in finishes:
+            finishItem = self.insertFinishInFinishTreeView(aFinish,"end")
         
         # the call up update_idletasks is needed to make sure that the
         # treeview is fully populated. Without this line, on Active Python 2.7.2.5
@@ -584,12 +647,24 @@ class ScreenController():
         
         #
         # if we don't already have a selected finish, 
-        # or select the fleet just added
+        # or select the first finish just added without a fleet
         #
         if not self.selectedFinish or self.selectedFinish.hasFleet():
-            self.selectFinishInTreeView(aFinish)
+            for aFinish in finishes:
+                if not aFinish.hasFleet():
+                    self.selectFinishInTreeView(aFinish)
+                    return
+            self.selectFinishInTreeView(finishes[-1])
     
     
+    def insertFinishInFinishTreeView(self,aFinish,index):
+        return self.startLineFrame.finishTreeView.insert(
+             parent="",
+             index=index,
+             iid = aFinish.finishId,
+             text = self.renderFinishTime(aFinish),
+             values=(self.renderFinishFleet(aFinish),self.renderFinishElapsedTime(aFinish)))
+    
     #
     # This isn't quite right. 
     #
@@ -665,12 +740,12 @@ class ScreenController():
     # of a regular clock. On a countdown, we show the time as 2 seconds until it is
     # exactly 1 second.
     #
-    def integerAdjustedDeltaSecondsToFleetStartTime(self,aFleet):
-        return int(aFleet.adjustedDeltaSecondsToStartTime()-1)
+    def integerAdjustedDeltaSecondsToFleetStartTime(self,aFleetState):
+        return int(aFleetState.adjustedDeltaSeconds-1)
     
-    def renderDeltaToStartTime(self, aFleet):
-        if aFleet.hasStartTime():
-            deltaToStartTimeSeconds = int(self.integerAdjustedDeltaSecondsToFleetStartTime(aFleet))
+    def renderDeltaToStartTime(self, aFleetState):
+        if aFleetState.fleet.hasStartTime():
+            deltaToStartTimeSeconds = int(self.integerAdjustedDeltaSecondsToFleetStartTime(aFleetState))
             
             hmsString = str(datetime.timedelta(seconds=(abs(deltaToStartTimeSeconds))))
             
@@ -684,9 +759,9 @@ class ScreenController():
         
     
     
-    def renderDeltaSecondsToStartTime(self, aFleet):
-        if aFleet.hasStartTime():
-            return self.integerAdjustedDeltaSecondsToFleetStartTime(aFleet)
+    def renderDeltaSecondsToStartTime(self, aFleetState):
+        if aFleetState.fleet.hasStartTime():
+            return self.integerAdjustedDeltaSecondsToFleetStartTime(aFleetState)
             
             
             
@@ -696,24 +771,25 @@ class ScreenController():
     
     def refreshFleetsView(self):
         #
-        # iterate over all of our fleets. Read the start time delta and
+        # take a snapshot of all of our fleets at this instant. Render the start time delta and
         # and status, and update the fleetsTreeView with their values
         #
+        snapshot = self.raceManager.snapshot()
         
-        for aFleet in self.raceManager.fleets:
+        for aFleetState in snapshot.fleetStates:
             
             self.startLineFrame.fleetsTreeView.item(
-                        aFleet.fleetId,
+                        aFleetState.fleet.fleetId,
                         
-                        values=[self.renderDeltaToStartTime(aFleet), self.renderDeltaSecondsToStartTime(aFleet),aFleet.status()])
+                        values=[self.renderDeltaToStartTime(aFleetState), self.renderDeltaSecondsToStartTime(aFleetState),aFleetState.status])
         
        
         
         #
-        # Ask our race manager if we have a started fleet and last fleet started was started less than 30 seconds ago
+        # Ask our snapshot if we have a started fleet and last fleet started was started less than 30 seconds ago
         #
             
-        if self.raceManager.hasStartedFleet() and self.raceManager.lastFleetStarted().adjustedDeltaSecondsToStartTime() < 30.0:
+        if snapshot.hasStartedFleet() and snapshot.stateForFleet(snapshot.lastFleetStarted).adjustedDeltaSeconds < 30.0:
             self.startLineFrame.enableGeneralRecallButton()
         else:
             self.startLineFrame.disableGeneralRecallButton()
@@ -723,7 +799,7 @@ class ScreenController():
         #
         # Update our clock
         #
-        self.startLineFrame.clockStringVar.set(datetime.datetime.now().strftime("%H:%M:%S"))
+        self.startLineFrame.clockStringVar.set(snapshot.at.strftime("%H:%M:%S"))
         
         #
         # Update the connection status
@@ -748,7 +824,8 @@ class ScreenController():
         #
         # Logic for enabling and disabling buttons
         #   
-        if self.raceManager.hasSequenceStarted() or self.raceManager.hasStartedFleet(): 
+        snapshot = self.raceManager.snapshot()
+        if snapshot.hasSequenceStarted() or snapshot.hasStartedFleet(): 
             
             self.startLineFrame.enableResetStartRaceSequenceButton()
             self.startLineFrame.disableAddFleetButton()
@@ -803,19 +880,79 @@ class ScreenController():
     def exitClicked(self):
         result = tkMessageBox.askquestion("Exit","Are you sure?", icon="warning")
         if result == 'yes':
-            self.shutdown()
+            if self.coursesController:
+                self.coursesController.shutdown()
+            else:
+                self.shutdown()
         
     def shutdown(self):
+        self.stop()
+        
+        # and then quit after a second
+        self.startLineFrame.after(1000,self.startLineFrame.master.quit)
+        
+    #
+    # Turn off our lights and stop our relay and recovery manager
+    #
+    def stop(self):
         
         logging.info("Shutting down")
+        for (name, calls, totalSeconds, maxSeconds) in self.raceManager.changed.handlerTimings():
+            logging.info("Signal handler %s: %d calls, %.3f seconds, max %.3f seconds" % (name, calls, totalSeconds, maxSeconds))
         if self.easyDaqRelay:
-            self.easyDaqRelay.sendRelayCommand([LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF, LIGHT_OFF])
+            self.easyDaqRelay.sendRelayCommand(LIGHTS_OFF)
             self.easyDaqRelay.stop()
         
         # delete our recovery file if we have one
         if self.recoveryManager:
             self.recoveryManager.stop()
-        
+
+
+#
+# CoursesController looks after several start lines (courses) running in one process, e.g.
+# an inner and an outer course on a regatta day. Each course has its own race manager,
+# lights and screen controller. They share the Tk event loop, the real time scheduler for
+# their guns and lights, one audio manager and one recovery writer. Exiting from any course
+# shuts them all down.
+#
+class CoursesController():
+    
+    # the longest we wait at shutdown for the race archive to write what it has queued
+    archiveStopSeconds = 5
+    
+    def __init__(self,tkRoot,screenControllers,recoveryWriter=None,raceArchive=None,resultsExporter=None,scheduler=None):
+        self.tkRoot = tkRoot
+        self.screenControllers = screenControllers
+        self.recoveryWriter = recoveryWriter
+        self.raceArchive = raceArchive
+        self.resultsExporter = resultsExporter
+        # the real time scheduler for the guns and lights, if they don't use Tk
+        self.scheduler = scheduler
+        for screenController in self.screenControllers:
+            screenController.coursesController = self
+            
+    def start(self):
+        for screenController in self.screenControllers:
+            screenController.start()
+            
+    def shutdown(self):
+        # stop the guns and lights first, so that a light change doesn't follow the lights going off
+        if self.scheduler:
+            self.scheduler.stop()
+        for screenController in self.screenControllers:
+            screenController.stop()
+        if self.recoveryWriter:
+            self.recoveryWriter.stop()
+        # the archive and the exporter hear about changes in the background lane, when Tk is idle,
+        # so we let the changes made by stopping the courses reach them first
+        self.tkRoot.update_idletasks()
+        # the archive writes what it has queued before its thread ends, and we wait for it
+        if self.raceArchive:
+            self.raceArchive.stop(self.archiveStopSeconds)
+        # as does the results exporter
+        if self.resultsExporter:
+            self.resultsExporter.stop()
+            
         # and then quit after a second
-        self.startLineFrame.after(1000,self.startLineFrame.master.quit)
+        self.tkRoot.after(1000,self.tkRoot.quit)
 
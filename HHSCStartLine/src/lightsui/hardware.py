@@ -6,14 +6,18 @@ Created on 26 Jan 2014
 import logging
 import Queue
 import datetime
-import time
+from collections import deque
 
 import serial
 from model.utils import Signal
+from model.clock import monotonicSeconds, Waker
 
-# constants for lights state
-LIGHT_OFF = 0
-LIGHT_ON = 1
+#
+# The relays are set with a bitmask, where bit 0 is relay 1, bit 1 relay 2 and so on. This is the
+# byte the EasyDaq takes, so we build the packet for each bitmask once.
+#
+RELAY_COMMAND_PACKETS = tuple('C' + chr(relays) for relays in range(256))
+RELAY_CONFIGURATION_PACKETS = tuple('B' + chr(relays) for relays in range(256))
 
 # constants for serial port session state
 DISCONNECTED = 0
@@ -29,8 +33,34 @@ managing itself.
 from the rest of the application. This means that the relay changes from an asynchronous model running on the Tk event loop to 
 a synchronous model. The performance overhead is not an issue for this application. The interface to the relay becomes
 a queue of command objects to change the state of the relay.  
+
+A relay command sets the state of every relay, so a relay command waiting on the queue is superseded by any later one.
+When commands back up behind the pacing of packets to the EasyDaq, e.g. while flashing, we take everything waiting on the
+queue and only send the newest relay command, so that the lights show the current state rather than working through
+a backlog of old ones.
+
+The relay thread never sleeps. Everything it has to wait for is a deadline: the pacing between packets, the EasyDaq
+settling after we open the serial port, the heartbeat and its reply, and the backoff before we reconnect. The thread
+waits on the command queue until the next deadline, so a command is handled as soon as it arrives, and then does
+whatever is due. Reads from the serial port don't block; we read the reply to a heartbeat when it is due.
+
+Packets are written one per pacing interval, in order of priority: relay configuration, then the latest relay command,
+then a heartbeat. A light change therefore goes out within one pacing interval of arriving, even during a heartbeat or
+a reconnect.
 '''
 class EasyDaqUSBRelay:
+    
+    # the least time between two packets to the EasyDaq
+    packetIntervalSeconds = 0.1
+    # the time the EasyDaq needs after we open the serial port before we establish the session
+    connectSettleSeconds = 2
+    # we send a heartbeat if we haven't sent a packet for this long
+    heartbeatIntervalSeconds = 5
+    # the time we give the EasyDaq to reply to a heartbeat
+    heartbeatReplySeconds = 0.5
+    # the delay before we try to reconnect, which doubles after each failure up to the maximum
+    minReconnectSeconds = 0.5
+    maxReconnectSeconds = 5
 
     def __init__(self, serialPortName):
         # capture the name of the serial port. On windows, this will be COM3, COM4 etc. The COM port is set
@@ -41,6 +71,8 @@ class EasyDaqUSBRelay:
         # we use a python queue as our command interface, both internally and externally
         #
         self.commandQueue = Queue.Queue()
+        # wakes the relay thread when a command is queued
+        self.waker = Waker()
         
         #
         # we use a python queue as our session state description output mechanism. This insulates the GUI from the threading
@@ -56,8 +88,8 @@ class EasyDaqUSBRelay:
         #
         # we create our serial port connection now. We don't open the connection until we are asked to connect
         #
-        # timeout is set to 0.5 second for reads. 
-        self.serialConnection = serial.Serial(timeout=0.5)
+        # timeout is set to 0 so that reads return straight away with whatever has arrived
+        self.serialConnection = serial.Serial(timeout=0)
         
         # and tell the serial connection which serial port to connect
         self.serialConnection.port = self.serialPortName      
@@ -74,9 +106,9 @@ class EasyDaqUSBRelay:
         
                 
         #
-        # track the time of the last command. We default to now as the startup time
+        # track the time of the last packet, in monotonic seconds. We haven't written one yet.
         #
-        self.lastPacketTime = datetime.datetime.now()
+        self.lastPacketSeconds = None
         
         #
         # trace the previous relay command. This enables us to resend in the event of a disconnect
@@ -84,10 +116,33 @@ class EasyDaqUSBRelay:
         self.currentRelayCommand = None
         self.previousRelayCommand = None
         
+        #
+        # the packets waiting to be written: relay configurations, the latest relay command and a heartbeat
+        #
+        self.pendingConfigurationPackets = deque()
+        self.pendingRelayCommand = None
+        self.isHeartbeatPending = False
+        
+        #
+        # our deadlines, in monotonic seconds, or None if we aren't waiting for them
+        #
+        self.establishSessionAt = None
+        self.heartbeatReplyBy = None
+        self.reconnectAt = None
+        self.reconnectDelaySeconds = self.minReconnectSeconds
+        
         #
         # We track our session status through constants DISCONNECTED,RECONNECTING,CONNECTED
         #
         self.sessionState = DISCONNECTED
+        
+        #
+        # metrics for the command queue: the number of commands we have executed, the number of superseded
+        # relay commands we have dropped, and the most commands we have found waiting at once
+        #
+        self.executedCommandCount = 0
+        self.droppedCommandCount = 0
+        self.maxQueueDepth = 0
             
     def setSessionState(self,state):
         self.sessionState = state
@@ -129,35 +184,23 @@ class EasyDaqUSBRelay:
         self.lastCommandProcessedTime = datetime.datetime.now()
         
     def maintainSession(self):
-     
+        '''
+        Queue a request for the EasyDaq to output its status. We read the reply when it is due.
+        '''
         if self.isConnected():
             logging.debug("Maintaining session")
-            
-            
-            try:
-                
-                # create a relay packet that requests the EasyDaq to output its status
-                self.currentRelayPacket = 'A' + chr(0)
-                # and queue a request
-                self.queuePacketToEasyDaq()
-                
-                # sleep for half a second
-                time.sleep(0.5)
-                # and read
-                self.readSession()
-                
-            except (serial.SerialException):
-                logging.exception("Exception writing read request to session")
-                self.beNotConnected()
-                self.reconnect()
+            self.isHeartbeatPending = True
         
     
     def readSession(self):
         logging.debug("Reading from session")
         try:
-            # read a single byte. This should be our current status but at the moment we don't check for that
+            # read a single byte, if it has arrived. This should be our current status but at the moment we don't check for that
             x = self.serialConnection.read()
-            logging.debug("Read from session")
+            if x:
+                logging.debug("Read from session")
+            else:
+                logging.debug("No reply from session")
             
         except (serial.SerialException, ValueError) as e:
             logging.error("I/O error: {0}".format(e))
@@ -168,23 +211,21 @@ class EasyDaqUSBRelay:
     
     def establishSession(self):
         logging.debug("Establishing session in state: %s" % self.sessionStateDescription() )
-        self.sendRelayConfiguration([0,0,0,0,0])
-        
-        previousState = self.sessionState
+        self._sendRelayConfiguration(0)
         
         # and be connected
         self.beConnected()
-        
-        if previousState == RECONNECTING:
-                
-            if self.currentRelayCommand:
-                logging.info("Recovering ... sending current relay command: %s" % self.printableCommand(self.currentRelayCommand))
-                self.currentRelayPacket = self.currentRelayCommand
-                self.queuePacketToEasyDaq()
-            elif self.previousRelayCommand:
-                logging.info("Recovering ... sending previous relay command: %s" % self.printableCommand(self.previousRelayCommand))
-                self.currentRelayPacket = self.previousRelayCommand
-                self.queuePacketToEasyDaq()
+        self.reconnectDelaySeconds = self.minReconnectSeconds
+        
+        # send the lights we were asked for while we weren't connected: after a reconnect, or while the
+        # EasyDaq settled after we first connected. The lights are only sent when they change, so
+        # nothing else will correct them.
+        if self.currentRelayCommand:
+            logging.info("Establishing session ... sending current relay command: %s" % self.printableCommand(self.currentRelayCommand))
+            self.pendingRelayCommand = self.currentRelayCommand
+        elif self.previousRelayCommand:
+            logging.info("Establishing session ... sending previous relay command: %s" % self.printableCommand(self.previousRelayCommand))
+            self.pendingRelayCommand = self.previousRelayCommand
         
     
     def _connect(self):
@@ -192,7 +233,7 @@ class EasyDaqUSBRelay:
         # connected
         if not self.isConnected():
             logging.debug("Connecting to serial port")
-            self.enabled = True
+            self.isEnabled = True
             try:
                 # try to open the serial port
                 if self.serialConnection.isOpen():
@@ -200,9 +241,9 @@ class EasyDaqUSBRelay:
                 else:
                     self.serialConnection.open()
                     logging.debug("Connected to serial port")
-                # wait for a second and establish the session
-                time.sleep(2)
-                self.establishSession()
+                # give the EasyDaq time to settle, then establish the session
+                if self.establishSessionAt is None:
+                    self.establishSessionAt = monotonicSeconds() + self.connectSettleSeconds
             
             except (serial.SerialException,ValueError) as e:           
                 logging.error("I/O error: {0}".format(e))
@@ -214,49 +255,84 @@ class EasyDaqUSBRelay:
             
     
     def reconnect(self):
-        logging.info("Reconnecting to serial port")
-        # sleep for 5 seconds
-        time.sleep(5)
-        # connect
-        self._connect()
+        '''
+        Schedule an attempt to reconnect. We back off, doubling the delay after each failure.
+        '''
+        logging.info("Reconnecting to serial port in %.1f seconds" % self.reconnectDelaySeconds)
+        self.establishSessionAt = None
+        self.heartbeatReplyBy = None
+        self.isHeartbeatPending = False
+        self.reconnectAt = monotonicSeconds() + self.reconnectDelaySeconds
+        self.reconnectDelaySeconds = min(self.reconnectDelaySeconds * 2, self.maxReconnectSeconds)
         
         
     def connect(self):
-        self.commandQueue.put(EasyDaqUSBConnect())
+        self.queueCommand(EasyDaqUSBConnect())
         
 
     
     def disconnect(self):
-        self.enabled = False
-        if self.isConnected:
+        self.isEnabled = False
+        self.establishSessionAt = None
+        self.heartbeatReplyBy = None
+        self.reconnectAt = None
+        if self.isConnected():
             self.serialConnection.close()
             self.beNotConnected()
         
-    def timeSinceLastPacket(self):
+    def nextPacketSeconds(self):
         '''
-        calculate the time since the last command
+        When we can next write a packet, given the pacing between packets
         '''
-        deltaSinceLastPacket = datetime.datetime.now() - self.lastPacketTime
-        
-        return int((deltaSinceLastPacket.microseconds/1000) + deltaSinceLastPacket.seconds*1000)
+        if self.lastPacketSeconds is None:
+            return 0
+        return self.lastPacketSeconds + self.packetIntervalSeconds
+    
+    def heartbeatDueSeconds(self):
+        if self.lastPacketSeconds is None:
+            return 0
+        return self.lastPacketSeconds + self.heartbeatIntervalSeconds
     
+    def hasPendingPacket(self):
+        return bool(self.pendingConfigurationPackets or self.pendingRelayCommand or self.isHeartbeatPending)
     
-    def writePacketToEasyDaq(self):
+    def hasPendingRelayPacket(self):
+        return self.isConnected() and bool(self.pendingConfigurationPackets or self.pendingRelayCommand)
+    
+    def takePendingPacket(self):
+        '''
+        Take the packet to write next: a relay configuration, then the latest relay command, then a heartbeat
+        '''
+        if self.pendingConfigurationPackets:
+            return self.pendingConfigurationPackets.popleft()
+        if self.pendingRelayCommand:
+            packet = self.pendingRelayCommand
+            self.pendingRelayCommand = None
+            return packet
+        self.isHeartbeatPending = False
+        # create a relay packet that requests the EasyDaq to output its status
+        return 'A' + chr(0)
+    
+    def writePacketToEasyDaq(self,packet):
         # if we are connected, we write our packet
         try:
-            logging.debug("Writing to serial port: %s" % self.printableCommand(self.currentRelayPacket))
-            self.serialConnection.write(self.currentRelayPacket)
+            logging.debug("Writing to serial port: %s" % self.printableCommand(packet))
+            self.serialConnection.write(packet)
             
             #
             # Not the most elegant, but we check to see if this packet is a command by looking for a C as the first byte of the packet
             #
-            if self.currentRelayPacket[0] =='C':
+            if packet[0] =='C':
                 
-                self.previousRelayCommand = self.currentRelayCommand
-                self.currentRelayCommand = None
+                self.previousRelayCommand = packet
+                if packet == self.currentRelayCommand:
+                    self.currentRelayCommand = None
+            elif packet[0] == 'A':
+                # we read the reply when the EasyDaq has had time to send it
+                self.heartbeatReplyBy = monotonicSeconds() + self.heartbeatReplySeconds
 
             
-            self.lastPacketTime = datetime.datetime.now()
+            self.lastPacketSeconds = monotonicSeconds()
         except (serial.SerialException,ValueError) as e:
             logging.error("I/O error: {0}".format(e))
             self.serialConnection.close()
@@ -267,103 +343,163 @@ class EasyDaqUSBRelay:
     def printableCommand(self,relayCommand):
         return relayCommand[0] + "," + str(ord(relayCommand[1]))
     
-    def queuePacketToEasyDaq(self):
+    def writeDuePacket(self):
         '''
-        Write a command to EasyDaq. If we have written a command within the last 100 milliseconds,
-        then delay by 100 milliseconds, otherwise write the command now.
+        Write the next packet to EasyDaq, if we have one and at least 100 milliseconds have passed since the last packet.
         '''
-        # easy scenario is that we can write the command immediately
-        
-        
-        # if time delta is at least 100 milliseconds
-        
-        if (self.timeSinceLastPacket() > 100):
-            # we can write the command now.
-            self.writePacketToEasyDaq()
-                
-        else:
-            # and queue to be written in 100 milliseconds
-            logging.debug("Queuing writing packet to easyDaq")
-            time.sleep((100-self.timeSinceLastPacket())/1000)
-            self.writePacketToEasyDaq()
+        if self.isConnected() and self.hasPendingPacket() and monotonicSeconds() >= self.nextPacketSeconds():
+            self.writePacketToEasyDaq(self.takePendingPacket())
+    
+    #
+    # Do whatever is due: reconnect, establish the session, read the reply to a heartbeat,
+    # send a heartbeat and write the next packet
+    #
+    def runDueTimers(self):
+        now = monotonicSeconds()
+        if self.reconnectAt is not None and now >= self.reconnectAt:
+            self.reconnectAt = None
+            self._connect()
+        if self.establishSessionAt is not None and now >= self.establishSessionAt:
+            self.establishSessionAt = None
+            self.establishSession()
+        if self.isConnected():
+            if self.heartbeatReplyBy is not None and now >= self.heartbeatReplyBy:
+                self.heartbeatReplyBy = None
+                self.readSession()
+            if now >= self.heartbeatDueSeconds() and not self.hasPendingPacket() and self.heartbeatReplyBy is None:
+                self.maintainSession()
+            self.writeDuePacket()
+    
+    #
+    # The seconds until our next deadline. This is how long we wait for a command.
+    #
+    def secondsUntilNextDeadline(self):
+        deadlines = [deadline for deadline in [self.reconnectAt,self.establishSessionAt] if deadline is not None]
+        if self.isConnected():
+            if self.hasPendingPacket():
+                deadlines.append(self.nextPacketSeconds())
+            if self.heartbeatReplyBy is not None:
+                deadlines.append(self.heartbeatReplyBy)
+            deadlines.append(self.heartbeatDueSeconds())
+        if not deadlines:
+            return self.heartbeatIntervalSeconds
+        return max(0,min(deadlines) - monotonicSeconds())
 
 
     #
     # This forms part of the external interface that will be invoked in a different thread.
     # Encapsulate in an object and put on a queue for execution.
     #
-    def sendRelayConfiguration(self,relayArray):
+    def sendRelayConfiguration(self,relays):
         
         
-        self.commandQueue.put(EasyDaqUSBSendRelayConfiguration(relayArray))
+        self.queueCommand(EasyDaqUSBSendRelayConfiguration(relays))
      
 
     #
     # This forms part of the external interface that will be invoked in a different thread.
     # Encapsulate in an object and put on a queue for execution.
     #
-    def sendRelayCommand(self,relayArray):
+    # The relays are a bitmask.
+    #
+    def sendRelayCommand(self,relays):
      
         
-        self.commandQueue.put(EasyDaqUSBSendRelayCommand(relayArray))
-    
-    def _sendRelayCommand(self,relayArray):
-        # turn the values in the list into a byte where the bit in the byte reflects the position in the list.
-        
-        commandValue = 0
-        
-        for i in range(len(relayArray)):
-                bitValue = (relayArray[i] *  pow(2,i))
-                commandValue = commandValue + bitValue
+        self.queueCommand(EasyDaqUSBSendRelayCommand(relays))
         
-        logging.debug("Sending C + %i" % commandValue)
-        relayCommand = 'C' + chr(commandValue)
+    #
+    # Put a command on the command queue and wake the relay thread to execute it
+    #
+    def queueCommand(self,command):
+        self.commandQueue.put(command)
+        self.waker.wake()
+    
+    def _sendRelayCommand(self,relays):
+        logging.debug("Sending C + %i" % relays)
+        relayCommand = RELAY_COMMAND_PACKETS[relays]
         self.currentRelayCommand = relayCommand
         
-        self.currentRelayPacket = relayCommand
-        # if we are connected, we queue the packet. If we are not connected,
-        # the session recovery will play in the relay packet
+        # if we are connected, the command is written when the pacing allows, replacing any command still waiting.
+        # If we are not connected, the session recovery will play in the relay packet
         if self.isConnected():
-            self.queuePacketToEasyDaq()
+            if self.pendingRelayCommand is not None:
+                self.droppedCommandCount = self.droppedCommandCount + 1
+            self.pendingRelayCommand = relayCommand
 
        
-    def _sendRelayConfiguration(self,relayArray):
-        # turn the values in the list into a byte where the bit in the byte reflects the position in the list.
-        
-        commandValue = 0
-        
-        for i in range(len(relayArray)):
-                bitValue = (relayArray[i] *  pow(2,i))
-                commandValue = commandValue + bitValue
-        
-        logging.debug("Sending B + %i" % commandValue)        
-        self.currentRelayPacket = 'B' + chr(commandValue)
-        
-        self.queuePacketToEasyDaq()
+    def _sendRelayConfiguration(self,relays):
+        logging.debug("Sending B + %i" % relays)        
+        self.pendingConfigurationPackets.append(RELAY_CONFIGURATION_PACKETS[relays])
         
     
+    #
+    # The number of commands waiting on the command queue
+    #
+    def queueDepth(self):
+        return self.commandQueue.qsize()
+    
+    #
+    # Take the commands waiting on the command queue, without waiting for more
+    #
+    def takeQueuedCommands(self):
+        commands = []
+        while True:
+            try:
+                commands.append(self.commandQueue.get(block=False))
+            except Queue.Empty:
+                return commands
+    
+    #
+    # Drop the relay commands that are superseded by a later relay command. The other commands
+    # are kept, in order.
+    #
+    def coalesceCommands(self,commands):
+        newestRelayCommand = None
+        for command in commands:
+            if isinstance(command,EasyDaqUSBSendRelayCommand):
+                newestRelayCommand = command
+        coalescedCommands = [command for command in commands
+                             if command is newestRelayCommand or not isinstance(command,EasyDaqUSBSendRelayCommand)]
+        droppedCount = len(commands) - len(coalescedCommands)
+        if droppedCount:
+            logging.debug("Dropped %d superseded relay commands" % droppedCount)
+            self.droppedCommandCount = self.droppedCommandCount + droppedCount
+        return coalescedCommands
+    
     #
     # run is effectively the main method for the EasyDaqRelay
     #
     def run(self):
         self.isRunning = True
         self._connect()
-        while self.isRunning:
+        # when we are stopped, we carry on until we have written the last relay command, e.g. lights off
+        while self.isRunning or self.hasPendingRelayPacket():
             
-            # get the next command from the command queue. If we don't get a command after five seconds
-            # maintain our session
-            try:
+            # do whatever is due, then wait for the next command until our next deadline
+            self.runDueTimers()
+            if not self.isRunning and not self.hasPendingRelayPacket():
+                # we have written the last relay command after being stopped
+                break
+            commands = self.takeQueuedCommands()
+            if not commands:
                 logging.debug("Waiting for next command on command queue.")
-                nextCommand = self.commandQueue.get(timeout=5)
-                logging.debug("Return from command queue")
-                nextCommand.executeOn(self)
-            except Queue.Empty:
-                logging.debug("Timeout on command queue. Maintaining session.")
-                self.maintainSession()
+                self.waker.wait(self.secondsUntilNextDeadline())
+                commands = self.takeQueuedCommands()
+                if not commands:
+                    continue
+            
+            # everything that has backed up is executed together
+            self.maxQueueDepth = max(self.maxQueueDepth,len(commands))
+            for command in self.coalesceCommands(commands):
+                command.executeOn(self)
+                self.executedCommandCount = self.executedCommandCount + 1
+        logging.info("Relay executed %d commands, dropped %d superseded relay commands, max queue depth %d" %
+                     (self.executedCommandCount,self.droppedCommandCount,self.maxQueueDepth))
         self.disconnect()
+        self.waker.close()
     
     def stop(self):
-        self.commandQueue.put(EasyDaqUSBStop())
+        self.queueCommand(EasyDaqUSBStop())
      
                 
 #
@@ -388,17 +524,17 @@ class EasyDaqUSBStop(EasyDaqUSBCommand):
         aRelay.isRunning = False        
 
 class EasyDaqUSBSendRelayCommand(EasyDaqUSBCommand):
-    def __init__(self,relayArray):
-        self.relayArray = relayArray
+    def __init__(self,relays):
+        self.relays = relays
     
     def executeOn(self,aRelay):
-        aRelay._sendRelayCommand(self.relayArray)
+        aRelay._sendRelayCommand(self.relays)
         
         
 class EasyDaqUSBSendRelayConfiguration(EasyDaqUSBCommand):
-    def __init__(self,relayArray):
-        self.relayArray = relayArray
+    def __init__(self,relays):
+        self.relays = relays
     
     def executeOn(self,aRelay):
-        aRelay._sendRelayConfiguration(self.relayArray)
+        aRelay._sendRelayConfiguration(self.relays)
                 
\ No newline at end of file
@@ -0,0 +1,324 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The EasyDaq simulator stands in for an EasyDaq USB relay card, so that we can measure and
+# soak test the relay without hardware. It is the Python equivalent of the Arduino sketch in
+# tools/easy_daq_relay_simulator.ino, and needs Linux (or another system with ptys).
+#
+# The simulator opens a pseudo-terminal and links its port name to the pty, so that an
+# EasyDaqUSBRelay opens the port name as if it was the card's serial port. It speaks the
+# EasyDaq protocol of two byte packets:
+#
+#   'B', X - configure the direction of each relay
+#   'C', X - latch relay state X
+#   'A', X - read the relay state. The card replies with one byte, the latched state.
+#
+# The simulator records the time of every relay state it latches, in monotonic seconds, and
+# can inject faults: disconnecting (the port disappears, as if the USB cable was pulled) and
+# responding slowly.
+#
+# A latency probe records the time each relay command was sent to an EasyDaqUSBRelay, and
+# latencyReport matches the commands to the states latched by the simulator, to give the end
+# to end latency of a light change.
+#
+# To soak test the relay, run from the src directory:
+#
+#   python -m lightsui.simulator [seconds]
+#
+
+import errno
+import logging
+import os
+import pty
+import random
+import select
+import sys
+import tempfile
+import threading
+import tty
+from bisect import bisect_left
+from collections import namedtuple
+
+from model.clock import monotonicSeconds
+
+LatchedState = namedtuple("LatchedState", ["seconds", "value"])
+
+LatencyReport = namedtuple("LatencyReport", ["requests", "latched", "superseded", "missed",
+                                             "minimumSeconds", "meanSeconds", "p95Seconds", "maximumSeconds"])
+
+
+class EasyDaqSimulator(object):
+
+    # the time the card takes to act on a packet. Set it to inject slow responses.
+    responseDelaySeconds = 0
+
+    def __init__(self, portName=None):
+        self.temporaryDirectory = None
+        if portName is None:
+            self.temporaryDirectory = tempfile.mkdtemp()
+            portName = os.path.join(self.temporaryDirectory, "easydaq")
+        self.portName = portName
+        self.masterFd = None
+        self.slaveFd = None
+        # bytes read that don't yet make a whole packet
+        self.received = ""
+        # the packets read but not yet acted on, as (due seconds, command, value)
+        self.pendingPackets = []
+        # the replies waiting to be written
+        self.pendingReply = ""
+        self.reconnectAt = None
+        self.isRunning = False
+        # held while we use the pty, so that a disconnect doesn't close it underneath us
+        self.portLock = threading.RLock()
+
+        self.directions = None
+        self.latchedValue = 0
+        self.latchedStates = []
+        self.configurationCount = 0
+        self.readCount = 0
+        self.disconnectCount = 0
+
+    #
+    # Open a new pty and point our port name at it
+    #
+    def openPort(self):
+        (self.masterFd, self.slaveFd) = pty.openpty()
+        # a serial port doesn't echo or edit lines. We keep the slave end open ourselves so
+        # that reading the master doesn't fail while the relay has the port closed.
+        tty.setraw(self.slaveFd)
+        if os.path.lexists(self.portName):
+            os.remove(self.portName)
+        os.symlink(os.ttyname(self.slaveFd), self.portName)
+        self.received = ""
+        self.pendingReply = ""
+        logging.info("EasyDaq simulator on %s (%s)" % (self.portName, os.ttyname(self.slaveFd)))
+
+    def closePort(self):
+        if os.path.lexists(self.portName):
+            os.remove(self.portName)
+        for fd in [self.masterFd, self.slaveFd]:
+            if fd is not None:
+                os.close(fd)
+        self.masterFd = None
+        self.slaveFd = None
+
+    def isConnected(self):
+        return self.masterFd is not None
+
+    #
+    # Inject a disconnect: the port disappears, as if the USB cable was pulled, and comes back
+    # after a number of seconds, or when we are asked to reconnect
+    #
+    def disconnect(self, seconds=None):
+        logging.info("EasyDaq simulator disconnecting")
+        self.portLock.acquire()
+        try:
+            self.disconnectCount = self.disconnectCount + 1
+            self.closePort()
+            self.pendingPackets = []
+            if seconds is not None:
+                self.reconnectAt = monotonicSeconds() + seconds
+        finally:
+            self.portLock.release()
+
+    def reconnect(self):
+        self.portLock.acquire()
+        try:
+            self.reconnectAt = None
+            if not self.isConnected():
+                self.openPort()
+        finally:
+            self.portLock.release()
+
+    def start(self):
+        self.openPort()
+        self.isRunning = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.isRunning = False
+        self.thread.join(2)
+        self.closePort()
+        if self.temporaryDirectory:
+            os.rmdir(self.temporaryDirectory)
+
+    #
+    # This method gets called in its own thread
+    #
+    def run(self):
+        while self.isRunning:
+            self.portLock.acquire()
+            try:
+                self.runOnce(0.05)
+            finally:
+                self.portLock.release()
+
+    def runOnce(self, maxWaitSeconds):
+        now = monotonicSeconds()
+        if self.reconnectAt is not None and now >= self.reconnectAt:
+            self.reconnect()
+        if not self.isConnected():
+            self.portLock.release()
+            try:
+                select.select([], [], [], maxWaitSeconds)
+            finally:
+                self.portLock.acquire()
+            return
+
+        waitSeconds = maxWaitSeconds
+        if self.pendingPackets:
+            waitSeconds = max(0, min(waitSeconds, self.pendingPackets[0][0] - now))
+        writers = []
+        if self.pendingReply:
+            writers = [self.masterFd]
+        (readable, writable, errors) = select.select([self.masterFd], writers, [], waitSeconds)
+        try:
+            if readable:
+                self.receive(os.read(self.masterFd, 1024))
+            if writable:
+                written = os.write(self.masterFd, self.pendingReply)
+                self.pendingReply = self.pendingReply[written:]
+        except OSError as e:
+            if e.errno != errno.EIO:
+                raise
+        self.actOnDuePackets()
+
+    def receive(self, data):
+        self.received = self.received + data
+        now = monotonicSeconds()
+        while len(self.received) >= 2:
+            (command, value) = (self.received[0], ord(self.received[1]))
+            if command in "ABC":
+                self.pendingPackets.append((now + self.responseDelaySeconds, command, value))
+                self.received = self.received[2:]
+            else:
+                # out of step, e.g. after a disconnect part way through a packet
+                self.received = self.received[1:]
+
+    def actOnDuePackets(self):
+        now = monotonicSeconds()
+        while self.pendingPackets and self.pendingPackets[0][0] <= now:
+            (dueSeconds, command, value) = self.pendingPackets.pop(0)
+            self.actOnPacket(command, value, now)
+
+    def actOnPacket(self, command, value, now):
+        if command == 'B':
+            self.directions = value
+            self.configurationCount = self.configurationCount + 1
+        elif command == 'C':
+            self.latchedValue = value
+            self.latchedStates.append(LatchedState(now, value))
+        elif command == 'A':
+            self.readCount = self.readCount + 1
+            self.pendingReply = self.pendingReply + chr(self.latchedValue)
+
+
+#
+# Record when each relay command is sent to an EasyDaqUSBRelay
+#
+class LatencyProbe(object):
+
+    def __init__(self, easyDaqRelay):
+        self.requests = []
+        self.sendRelayCommandToRelay = easyDaqRelay.sendRelayCommand
+        easyDaqRelay.sendRelayCommand = self.sendRelayCommand
+
+    def sendRelayCommand(self, relays):
+        self.requests.append((monotonicSeconds(), relays))
+        self.sendRelayCommandToRelay(relays)
+
+
+#
+# Match each request to the first latch of its state after it was made. A request whose state
+# isn't latched before the next request was superseded; the last request may have been missed.
+#
+def latencyReport(requests, latchedStates):
+    latchSeconds = [latchedState.seconds for latchedState in latchedStates]
+    latencies = []
+    superseded = 0
+    missed = 0
+    for index, (requestSeconds, value) in enumerate(requests):
+        if index + 1 < len(requests):
+            nextRequestSeconds = requests[index + 1][0]
+        else:
+            nextRequestSeconds = None
+        latchIndex = bisect_left(latchSeconds, requestSeconds)
+        latency = None
+        while latchIndex < len(latchedStates):
+            latchedState = latchedStates[latchIndex]
+            if nextRequestSeconds is not None and latchedState.seconds >= nextRequestSeconds:
+                break
+            if latchedState.value == value:
+                latency = latchedState.seconds - requestSeconds
+                break
+            latchIndex = latchIndex + 1
+        if latency is not None:
+            latencies.append(latency)
+        elif nextRequestSeconds is not None:
+            superseded = superseded + 1
+        else:
+            missed = missed + 1
+
+    if not latencies:
+        return LatencyReport(len(requests), 0, superseded, missed, None, None, None, None)
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return LatencyReport(len(requests), len(latencies), superseded, missed,
+                         latencies[0], sum(latencies) / len(latencies), p95, latencies[-1])
+
+
+#
+# Soak test an EasyDaqUSBRelay against the simulator: flash the lights twice a second, change
+# them at random, and pull the cable now and then
+#
+def soak(seconds):
+    from lightsui.hardware import EasyDaqUSBRelay
+
+    simulator = EasyDaqSimulator()
+    simulator.start()
+    easyDaqRelay = EasyDaqUSBRelay(simulator.portName)
+    probe = LatencyProbe(easyDaqRelay)
+    relayThread = threading.Thread(target=easyDaqRelay.run)
+    relayThread.daemon = True
+    relayThread.start()
+
+    endSeconds = monotonicSeconds() + seconds
+    nextDisconnectSeconds = monotonicSeconds() + 20
+    flash = 0
+    while monotonicSeconds() < endSeconds:
+        select.select([], [], [], 0.5)
+        flash = 1 - flash
+        easyDaqRelay.sendRelayCommand(flash | (random.randint(0, 15) << 1))
+        if monotonicSeconds() >= nextDisconnectSeconds:
+            simulator.disconnect(2)
+            nextDisconnectSeconds = monotonicSeconds() + 20
+
+    easyDaqRelay.stop()
+    relayThread.join(5)
+    simulator.stop()
+
+    report = latencyReport(probe.requests, simulator.latchedStates)
+    sys.stdout.write("%d requests, %d latched, %d superseded, %d missed\n" %
+                     (report.requests, report.latched, report.superseded, report.missed))
+    if report.latched:
+        sys.stdout.write("latency min %.1f ms, mean %.1f ms, p95 %.1f ms, max %.1f ms\n" %
+                         (report.minimumSeconds * 1000, report.meanSeconds * 1000,
+                          report.p95Seconds * 1000, report.maximumSeconds * 1000))
+    sys.stdout.write("%d disconnects, %d heartbeats, %d dropped relay commands, max queue depth %d\n" %
+                     (simulator.disconnectCount, simulator.readCount, easyDaqRelay.droppedCommandCount,
+                      easyDaqRelay.maxQueueDepth))
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        soak(float(sys.argv[1]))
+    else:
+        soak(60)
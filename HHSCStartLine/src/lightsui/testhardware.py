@@ -0,0 +1,111 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import sys
+import types
+
+from model.clock import monotonicSeconds
+
+#
+# The relay only needs pyserial to open the port, and we replace its serial connection
+# below, so we stub pyserial out if it isn't installed
+#
+try:
+    import serial
+except ImportError:
+    serial = types.ModuleType("serial")
+    serial.SerialException = type("SerialException", (IOError,), {})
+    serial.Serial = lambda timeout=None: FakeSerialConnection()
+    sys.modules['serial'] = serial
+
+from lightsui.hardware import EasyDaqUSBRelay, EasyDaqUSBConnect, EasyDaqUSBStop, \
+    EasyDaqUSBSendRelayCommand
+
+#
+# A serial connection that records the packets written to it
+#
+class FakeSerialConnection(object):
+
+    def __init__(self):
+        self.isOpened = False
+        self.packets = []
+
+    def open(self):
+        self.isOpened = True
+
+    def close(self):
+        self.isOpened = False
+
+    def isOpen(self):
+        return self.isOpened
+
+    def read(self):
+        return ''
+
+    def write(self, packet):
+        self.packets.append(packet)
+
+
+class EasyDaqUSBRelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.relay = EasyDaqUSBRelay("COM3")
+        self.relay.serialConnection = FakeSerialConnection()
+        self.relay.packetIntervalSeconds = 0
+        self.relay.connectSettleSeconds = 0
+
+    def testRelayCommandDuringSettleIsSent(self):
+        self.relay.connectSettleSeconds = 60
+        self.relay._connect()
+        # the lights change while the EasyDaq settles
+        self.relay._sendRelayCommand(7)
+        self.relay.runDueTimers()
+        self.assertEqual(self.relay.serialConnection.packets, [])
+        self.relay.establishSessionAt = monotonicSeconds()
+        self.relay.runDueTimers()
+        self.relay.runDueTimers()
+        self.assertEqual(self.relay.serialConnection.packets, ['B\x00', 'C\x07'])
+
+    def testOverwrittenPendingRelayCommandIsCounted(self):
+        self.relay._connect()
+        self.relay.runDueTimers()
+        self.relay.runDueTimers()
+        # the next packet isn't due, so the first command is still waiting when the second replaces it
+        self.relay.packetIntervalSeconds = 60
+        self.relay._sendRelayCommand(1)
+        self.relay._sendRelayCommand(2)
+        self.assertEqual(self.relay.droppedCommandCount, 1)
+        self.assertEqual(self.relay.pendingRelayCommand, 'C\x02')
+
+    def testNewestRelayCommandWins(self):
+        commands = [EasyDaqUSBSendRelayCommand(1), EasyDaqUSBSendRelayCommand(2), EasyDaqUSBSendRelayCommand(3)]
+        self.assertEqual(self.relay.coalesceCommands(commands), commands[2:])
+        self.assertEqual(self.relay.droppedCommandCount, 2)
+
+    def testOtherCommandsKeepTheirOrder(self):
+        connect = EasyDaqUSBConnect()
+        stop = EasyDaqUSBStop()
+        first = EasyDaqUSBSendRelayCommand(1)
+        last = EasyDaqUSBSendRelayCommand(2)
+        self.assertEqual(self.relay.coalesceCommands([connect, first, stop, last]), [connect, stop, last])
+        self.assertEqual(self.relay.coalesceCommands([first, stop, connect]), [first, stop, connect])
+        self.assertEqual(self.relay.droppedCommandCount, 1)
+
+    def testRunSendsOnlyNewestOfBacklog(self):
+        # everything is waiting before the relay thread gets going
+        self.relay.connect()
+        for relays in [1, 2, 3]:
+            self.relay.sendRelayCommand(relays)
+        self.relay.stop()
+        self.relay.run()
+        self.assertEqual(self.relay.serialConnection.packets, ['B\x00', 'C\x03'])
+        self.assertEqual(self.relay.maxQueueDepth, 5)
+        self.assertEqual(self.relay.droppedCommandCount, 2)
+        self.assertEqual(self.relay.executedCommandCount, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import os
+import select
+import threading
+
+from model.clock import monotonicSeconds
+from lightsui.simulator import EasyDaqSimulator, LatchedState, latencyReport
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+class EasyDaqSimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = EasyDaqSimulator()
+        self.simulator.start()
+        self.port = self.openPort()
+
+    def tearDown(self):
+        if self.port is not None:
+            os.close(self.port)
+        self.simulator.stop()
+
+    def openPort(self):
+        return os.open(self.simulator.portName, os.O_RDWR | os.O_NOCTTY)
+
+    def waitFor(self, condition, seconds=2):
+        endSeconds = monotonicSeconds() + seconds
+        while not condition() and monotonicSeconds() < endSeconds:
+            select.select([], [], [], 0.01)
+        return condition()
+
+    def testLatchesRelayStates(self):
+        os.write(self.port, "B\x00C\x05C\x03")
+        self.assertTrue(self.waitFor(lambda: len(self.simulator.latchedStates) == 2))
+        self.assertEqual(self.simulator.directions, 0)
+        self.assertEqual([latchedState.value for latchedState in self.simulator.latchedStates], [5, 3])
+
+    def testReadRepliesWithLatchedState(self):
+        os.write(self.port, "C\x1fA\x00")
+        (readable, writable, errors) = select.select([self.port], [], [], 2)
+        self.assertTrue(readable)
+        self.assertEqual(os.read(self.port, 1), "\x1f")
+
+    def testSlowResponse(self):
+        self.simulator.responseDelaySeconds = 0.2
+        sentSeconds = monotonicSeconds()
+        os.write(self.port, "C\x01")
+        self.assertTrue(self.waitFor(lambda: self.simulator.latchedStates))
+        self.assertTrue(self.simulator.latchedStates[0].seconds - sentSeconds >= 0.2)
+
+    def testDisconnect(self):
+        self.simulator.disconnect(0.2)
+        self.assertFalse(os.path.exists(self.simulator.portName))
+        self.assertRaises(OSError, os.write, self.port, "C\x01")
+        os.close(self.port)
+        self.port = None
+        self.assertTrue(self.waitFor(lambda: os.path.exists(self.simulator.portName)))
+        self.port = self.openPort()
+        os.write(self.port, "C\x01")
+        self.assertTrue(self.waitFor(lambda: self.simulator.latchedStates))
+
+    @unittest.skipIf(serial is None, "needs pyserial")
+    def testRelayLatency(self):
+        from lightsui.hardware import EasyDaqUSBRelay
+        from lightsui.simulator import LatencyProbe
+        os.close(self.port)
+        self.port = None
+        easyDaqRelay = EasyDaqUSBRelay(self.simulator.portName)
+        easyDaqRelay.connectSettleSeconds = 0.1
+        probe = LatencyProbe(easyDaqRelay)
+        relayThread = threading.Thread(target=easyDaqRelay.run)
+        relayThread.daemon = True
+        relayThread.start()
+        self.assertTrue(self.waitFor(lambda: self.simulator.configurationCount))
+        for i in range(10):
+            easyDaqRelay.sendRelayCommand((i % 2) | 2)
+            select.select([], [], [], 0.15)
+        easyDaqRelay.stop()
+        relayThread.join(2)
+        report = latencyReport(probe.requests, self.simulator.latchedStates)
+        self.assertEqual(report.latched + report.superseded, 10)
+        self.assertTrue(report.maximumSeconds < 0.2)
+
+
+class LatencyReportTest(unittest.TestCase):
+
+    def testLatencies(self):
+        requests = [(1.0, 1), (2.0, 0), (2.05, 1), (3.0, 3)]
+        latchedStates = [LatchedState(1.01, 1), LatchedState(2.15, 1)]
+        report = latencyReport(requests, latchedStates)
+        # the second request was superseded before it was latched, and the last was missed
+        self.assertEqual((report.requests, report.latched, report.superseded, report.missed), (4, 2, 1, 1))
+        self.assertAlmostEqual(report.minimumSeconds, 0.01)
+        self.assertAlmostEqual(report.maximumSeconds, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
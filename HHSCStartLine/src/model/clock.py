@@ -0,0 +1,224 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# This module contains the clocks used by the model to ask "what time is it now?".
+#
+# The model never calls datetime.now() directly. Instead, the race manager and its
+# fleets ask their clock. A clock is any object with a now() method that returns the
+# current time as a naive datetime; there is no base class. This lets us swap the clock:
+#
+# WallClock - the computer's clock. This is the default and what we use on the water.
+#
+# MonotonicClock - anchored to the computer's clock at startup, then driven by a
+# monotonic counter. This is immune to the wall clock being changed under our feet, e.g.
+# by a time sync part way through a start sequence.
+#
+# SimulatedClock - a clock that only moves when asked. It also provides after and
+# after_cancel with the same signature as Tk, so it can stand in for the Tk root
+# in the controllers. A full start sequence with general recalls can then be run
+# in milliseconds for training, regression tests and benchmarks.
+#
+# The module also has the Waker, which the threads that work to deadlines wait on.
+#
+
+from datetime import datetime, timedelta
+import heapq
+import select
+import socket
+import sys
+import time
+
+
+#
+# Find the best monotonic seconds counter for this platform. Python 3 has time.monotonic.
+# On Python 2, time.clock is a monotonic high resolution counter on Windows, and on Linux
+# (e.g. the Raspberry Pi) we ask librt for CLOCK_MONOTONIC. As a last resort we fall back
+# to time.time.
+#
+def _findMonotonicSeconds():
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+
+    if sys.platform == "win32":
+        return time.clock
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        CLOCK_MONOTONIC = 1
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1", use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonicSeconds():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                raise OSError(ctypes.get_errno(), "clock_gettime failed")
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        # check that it works before we rely on it
+        monotonicSeconds()
+        return monotonicSeconds
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+monotonicSeconds = _findMonotonicSeconds()
+
+
+#
+# A pair of connected sockets. Python 2 only has socket.socketpair on POSIX, so on Windows we
+# connect two sockets over the loopback interface.
+#
+def _socketPair():
+    if hasattr(socket, "socketpair"):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sender.connect(listener.getsockname())
+        (receiver, address) = listener.accept()
+    finally:
+        listener.close()
+    return (receiver, sender)
+
+
+#
+# A thread waits on a Waker until its next deadline, and another thread wakes it early,
+# e.g. with a new, earlier deadline or a command to handle. On Python 2, Condition.wait and
+# Queue.get with a timeout poll, sleeping up to 50 milliseconds at a time, so a waiting thread
+# wakes twenty times a second and hears about a change up to 50 milliseconds late. The Waker
+# blocks in select on a socket instead, for the whole timeout, until it is woken.
+#
+# A wake before the wait isn't lost: the wait returns straight away.
+#
+class Waker(object):
+
+    def __init__(self):
+        (self.receiver, self.sender) = _socketPair()
+        self.receiver.setblocking(False)
+        self.sender.setblocking(False)
+
+    #
+    # Wait until we are woken, or for timeoutSeconds. None waits until we are woken.
+    #
+    def wait(self, timeoutSeconds=None):
+        if timeoutSeconds is not None:
+            timeoutSeconds = max(timeoutSeconds, 0)
+        (readable, writable, failed) = select.select([self.receiver], [], [], timeoutSeconds)
+        if readable:
+            self.clear()
+
+    def clear(self):
+        try:
+            while self.receiver.recv(1024):
+                pass
+        except socket.error:
+            pass
+
+    #
+    # Wake the waiting thread. This can be called from any thread.
+    #
+    def wake(self):
+        try:
+            self.sender.send("w")
+        except socket.error:
+            # the socket is full of wakes the waiting thread hasn't read yet
+            pass
+
+    def close(self):
+        self.receiver.close()
+        self.sender.close()
+
+
+class WallClock(object):
+
+    def now(self):
+        return datetime.now()
+
+
+class MonotonicClock(object):
+
+    def __init__(self):
+        # anchor the monotonic counter to the wall clock once, at startup
+        self.originTime = datetime.now()
+        self.originSeconds = monotonicSeconds()
+
+    def now(self):
+        return self.originTime + timedelta(seconds=monotonicSeconds() - self.originSeconds)
+
+
+class SimulatedClock(object):
+
+    def __init__(self, startTime=None):
+        if startTime is None:
+            startTime = datetime.now()
+        self.currentTime = startTime
+        # a heap of (dueTime, scheduleId, callback, args)
+        self.schedules = []
+        self.cancelledSchedules = set()
+        self.nextScheduleId = 1
+
+    def now(self):
+        return self.currentTime
+
+    #
+    # Schedule a callback in millis milliseconds of simulated time. Same signature as Tk after.
+    #
+    def after(self, millis, callback, *args):
+        scheduleId = self.nextScheduleId
+        self.nextScheduleId = self.nextScheduleId + 1
+        dueTime = self.currentTime + timedelta(milliseconds=millis)
+        heapq.heappush(self.schedules, (dueTime, scheduleId, callback, args))
+        return scheduleId
+
+    #
+    # Cancel a schedule. As with Tk, cancelling a schedule that has already run has no effect.
+    #
+    def after_cancel(self, scheduleId):
+        self.cancelledSchedules.add(scheduleId)
+
+    #
+    # The controllers call update_idletasks on the Tk root. There is nothing to do here.
+    #
+    def update_idletasks(self):
+        pass
+
+    #
+    # Move the clock forward by a number of seconds, running any schedules that fall due
+    # on the way, in time order. Callbacks see the clock at their due time.
+    #
+    def advance(self, seconds):
+        self.advanceTo(self.currentTime + timedelta(seconds=seconds))
+
+    def advanceTo(self, targetTime):
+        while self.schedules and self.schedules[0][0] <= targetTime:
+            (dueTime, scheduleId, callback, args) = heapq.heappop(self.schedules)
+            if scheduleId in self.cancelledSchedules:
+                self.cancelledSchedules.discard(scheduleId)
+                continue
+            self.currentTime = max(self.currentTime, dueTime)
+            callback(*args)
+        self.currentTime = max(self.currentTime, targetTime)
+
+    #
+    # Jump the clock to a time without running any schedules
+    #
+    def setNow(self, aTime):
+        self.currentTime = aTime
+
+
+#
+# The clock used by the model unless told otherwise
+#
+wallClock = WallClock()
@@ -0,0 +1,191 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The competitor registry holds the boats entered for a race or a series. It is loaded in
+# bulk from an entry list CSV file and indexed by sail number, class and fleet.
+#
+# Sail numbers are searched by prefix, so that a race officer typing "316" at the
+# finish line sees every boat whose sail number starts 316. The sail numbers are
+# kept in a sorted list and found by bisection. Each search remembers its range, so a
+# search that extends the previous prefix (the next keystroke) only bisects within the
+# previous matches.
+#
+# The entry list CSV has a header row. The columns are matched ignoring case, spaces and
+# underscores:
+#
+# SailNumber - required
+# Class - required
+# PY - optional Portsmouth Yardstick number
+# Fleet - optional name of the fleet the boat races in
+#
+
+import csv
+from bisect import bisect_left, insort
+
+from race import Boat
+
+#
+# the names we accept for each column in the entry list, after normalising
+#
+SAIL_NUMBER_COLUMNS = ["sailnumber", "sailno", "sail"]
+CLASS_COLUMNS = ["class", "boatclass"]
+PY_COLUMNS = ["py", "handicap"]
+FLEET_COLUMNS = ["fleet", "fleetname"]
+
+# sorts after every sail number
+PREFIX_END = "\xff"
+
+
+class CompetitorException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+#
+# Sail numbers are compared without spaces and ignoring case, e.g. "gbr 2345" is "GBR2345"
+#
+def normaliseSailNumber(sailNumber):
+    if isinstance(sailNumber, unicode):
+        sailNumber = sailNumber.encode("utf-8")
+    return str(sailNumber).replace(" ", "").upper()
+
+
+def normaliseName(name):
+    return name.strip().lower()
+
+
+class CompetitorRegistry(object):
+
+    def __init__(self, boats=()):
+        self.boats = []
+        self.boatsBySailNumber = {}
+        self.boatsByClass = {}
+        self.boatsByFleet = {}
+        # sorted list of (normalised sail number, registration number)
+        self.sailNumberKeys = []
+        self.boatsByRegistration = []
+        self.lastSearch = None
+
+        self.addBoats(boats)
+
+    #
+    # Add many boats, sorting the sail number index once
+    #
+    def addBoats(self, boats):
+        for boat in boats:
+            self.indexBoat(boat)
+            self.sailNumberKeys.append((normaliseSailNumber(boat.sailNumber), len(self.boatsByRegistration) - 1))
+        self.sailNumberKeys.sort()
+        self.lastSearch = None
+
+    def addBoat(self, boat):
+        self.indexBoat(boat)
+        insort(self.sailNumberKeys, (normaliseSailNumber(boat.sailNumber), len(self.boatsByRegistration) - 1))
+        self.lastSearch = None
+
+    def indexBoat(self, boat):
+        self.boats.append(boat)
+        self.boatsByRegistration.append(boat)
+        self.boatsBySailNumber.setdefault(normaliseSailNumber(boat.sailNumber), []).append(boat)
+        self.boatsByClass.setdefault(normaliseName(boat.boatClass), []).append(boat)
+        if boat.fleetName:
+            self.boatsByFleet.setdefault(normaliseName(boat.fleetName), []).append(boat)
+
+    def numberBoats(self):
+        return len(self.boats)
+
+    def boatsWithSailNumber(self, sailNumber):
+        return list(self.boatsBySailNumber.get(normaliseSailNumber(sailNumber), []))
+
+    def boatsInClass(self, boatClass):
+        return list(self.boatsByClass.get(normaliseName(boatClass), []))
+
+    def boatsInFleet(self, aFleet):
+        return list(self.boatsByFleet.get(normaliseName(aFleet.name), []))
+
+    #
+    # Find the boats whose sail number starts with a prefix, in sail number order.
+    # If a fleet is given, only boats in that fleet are returned.
+    #
+    def search(self, prefix, aFleet=None, limit=None):
+        prefix = normaliseSailNumber(prefix)
+
+        # narrow the previous search if this prefix extends it
+        (low, high) = (0, len(self.sailNumberKeys))
+        if self.lastSearch and prefix.startswith(self.lastSearch[0]):
+            (low, high) = self.lastSearch[1:]
+
+        # every sail number starting with the prefix sorts before the prefix followed by the
+        # highest byte, which can't appear in a sail number
+        start = bisect_left(self.sailNumberKeys, (prefix,), low, high)
+        end = bisect_left(self.sailNumberKeys, (prefix + PREFIX_END,), start, high)
+        self.lastSearch = (prefix, start, end)
+
+        matches = []
+        for (sailNumber, registration) in self.sailNumberKeys[start:end]:
+            boat = self.boatsByRegistration[registration]
+            if aFleet and normaliseName(boat.fleetName or "") != normaliseName(aFleet.name):
+                continue
+            matches.append(boat)
+            if limit and len(matches) >= limit:
+                break
+        return matches
+
+    #
+    # Load the boats from an entry list CSV file
+    #
+    @classmethod
+    def fromEntryListFile(cls, filename):
+        entryListFile = open(filename, "rb")
+        try:
+            return cls(readEntryList(entryListFile))
+        finally:
+            entryListFile.close()
+
+
+#
+# Read boats from the rows of an entry list CSV. Generates a Boat for each row.
+#
+def readEntryList(csvLines):
+    reader = csv.reader(csvLines)
+    try:
+        header = reader.next()
+    except StopIteration:
+        return
+
+    columns = [normaliseName(column).replace(" ", "").replace("_", "") for column in header]
+
+    def columnIndex(names, required):
+        for name in names:
+            if name in columns:
+                return columns.index(name)
+        if required:
+            raise CompetitorException("Entry list has no %s column" % names[0])
+        return None
+
+    sailNumberColumn = columnIndex(SAIL_NUMBER_COLUMNS, True)
+    classColumn = columnIndex(CLASS_COLUMNS, True)
+    pyColumn = columnIndex(PY_COLUMNS, False)
+    fleetColumn = columnIndex(FLEET_COLUMNS, False)
+
+    for row in reader:
+        if not row or not row[sailNumberColumn].strip():
+            continue
+        py = None
+        if pyColumn is not None and row[pyColumn].strip():
+            try:
+                py = int(row[pyColumn])
+            except ValueError:
+                raise CompetitorException("Entry list row %d has a PY of %s, which is not a whole number" %
+                                          (reader.line_num, row[pyColumn].strip()))
+        fleetName = None
+        if fleetColumn is not None and row[fleetColumn].strip():
+            fleetName = row[fleetColumn].strip()
+        yield Boat(row[sailNumberColumn].strip(), row[classColumn].strip(), py, fleetName)
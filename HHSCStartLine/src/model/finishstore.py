@@ -0,0 +1,225 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The finish store holds the race manager's finishes. It replaces a plain list so that the
+# questions the finish line asks most often stay cheap as the day goes on:
+#
+# - find a finish by id (constant time)
+# - iterate the finishes in finish time order
+# - iterate the finishes for a fleet
+# - find the next finish without a fleet after a given finish (bisection)
+# - add or remove a finish (bisection, moving only the finishes in one block)
+#
+# Each finish is given a sort key of (finishTime, sequence). The sequence is the order the
+# finish was added to the store, so finishes with the same time stay in the order they
+# were created.
+#
+# The store does not notice when a finish changes fleet. The race manager calls reindex
+# when it is told a finish has changed.
+#
+
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+
+#
+# A list of finishes kept sorted by their sort keys. The finishes are kept in blocks of at
+# most twice blockSize, so that adding or removing a finish only moves the finishes in its
+# block rather than every finish after it. We find the block by bisecting the last key of
+# each block, then the finish by bisecting the block.
+#
+class SortedFinishIndex(object):
+
+    # a block is split in two when it grows to twice this
+    blockSize = 256
+
+    def __init__(self):
+        # the sort keys and finishes of each block. Every key in a block is before every
+        # key in the next block.
+        self.keyBlocks = []
+        self.finishBlocks = []
+        # the last key in each block
+        self.maxKeys = []
+        self.length = 0
+
+    def add(self, key, finish):
+        self.length = self.length + 1
+        if not self.keyBlocks:
+            self.keyBlocks.append([key])
+            self.finishBlocks.append([finish])
+            self.maxKeys.append(key)
+            return
+        # the first block that ends after the key, or the last block if none does
+        blockIndex = min(bisect_left(self.maxKeys, key), len(self.maxKeys) - 1)
+        keys = self.keyBlocks[blockIndex]
+        finishes = self.finishBlocks[blockIndex]
+        index = bisect_right(keys, key)
+        keys.insert(index, key)
+        finishes.insert(index, finish)
+        self.maxKeys[blockIndex] = keys[-1]
+        if len(keys) >= 2 * self.blockSize:
+            self.splitBlock(blockIndex)
+
+    def splitBlock(self, blockIndex):
+        keys = self.keyBlocks[blockIndex]
+        finishes = self.finishBlocks[blockIndex]
+        self.keyBlocks[blockIndex:blockIndex + 1] = [keys[:self.blockSize], keys[self.blockSize:]]
+        self.finishBlocks[blockIndex:blockIndex + 1] = [finishes[:self.blockSize], finishes[self.blockSize:]]
+        self.maxKeys[blockIndex:blockIndex + 1] = [keys[self.blockSize - 1], keys[-1]]
+
+    def remove(self, key):
+        blockIndex = bisect_left(self.maxKeys, key)
+        if blockIndex == len(self.maxKeys):
+            return
+        keys = self.keyBlocks[blockIndex]
+        index = bisect_left(keys, key)
+        if keys[index] != key:
+            return
+        self.length = self.length - 1
+        del keys[index]
+        del self.finishBlocks[blockIndex][index]
+        if keys:
+            self.maxKeys[blockIndex] = keys[-1]
+        else:
+            del self.keyBlocks[blockIndex]
+            del self.finishBlocks[blockIndex]
+            del self.maxKeys[blockIndex]
+
+    #
+    # Return the first finish with a key after the given key, or None
+    #
+    def firstAfter(self, key):
+        blockIndex = bisect_right(self.maxKeys, key)
+        if blockIndex == len(self.maxKeys):
+            return None
+        return self.finishBlocks[blockIndex][bisect_right(self.keyBlocks[blockIndex], key)]
+
+    def __iter__(self):
+        return chain.from_iterable(self.finishBlocks)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index = index + self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("finish index out of range")
+        for finishes in self.finishBlocks:
+            if index < len(finishes):
+                return finishes[index]
+            index = index - len(finishes)
+
+
+class FinishStore(object):
+
+    def __init__(self, finishes=None):
+        self.finishesById = {}
+        self.sortKeysById = {}
+        # the fleet id each finish is indexed under, None for a finish without a fleet
+        self.indexedFleetIdsById = {}
+        self.allFinishes = SortedFinishIndex()
+        self.unassignedFinishes = SortedFinishIndex()
+        self.finishesByFleetId = {}
+        self.nextSequence = 0
+
+        if finishes:
+            for finish in finishes:
+                self.add(finish)
+
+    def add(self, finish):
+        sortKey = (finish.finishTime, self.nextSequence)
+        self.nextSequence = self.nextSequence + 1
+
+        self.finishesById[finish.finishId] = finish
+        self.sortKeysById[finish.finishId] = sortKey
+        self.allFinishes.add(sortKey, finish)
+        self.indexFleet(finish, sortKey)
+
+    def remove(self, finish):
+        sortKey = self.sortKeysById.pop(finish.finishId)
+        del self.finishesById[finish.finishId]
+        self.allFinishes.remove(sortKey)
+        self.unindexFleet(finish, sortKey)
+
+    #
+    # Update the fleet indexes for a finish whose fleet may have changed
+    #
+    def reindex(self, finish):
+        sortKey = self.sortKeysById[finish.finishId]
+        if self.indexedFleetIdsById[finish.finishId] != self.fleetIdForFinish(finish):
+            self.unindexFleet(finish, sortKey)
+            self.indexFleet(finish, sortKey)
+
+    def fleetIdForFinish(self, finish):
+        if finish.hasFleet():
+            return finish.fleet.fleetId
+        return None
+
+    def indexFleet(self, finish, sortKey):
+        fleetId = self.fleetIdForFinish(finish)
+        self.indexedFleetIdsById[finish.finishId] = fleetId
+        if fleetId is None:
+            self.unassignedFinishes.add(sortKey, finish)
+        else:
+            if not fleetId in self.finishesByFleetId:
+                self.finishesByFleetId[fleetId] = SortedFinishIndex()
+            self.finishesByFleetId[fleetId].add(sortKey, finish)
+
+    def unindexFleet(self, finish, sortKey):
+        fleetId = self.indexedFleetIdsById.pop(finish.finishId)
+        if fleetId is None:
+            self.unassignedFinishes.remove(sortKey)
+        else:
+            self.finishesByFleetId[fleetId].remove(sortKey)
+
+    def finishWithId(self, finishId):
+        return self.finishesById.get(finishId)
+
+    #
+    # The finishes for a fleet, in finish time order
+    #
+    def finishesForFleet(self, aFleet):
+        return list(self.finishesByFleetId.get(aFleet.fleetId, []))
+
+    def numberFinishesForFleet(self, aFleet):
+        return len(self.finishesByFleetId.get(aFleet.fleetId, []))
+
+    #
+    # The finishes without a fleet, in finish time order
+    #
+    def unassignedFinishList(self):
+        return list(self.unassignedFinishes)
+
+    #
+    # The next finish after the given finish that does not have a fleet, or None
+    #
+    def nextUnassignedAfter(self, finish):
+        return self.unassignedFinishes.firstAfter(self.sortKeysById[finish.finishId])
+
+    #
+    # We pickle just the finishes, in order, and rebuild the indexes when unpickled
+    #
+    def __getstate__(self):
+        return list(self.allFinishes)
+
+    def __setstate__(self, finishes):
+        self.__init__(finishes)
+
+    def __iter__(self):
+        return iter(self.allFinishes)
+
+    def __len__(self):
+        return len(self.allFinishes)
+
+    def __contains__(self, finish):
+        return self.finishesById.get(finish.finishId) is finish
+
+    def __getitem__(self, index):
+        return self.allFinishes[index]
@@ -0,0 +1,98 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# A light pattern is the table of start lights shown for each fleet's start. It is written
+# as a list of steps, each the number of seconds before the start and the relays that are
+# on from then, e.g. the usual five minute sequence:
+#
+#   300:11111,240:11110,180:11100,120:11000,60:10000,0:00000
+#
+# The relays are a string of 0 (off) and 1 (on), relay 1 first, so a card with more relays,
+# e.g. the 8 relay ESB8PR2, just has longer strings. A flash step makes the lights flash for
+# the last seconds before the start, off and on each half second, starting with off, e.g.
+#
+#   30:10000
+#
+# flashes the first light for the last thirty seconds.
+#
+# The pattern is compiled once, when it is read, into a tuple of (seconds before the start,
+# relay bitmask) in time order. Bit 0 of the bitmask is relay 1, bit 1 relay 2 and so on,
+# which is the byte the EasyDaq card takes, so the lights are bitmasks from the start
+# timeline through to the serial port.
+#
+
+DEFAULT_PATTERN = "300:11111,240:11110,180:11100,120:11000,60:10000,0:00000"
+DEFAULT_FLASH = "30:10000"
+
+# the relay bitmask with every light off
+LIGHTS_OFF = 0
+
+FLASH_INTERVAL_SECONDS = 0.5
+
+
+class LightPatternException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+#
+# The relay bitmask for a string of relays, e.g. "11000" is 3
+#
+def relayMask(relays):
+    mask = 0
+    for relayNumber, relay in enumerate(relays):
+        if relay == "1":
+            mask = mask | (1 << relayNumber)
+        elif relay != "0":
+            raise LightPatternException("Relays must be 0 or 1, not %s" % relays)
+    if mask > 0xff:
+        raise LightPatternException("An EasyDaq card has at most 8 relays, not %d" % len(relays))
+    return mask
+
+
+#
+# Parse a step, e.g. "240:11110", into (seconds before the start, relay bitmask)
+#
+def parseStep(step):
+    try:
+        (seconds, relays) = step.split(":")
+        seconds = float(seconds)
+    except ValueError:
+        raise LightPatternException("A light pattern step is seconds:relays, not %s" % step.strip())
+    if seconds < 0:
+        raise LightPatternException("A light pattern step can't be after the start: %s" % step.strip())
+    return (seconds, relayMask(relays.strip()))
+
+
+#
+# Compile a light pattern, and optional flash, into a tuple of (seconds before the start,
+# relay bitmask) in time order. The flash replaces any steps of the pattern during the flash.
+#
+def compileLightPattern(pattern=DEFAULT_PATTERN, flash=DEFAULT_FLASH):
+    masksBySeconds = {}
+    for step in pattern.split(","):
+        if step.strip():
+            (seconds, mask) = parseStep(step)
+            masksBySeconds[seconds] = mask
+
+    if flash:
+        (flashSeconds, mask) = parseStep(flash)
+        flashCount = int(round(flashSeconds / FLASH_INTERVAL_SECONDS))
+        for seconds in masksBySeconds.keys():
+            if 0 < seconds < flashSeconds:
+                del masksBySeconds[seconds]
+        for flashNumber in range(flashCount):
+            seconds = flashSeconds - flashNumber * FLASH_INTERVAL_SECONDS
+            masksBySeconds[seconds] = mask if flashNumber % 2 else LIGHTS_OFF
+
+    return tuple(sorted(masksBySeconds.items(), reverse=True))
+
+
+DEFAULT_LIGHT_PATTERN = compileLightPattern()
@@ -24,8 +24,14 @@
 #
 #
 
-from datetime import datetime,timedelta
-from utils import Signal
+from datetime import timedelta
+from collections import namedtuple
+from utils import Signal, datetimeToEpochMicros, epochMicrosToDatetime
+from clock import wallClock, WallClock
+from timeline import StartTimeline
+from lightpattern import DEFAULT_LIGHT_PATTERN
+from finishstore import FinishStore
+from results import pyCorrectedSeconds
 import logging
 
 
@@ -47,16 +53,31 @@ class RaceException(Exception):
 
 
 
-class Boat:
+#
+# Boats and finishes are slotted so that they don't carry a __dict__ each. This
+# matters on a long day with a lot of finishes, all of which are pickled by the
+# recovery manager. They pickle as compact tuples.
+#
+class Boat(object):
     
-    def __init__(self,sailNumber,boatClass,py=None):
+    __slots__ = ["sailNumber","boatClass","py","fleetName","finish"]
+    
+    def __init__(self,sailNumber=None,boatClass=None,py=None,fleetName=None):
         self.sailNumber = sailNumber
         self.boatClass = boatClass
         self.py= py
+        # the name of the fleet the boat is entered in, if known
+        self.fleetName = fleetName
         self.finish = None
         
     def calculatePyAdjustedSeconds(self):
-        return self.finish.elapsedFinishTimeDelta().total_seconds() * 1000 / self.py
+        return pyCorrectedSeconds(self.finish.elapsedFinishTimeDelta().total_seconds(), self.py)
+    
+    def __getstate__(self):
+        return (self.sailNumber,self.boatClass,self.py,self.fleetName,self.finish)
+    
+    def __setstate__(self,state):
+        (self.sailNumber,self.boatClass,self.py,self.fleetName,self.finish) = state
 
 #
 # A fleet represents a fleet of boats in a race. You should not change
@@ -65,8 +86,10 @@ class Boat:
 #
 class Fleet:
     
+    # the clock is set by the race manager when the fleet is added
+    clock = wallClock
     
-    def __init__(self, name=None, startTime=None,fleetId=None):
+    def __init__(self, name=None, startTime=None,fleetId=None,clock=None):
         
         self.fleetId = str(fleetId)
         if name is None:
@@ -75,6 +98,20 @@ class Fleet:
         self.name = name
         self.startTime = startTime
         self.boats = []
+        if clock:
+            self.clock = clock
+        
+    #
+    # We don't pickle the clock. An unpickled fleet uses the class default until
+    # the race manager gives it a clock.
+    #
+    def __getstate__(self):
+        attributes = self.__dict__.copy()
+        attributes.pop("clock",None)
+        return attributes
+    
+    def __setstate__(self,d):
+        self.__dict__ = d
         
 
     #
@@ -95,7 +132,7 @@ class Fleet:
     #
     def isStarted(self):
         if self.hasStartTime():
-            return datetime.now() > self.startTime
+            return self.clock.now() > self.startTime
             
         else:
             return False
@@ -130,7 +167,7 @@ class Fleet:
     #
     def _deltaToStartTime(self):
         if self.hasStartTime():
-            return datetime.now() - self.startTime
+            return self.clock.now() - self.startTime
         else:
             raise RaceException(self, "Fleet has no start time")
 
@@ -152,20 +189,61 @@ class Fleet:
     # Provide a string representation of the status of the fleet
     #
     def status(self):
+        return self.state(self.clock.now()).status
+    
+    #
+    # Calculate the delta to start time and status of this fleet at a single instant,
+    # reading the start time once. Returns a FleetState.
+    #
+    def state(self,now):
         if not self.hasStartTime():
             # note sure about this description - ask Luke
-            return "Pending"
-        if self.isStarting():
-            return "Starting"
-        if self.isStarted():
-            return "Started"
-        if not self.isStarted():
-            return "Waiting to start"
+            return FleetState(self,None,None,"Pending")
+        
+        deltaSeconds = (now - self.startTime).total_seconds()
+        adjustedDeltaSeconds = deltaSeconds * RaceManager.testSpeedRatio
+        
+        # we are starting if our start time is in 5 mins or less
+        if (START_SECONDS * -1) <= adjustedDeltaSeconds < 0:
+            status = "Starting"
+        elif deltaSeconds > 0:
+            status = "Started"
+        else:
+            status = "Waiting to start"
+        return FleetState(self,deltaSeconds,adjustedDeltaSeconds,status)
             
 
     def __str__(self):
         return self.name + " status: " + self.status()
 
+#
+# The state of a fleet at an instant. The delta seconds are None if the fleet has no start time.
+#
+FleetState = namedtuple("FleetState",["fleet","deltaSeconds","adjustedDeltaSeconds","status"])
+
+#
+# A snapshot of the race manager at a single instant: the state of every fleet,
+# the next fleet to start and the last fleet started. The refresh loops take one
+# snapshot per tick and render from it, so every value in a tick agrees.
+#
+class RaceSnapshot(object):
+    
+    def __init__(self,at,fleetStates,nextFleetToStart,lastFleetStarted):
+        self.at = at
+        self.fleetStates = fleetStates
+        self.nextFleetToStart = nextFleetToStart
+        self.lastFleetStarted = lastFleetStarted
+        self.fleetStatesById = dict((aState.fleet.fleetId,aState) for aState in fleetStates)
+        
+    def stateForFleet(self,aFleet):
+        return self.fleetStatesById[aFleet.fleetId]
+    
+    def hasSequenceStarted(self):
+        return self.nextFleetToStart is not None
+    
+    def hasStartedFleet(self):
+        return self.lastFleetStarted is not None
+
 
 #
 # Finish represents a finish of a competitor in a race. The finish is decoupled from the
@@ -174,17 +252,36 @@ class Fleet:
 # are never associated with a competitor, typically because the race officer creates
 # a finish in error. 
 #
-class Finish:
-    
+class Finish(object):
     
+    __slots__ = ["fleet","finishTime","finishId","boat"]
     
     def __init__(self,finishTime=None,fleet=None,finishId=None):
         self.fleet = fleet
         self.finishTime = finishTime
         # we store the finishid as a string because this is the way Tk references it
         self.finishId = str(finishId)
+        # the boat for this finish, once the race officer has told us
+        self.boat = None
         
-        
+    #
+    # A finish pickles as a tuple, with its finish time as integer microseconds since the epoch
+    # and its id as an integer
+    #
+    def __getstate__(self):
+        finishTime = self.finishTime
+        if finishTime is not None:
+            finishTime = datetimeToEpochMicros(finishTime)
+        return (finishTime,self.fleet,int(self.finishId),self.boat)
+    
+    def __setstate__(self,state):
+        # recovery files written before finishes were slotted hold a dictionary
+        if isinstance(state,dict):
+            state = (state.get("finishTime"),state.get("fleet"),state.get("finishId"),state.get("boat"))
+        else:
+            state = (epochMicrosToDatetime(state[0]),) + tuple(state[1:])
+        (self.finishTime,self.fleet,finishId,self.boat) = state
+        self.finishId = str(finishId)
         
     def hasFleet(self):
         if self.fleet:
@@ -217,34 +314,60 @@ class RaceManager:
     
     testSpeedRatio = 1
     
-    def __init__(self):
+    def __init__(self,clock=None):
+        self.clock = clock or WallClock()
         self.fleets = []
         self.fleetsById = {}
         self.changed = Signal()
-        self.finishes = []
-        self.finishesById = {}
+        # the finishes, indexed by id, time order, fleet and whether they have a fleet
+        self.finishes = FinishStore()
         # we store these on the race manager so that they get pickled
         self.nextFleetId = 1
         self.nextFinishId = 1
+        # the time the F flag comes down, if the sequence was started with a warning
+        self.fFlagDownTime = None
+        # the compiled start timeline. Built on demand and thrown away when the sequence changes
+        self.startTimeline = None
+        # the compiled light pattern. This is set from the configuration, so it isn't pickled
+        self.lightPattern = DEFAULT_LIGHT_PATTERN
         
     #
     # this method controls how the RaceManager is pickled. We want to avoid pickling the Signal object
-    # stored on the changed attribute
+    # stored on the changed attribute, and the clock
     #
     def __getstate__(self):
         attributes = self.__dict__.copy()
         del attributes["changed"]
+        attributes.pop("clock",None)
+        attributes.pop("startTimeline",None)
+        attributes.pop("lightPattern",None)
         
         return attributes
     
     #
     # this method controls how the RaceManager is unpickled. We need to set the changed attribute
-    # as it is not part of the pickle
+    # and the clock as they are not part of the pickle
     #
     def __setstate__(self,d):
         self.__dict__ = d
         self.changed = Signal()
+        self.fFlagDownTime = d.get("fFlagDownTime")
+        self.startTimeline = None
+        self.lightPattern = DEFAULT_LIGHT_PATTERN
+        # recovery files written before the finish store hold a list of finishes
+        if isinstance(self.finishes,list):
+            self.finishes = FinishStore(self.finishes)
+            self.__dict__.pop("finishesById",None)
+        self.setClock(WallClock())
          
+    #
+    # Change the clock used by the race manager and all of its fleets
+    #
+    def setClock(self,clock):
+        self.clock = clock
+        for fleet in self.fleets:
+            fleet.clock = clock
+        
 
     def incrementNextFleetId(self):
         self.nextFleetId = self.nextFleetId + 1
@@ -266,7 +389,7 @@ class RaceManager:
     # we create a name as 'Fleet N' where N is the number of fleets.
     #
     def createFleet(self, name=None):
-        aFleet = Fleet(name=name,fleetId=self.nextFleetId)
+        aFleet = Fleet(name=name,fleetId=self.nextFleetId,clock=self.clock)
         self.incrementNextFleetId()
         self.addFleet(aFleet)
         return aFleet
@@ -277,8 +400,10 @@ class RaceManager:
         
 
     def addFleet(self, aFleet):
+        aFleet.clock = self.clock
         self.fleets.append(aFleet)
         self.fleetsById[aFleet.fleetId] = aFleet
+        self.invalidateTimeline()
         self.changed.fire("fleetAdded",aFleet)
         
 
@@ -287,6 +412,7 @@ class RaceManager:
             positionInList = self.fleets.index(aFleet)
             self.fleets.remove(aFleet)
             del self.fleetsById[aFleet.fleetId]
+            self.invalidateTimeline()
             self.changed.fire("fleetRemoved",aFleet)
             
         else:
@@ -307,17 +433,20 @@ class RaceManager:
         logging.info("Start sequence with warning (F flag start)")
         fleetNumber = 0
         
-        now = datetime.now()
+        now = self.clock.now()
         sequenceStart = now + timedelta(seconds=10)
-        for fleet in self.fleets:
-            fleetNumber = fleetNumber + 1
-            
-            startTime = sequenceStart + timedelta(
-                seconds = (WARNING_SECONDS/RaceManager.testSpeedRatio + 
-                        (START_SECONDS * fleetNumber)/RaceManager.testSpeedRatio))
-
-            self.updateFleetStartTime(fleet,startTime)
-        self.changed.fire("sequenceStartedWithWarning")
+        # the F flag comes down four minutes after it goes up
+        self.fFlagDownTime = sequenceStart + timedelta(seconds=240/RaceManager.testSpeedRatio)
+        with self.changed.batch():
+            for fleet in self.fleets:
+                fleetNumber = fleetNumber + 1
+                
+                startTime = sequenceStart + timedelta(
+                    seconds = (WARNING_SECONDS/RaceManager.testSpeedRatio + 
+                            (START_SECONDS * fleetNumber)/RaceManager.testSpeedRatio))
+    
+                self.updateFleetStartTime(fleet,startTime)
+            self.changed.fire("sequenceStartedWithWarning")
 
 
     #
@@ -326,54 +455,98 @@ class RaceManager:
     def startRaceSequenceWithoutWarning(self):
         logging.info("Start sequence without warning (class flag start)")
         fleetNumber = 0
-        now = datetime.now()
+        now = self.clock.now()
         
         sequenceStart = now + timedelta(seconds=10)
+        self.fFlagDownTime = None
         
-        for fleet in self.fleets:
-            fleetNumber = fleetNumber + 1
-            
-            startTime = sequenceStart + timedelta(
-                seconds = (START_SECONDS * fleetNumber)/RaceManager.testSpeedRatio)
-
-            self.updateFleetStartTime(fleet,startTime)
-        self.changed.fire("sequenceStartedWithoutWarning")
+        with self.changed.batch():
+            for fleet in self.fleets:
+                fleetNumber = fleetNumber + 1
+                
+                startTime = sequenceStart + timedelta(
+                    seconds = (START_SECONDS * fleetNumber)/RaceManager.testSpeedRatio)
+    
+                self.updateFleetStartTime(fleet,startTime)
+            self.changed.fire("sequenceStartedWithoutWarning")
     #
     # Update the startTime for a fleet. Do this through the race manager
     # so that the race manager can signal the event change
     #
     def updateFleetStartTime(self, aFleet, startTime):
         aFleet.startTime = startTime
+        self.invalidateTimeline()
         # signal that the fleet start time has changed
         self.changed.fire("fleetChanged",aFleet)
         
             
 
     #
-    # Find the last fleet started. This is a reverse search
-    # of the fleets list for a started fleet.
-    # Returns None if not found
+    # Return the compiled start timeline, building it if the sequence has
+    # changed since we last asked
+    #
+    def timeline(self):
+        if self.startTimeline is None:
+            self.startTimeline = StartTimeline(self.fleets, self.fFlagDownTime, self.lightPattern)
+        return self.startTimeline
+    
+    #
+    # Throw away the compiled start timeline. Call this whenever a fleet is added, removed
+    # or has its start time changed.
+    #
+    def invalidateTimeline(self):
+        self.startTimeline = None
+
+    #
+    # Set the compiled light pattern for the start lights
+    #
+    def setLightPattern(self,lightPattern):
+        self.lightPattern = lightPattern
+        self.invalidateTimeline()
+
+    #
+    # Find the last fleet started, i.e. the fleet with the latest start
+    # time in the past. Returns None if not found
     #
     def lastFleetStarted(self):
-        for fleet in reversed(self.fleets):
-            if fleet.isStarted():
-                return fleet
-        return None
+        return self.timeline().lastFleetStarted(self.clock.now())
     
     #
-    # Fine the next fleet to start. If we don't have a fleet starting,
+    # Find the next fleet to start. If we don't have a fleet starting,
     # return None.
     #
     def nextFleetToStart(self):
-        for fleet in self.fleets:
-            if fleet.isStarting() or fleet.isWaitingToStart():
-                return fleet
-        return None
+        return self.timeline().nextFleetToStart(self.clock.now())
+    
+    #
+    # The next signal in the start sequence, as a TimelineEvent, or None
+    # if the sequence is complete
+    #
+    def nextSequenceEvent(self):
+        return self.timeline().nextEvent(self.clock.now())
+    
+    #
+    # The phase of the start sequence, i.e. the kind of the most recent signal
+    #
+    def currentSequencePhase(self):
+        return self.timeline().currentPhase(self.clock.now())
 
 
     def hasStartedFleet(self):
         return not self.lastFleetStarted() is None
     
+    #
+    # Take a snapshot of all of our fleets at an instant, by default now.
+    #
+    def snapshot(self,at=None):
+        if at is None:
+            at = self.clock.now()
+        timeline = self.timeline()
+        return RaceSnapshot(at,
+                            tuple(fleet.state(at) for fleet in self.fleets),
+                            timeline.nextFleetToStart(at),
+                            timeline.lastFleetStarted(at))
+    
     
     def hasSequenceStarted(self):
         if self.nextFleetToStart():
@@ -388,8 +561,14 @@ class RaceManager:
     def resetStartSequence(self):
         for fleet in self.fleets:
             fleet.startTime = None
-        self.removeAllFinishes()
-        self.changed.fire("startSequenceReset")
+        self.fFlagDownTime = None
+        self.invalidateTimeline()
+        with self.changed.batch():
+            # the finishes removed next are removed by the reset, e.g. the archive keeps them
+            # as the finishes of the race that has ended
+            self.changed.fire("startSequenceResetting")
+            self.removeAllFinishes()
+            self.changed.fire("startSequenceReset")
 
     def lastFleet(self):
         return self.fleets[-1]
@@ -402,14 +581,20 @@ class RaceManager:
         logging.info("General recall")
         fleetToRecall = self.lastFleetStarted()
         
-        
-        
+        with self.changed.batch():
+            self.moveRecalledFleet(fleetToRecall)
+            self.changed.fire("generalRecall", fleetToRecall)
+    
+    #
+    # Give a recalled fleet its new start time
+    #
+    def moveRecalledFleet(self,fleetToRecall):
 
         # if this is the last (or only) fleet, set its start time to be six
         # minutes from now
         if fleetToRecall == self.fleets[-1]:
             logging.info("General recall last fleet")
-            self.updateFleetStartTime(fleetToRecall,datetime.now()
+            self.updateFleetStartTime(fleetToRecall,self.clock.now()
                                  + timedelta(seconds=(START_SECONDS+LAST_START_GENERAL_RECALL_DELAY)/RaceManager.testSpeedRatio))
 
         # otherwise kick the fleet to be the back of the queue,
@@ -423,8 +608,6 @@ class RaceManager:
             self.addFleet(fleetToRecall)
             logging.log(logging.INFO, "General recall not last fleet. Moving to back of queue. Delta to start time now %d seconds",
                         fleetToRecall.adjustedDeltaSecondsToStartTime())
-            
-        self.changed.fire("generalRecall", fleetToRecall)
 
         
     #
@@ -436,7 +619,7 @@ class RaceManager:
         
         # if no finish time is supplied, set the finish time to be now
         if not finishTime:
-            finishTime = datetime.now()
+            finishTime = self.clock.now()
         # create the finish object
         
         # if we only have one fleet, this will be the fleet for the finish
@@ -449,29 +632,90 @@ class RaceManager:
         self.addFinish(aFinish)
         
         return aFinish
+    
+    #
+    # Create a finish for each of a list of finish times, e.g. a finish rush captured by a
+    # button box or several spotters. A finish time of None is now. The finishes are added in
+    # finish time order and we fire a single finishesAdded signal with the list of finishes,
+    # so that subscribers can handle the burst in one pass. Returns the list of finishes.
+    #
+    def createFinishes(self, finishTimes, fleet=None):
+        
+        # if we only have one fleet, this will be the fleet for the finishes
+        if self.numberFleets() == 1:
+            fleet = self.fleets[0]
+        
+        now = self.clock.now()
+        newFinishes = []
+        for finishTime in sorted(finishTime or now for finishTime in finishTimes):
+            aFinish = Finish(fleet=fleet,finishTime=finishTime,finishId=self.nextFinishId)
+            self.incrementNextFinishId()
+            self.finishes.add(aFinish)
+            newFinishes.append(aFinish)
+        
+        if newFinishes:
+            self.changed.fire("finishesAdded",newFinishes)
+        
+        return newFinishes
         
     
     def addFinish(self,finish):
-        # add it to our list of finish objects
-        self.finishes.append(finish)
-        self.finishesById[finish.finishId] = finish
+        # add it to our store of finish objects
+        self.finishes.add(finish)
         # fire a change signal
         self.changed.fire("finishAdded",finish)
         
     def removeFinish(self,finish):
         self.finishes.remove(finish)
-        del self.finishesById[finish.finishId]
         self.changed.fire("finishRemoved",finish)
         
+    #
+    # Tell the race manager that a finish has changed, e.g. it has been given a fleet
+    #
     def updateFinish(self,finish):
+        self.finishes.reindex(finish)
         self.changed.fire("finishChanged",finish)
         
     def removeAllFinishes(self):
-        for finish in list(self.finishes):
-            self.removeFinish(finish)
+        with self.changed.batch():
+            for finish in list(self.finishes):
+                self.removeFinish(finish)
         
     def finishWithId(self,finishId):
-        if finishId in self.finishesById:
-            return self.finishesById[finishId]
+        return self.finishes.finishWithId(finishId)
+    
+    #
+    # Associate a boat with a finish. If the finish doesn't have a fleet yet and
+    # we have a fleet with the boat's fleet name, the finish gets that fleet.
+    #
+    def assignBoatToFinish(self,aBoat,finish):
+        if finish.boat and finish.boat is not aBoat:
+            finish.boat.finish = None
+        if aBoat.finish and aBoat.finish is not finish:
+            aBoat.finish.boat = None
+        finish.boat = aBoat
+        aBoat.finish = finish
+        if not finish.hasFleet() and aBoat.fleetName:
+            finish.fleet = self.fleetWithName(aBoat.fleetName)
+        self.updateFinish(finish)
+        
+    def fleetWithName(self,fleetName):
+        for fleet in self.fleets:
+            if fleet.name.strip().lower() == fleetName.strip().lower():
+                return fleet
+        return None
+    
+    #
+    # The finishes for a fleet, in finish time order
+    #
+    def finishesForFleet(self,aFleet):
+        return self.finishes.finishesForFleet(aFleet)
+    
+    #
+    # Find the next finish after a finish that doesn't have a fleet. Returns
+    # None if there isn't one.
+    #
+    def nextFinishWithoutFleetAfter(self,finish):
+        return self.finishes.nextUnassignedAfter(finish)
 
     
\ No newline at end of file
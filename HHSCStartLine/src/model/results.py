@@ -0,0 +1,254 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The results engine calculates the results of each fleet from the race manager's finishes
+# and a list of boats. It keeps the results of each fleet in columns: the elapsed and
+# Portsmouth Yardstick (PY) corrected seconds are arrays of doubles sorted by corrected
+# time, alongside a list of the finishes in the same order. Places and gaps to the
+# winner are calculated from the corrected column in a single pass.
+#
+# A fleet's results are calculated in one batch the first time they are asked for. After
+# that, the engine listens to the race manager and keeps them up to date incrementally:
+# a finish given a fleet is inserted by bisection into that fleet's columns, and only a
+# change of start time (e.g. a general recall) recalculates a whole fleet.
+#
+# Boats are linked to their finish through Boat.finish, or by the race manager's
+# assignBoatToFinish. A finish without a boat, or a boat without a PY, is scored on
+# elapsed time, as for a one design fleet.
+#
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+ResultRow = namedtuple("ResultRow", ["place", "finish", "boat", "elapsedSeconds", "correctedSeconds", "gapSeconds"])
+
+
+#
+# The PY corrected time for an elapsed time, as per the RYA Portsmouth Yardstick scheme
+#
+def pyCorrectedSeconds(elapsedSeconds, py):
+    return elapsedSeconds * 1000 / py
+
+
+#
+# The corrected time we score a finish on: PY corrected, or elapsed if there is no PY
+#
+def scoredSeconds(elapsedSeconds, py):
+    if py:
+        return pyCorrectedSeconds(elapsedSeconds, py)
+    return elapsedSeconds
+
+
+#
+# Rank a fleet's finishes, given (elapsed seconds, PY, item) for each finish in the order they
+# finished. Returns (corrected seconds, elapsed seconds, item) for each, sorted on corrected time,
+# then elapsed time, then finishing order.
+#
+def rankFinishes(timedFinishes):
+    rows = [(scoredSeconds(elapsed, py), elapsed, sequence, item)
+            for sequence, (elapsed, py, item) in enumerate(timedFinishes)]
+    rows.sort(key=lambda row: row[:3])
+    return [(corrected, elapsed, item) for (corrected, elapsed, sequence, item) in rows]
+
+
+#
+# The places for a list of corrected times in ranked order. Finishes with the same corrected
+# time share a place.
+#
+def placesForCorrectedSeconds(correctedSeconds):
+    places = []
+    previousCorrected = None
+    place = 0
+    for index, corrected in enumerate(correctedSeconds):
+        if corrected != previousCorrected:
+            place = index + 1
+            previousCorrected = corrected
+        places.append(place)
+    return places
+
+
+class FleetResults(object):
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.finishes = []
+        self.boats = []
+        self.elapsedSeconds = array('d')
+        self.correctedSeconds = array('d')
+        self.correctedSecondsById = {}
+
+    #
+    # Calculate the results for a list of finishes in one batch
+    #
+    def calculate(self, finishes, boatsByFinishId):
+        timedFinishes = []
+        for finish in finishes:
+            boat = finish.boat or boatsByFinishId.get(finish.finishId)
+            timedFinishes.append((finish.elapsedFinishTimeDelta().total_seconds(), boat and boat.py,
+                                  (finish, boat)))
+        rows = rankFinishes(timedFinishes)
+
+        self.finishes = [row[2][0] for row in rows]
+        self.boats = [row[2][1] for row in rows]
+        self.elapsedSeconds = array('d', [row[1] for row in rows])
+        self.correctedSeconds = array('d', [row[0] for row in rows])
+        self.correctedSecondsById = dict((row[2][0].finishId, row[0]) for row in rows)
+
+    def finishSeconds(self, finish, boat):
+        elapsed = finish.elapsedFinishTimeDelta().total_seconds()
+        return (elapsed, scoredSeconds(elapsed, boat and boat.py))
+
+    #
+    # Insert a finish into the results by bisection on the corrected time
+    #
+    def insert(self, finish, boat):
+        (elapsed, corrected) = self.finishSeconds(finish, boat)
+        index = bisect_right(self.correctedSeconds, corrected)
+        self.finishes.insert(index, finish)
+        self.boats.insert(index, boat)
+        self.elapsedSeconds.insert(index, elapsed)
+        self.correctedSeconds.insert(index, corrected)
+        self.correctedSecondsById[finish.finishId] = corrected
+
+    def remove(self, finish):
+        index = self.indexOf(finish)
+        if index is not None:
+            del self.finishes[index]
+            del self.boats[index]
+            del self.elapsedSeconds[index]
+            del self.correctedSeconds[index]
+            del self.correctedSecondsById[finish.finishId]
+
+    #
+    # Find a finish by bisection on its corrected time, then search the tied finishes
+    #
+    def indexOf(self, finish):
+        if not finish.finishId in self.correctedSecondsById:
+            return None
+        corrected = self.correctedSecondsById[finish.finishId]
+        index = bisect_left(self.correctedSeconds, corrected)
+        while index < len(self.finishes) and self.correctedSeconds[index] == corrected:
+            if self.finishes[index] is finish:
+                return index
+            index = index + 1
+        return None
+
+    #
+    # The places, in corrected time order. Finishes with the same corrected time share a place.
+    #
+    def places(self):
+        return placesForCorrectedSeconds(self.correctedSeconds)
+
+    #
+    # The gap in corrected seconds from each finish to the winner
+    #
+    def gaps(self):
+        if not self.correctedSeconds:
+            return array('d')
+        winner = self.correctedSeconds[0]
+        return array('d', [corrected - winner for corrected in self.correctedSeconds])
+
+    def rows(self):
+        return [ResultRow(place, finish, boat, elapsed, corrected, gap)
+                for (place, finish, boat, elapsed, corrected, gap)
+                in zip(self.places(), self.finishes, self.boats,
+                       self.elapsedSeconds, self.correctedSeconds, self.gaps())]
+
+    def __len__(self):
+        return len(self.finishes)
+
+
+class ResultsEngine(object):
+
+    def __init__(self, raceManager, boats=()):
+        self.raceManager = raceManager
+        self.boatsByFinishId = {}
+        # the results of each fleet we have calculated, by fleet id
+        self.fleetResultsById = {}
+        # the fleet id each finish is in the results for
+        self.resultFleetIdsByFinishId = {}
+
+        for boat in boats:
+            if boat.finish:
+                self.boatsByFinishId[boat.finish.finishId] = boat
+
+        self.wireEngine()
+
+    def wireEngine(self):
+        self.raceManager.changed.connect("finishAdded", self.handleFinishChanged)
+        self.raceManager.changed.connect("finishesAdded", self.handleFinishesAdded)
+        self.raceManager.changed.connect("finishChanged", self.handleFinishChanged)
+        self.raceManager.changed.connect("finishRemoved", self.handleFinishRemoved)
+        self.raceManager.changed.connect("fleetChanged", self.handleFleetChanged)
+        self.raceManager.changed.connect("fleetRemoved", self.handleFleetChanged)
+        self.raceManager.changed.connect("startSequenceReset", self.handleStartSequenceReset)
+
+    #
+    # Link a boat to its finish. If the finish is already in the results, it is
+    # re-ranked with the boat's PY.
+    #
+    def addBoat(self, boat):
+        if boat.finish:
+            self.boatsByFinishId[boat.finish.finishId] = boat
+            self.handleFinishChanged(boat.finish)
+
+    #
+    # The results for a fleet, calculated in one batch if we haven't already
+    #
+    def resultsForFleet(self, aFleet):
+        if not aFleet.fleetId in self.fleetResultsById:
+            fleetResults = FleetResults(aFleet)
+            if aFleet.hasStartTime():
+                finishes = self.raceManager.finishesForFleet(aFleet)
+                fleetResults.calculate(finishes, self.boatsByFinishId)
+                for finish in finishes:
+                    self.resultFleetIdsByFinishId[finish.finishId] = aFleet.fleetId
+            self.fleetResultsById[aFleet.fleetId] = fleetResults
+        return self.fleetResultsById[aFleet.fleetId]
+
+    def handleFinishChanged(self, aFinish):
+        self.removeFromResults(aFinish)
+        if aFinish.hasFleet() and aFinish.fleet.hasStartTime():
+            fleetId = aFinish.fleet.fleetId
+            # we only keep results up to date for fleets that someone has asked for
+            if fleetId in self.fleetResultsById:
+                self.fleetResultsById[fleetId].insert(aFinish, self.boatForFinish(aFinish))
+                self.resultFleetIdsByFinishId[aFinish.finishId] = fleetId
+
+    def handleFinishesAdded(self, finishes):
+        for aFinish in finishes:
+            self.handleFinishChanged(aFinish)
+
+    def boatForFinish(self, aFinish):
+        return aFinish.boat or self.boatsByFinishId.get(aFinish.finishId)
+
+    def handleFinishRemoved(self, aFinish):
+        self.removeFromResults(aFinish)
+        self.boatsByFinishId.pop(aFinish.finishId, None)
+
+    def removeFromResults(self, aFinish):
+        fleetId = self.resultFleetIdsByFinishId.pop(aFinish.finishId, None)
+        if fleetId in self.fleetResultsById:
+            self.fleetResultsById[fleetId].remove(aFinish)
+
+    #
+    # A fleet's start time has changed, so all of its elapsed times have changed.
+    # Throw its results away; they are recalculated when next asked for.
+    #
+    def handleFleetChanged(self, aFleet):
+        self.discardFleetResults(aFleet.fleetId)
+
+    def handleStartSequenceReset(self):
+        for fleetId in list(self.fleetResultsById):
+            self.discardFleetResults(fleetId)
+
+    def discardFleetResults(self, fleetId):
+        fleetResults = self.fleetResultsById.pop(fleetId, None)
+        if fleetResults:
+            for finish in fleetResults.finishes:
+                self.resultFleetIdsByFinishId.pop(finish.finishId, None)
@@ -0,0 +1,131 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The real time scheduler runs the sound and light signals in a thread of its own, so
+# that they are on time whatever the race officer is doing on screen. With Tk's after, a
+# gun or a light change waits behind anything Tk is busy with: a message box, the add
+# fleet dialog, or building a big finish view.
+#
+# It has the same after and after_cancel interface as Tk and the SimulatedClock, so the
+# gun and lights controllers are given it as their scheduler. Deadlines are kept in
+# monotonic seconds, so that a change to the system clock doesn't move them.
+#
+# Between deadlines the thread blocks on a Waker, which a new schedule at the top of the
+# heap wakes, rather than on a Condition, which on Python 2 polls every 50 milliseconds.
+# It wakes once for each deadline, and runs the callback as soon as the operating system's
+# timer allows.
+#
+# Callbacks are run on the scheduler's thread, one at a time, in time order. They must
+# not touch Tk; the guns and lights only queue clips and relay commands, which are
+# thread safe.
+#
+
+import heapq
+import logging
+import threading
+
+from clock import monotonicSeconds, Waker
+
+
+class RealTimeScheduler(object):
+
+    # a callback this late is logged as a warning. This is only the threshold for the log; the
+    # worst lateness is logged when we stop.
+    lateWarningSeconds = 0.02
+
+    def __init__(self):
+        # guards the heap, which is changed from any thread
+        self.lock = threading.Lock()
+        self.waker = Waker()
+        # a heap of (dueSeconds, scheduleId, callback, args)
+        self.schedules = []
+        # the schedules that haven't run or been cancelled. A cancelled schedule stays on
+        # the heap until it comes to the top.
+        self.pendingScheduleIds = set()
+        self.nextScheduleId = 1
+        # set here rather than in run, so that stopping before the thread gets going still stops it
+        self.isRunning = True
+        # metrics: the number of callbacks run, and the latest one ran
+        self.callbackCount = 0
+        self.maxLatenessSeconds = 0
+
+    #
+    # Schedule a callback in millis milliseconds. Same signature as Tk after. This can be
+    # called from any thread.
+    #
+    def after(self, millis, callback, *args):
+        with self.lock:
+            scheduleId = self.nextScheduleId
+            self.nextScheduleId = self.nextScheduleId + 1
+            heapq.heappush(self.schedules, (monotonicSeconds() + millis / 1000.0, scheduleId, callback, args))
+            self.pendingScheduleIds.add(scheduleId)
+            isNextDue = self.schedules[0][1] == scheduleId
+        # the new schedule is due before the one we are waiting for
+        if isNextDue:
+            self.waker.wake()
+        return scheduleId
+
+    #
+    # Cancel a schedule. As with Tk, cancelling a schedule that has already run has no effect.
+    #
+    def after_cancel(self, scheduleId):
+        with self.lock:
+            self.pendingScheduleIds.discard(scheduleId)
+
+    def pendingCount(self):
+        with self.lock:
+            return len(self.pendingScheduleIds)
+
+    #
+    # This method gets called in its own thread
+    #
+    def run(self):
+        while True:
+            schedule = self.waitForDueSchedule()
+            if schedule is None:
+                break
+            self.runSchedule(*schedule)
+        self.waker.close()
+        logging.info("Scheduler ran %d callbacks, max lateness %.1f ms" %
+                     (self.callbackCount, self.maxLatenessSeconds * 1000))
+
+    #
+    # Wait until the next schedule is due and take it off the heap. Returns None when we
+    # are stopped.
+    #
+    def waitForDueSchedule(self):
+        while self.isRunning:
+            with self.lock:
+                while self.schedules and not self.schedules[0][1] in self.pendingScheduleIds:
+                    heapq.heappop(self.schedules)
+                if not self.schedules:
+                    waitSeconds = None
+                else:
+                    waitSeconds = self.schedules[0][0] - monotonicSeconds()
+                    if waitSeconds <= 0:
+                        schedule = heapq.heappop(self.schedules)
+                        self.pendingScheduleIds.discard(schedule[1])
+                        return schedule
+            # a schedule made since we let go of the lock has woken the waker already
+            self.waker.wait(waitSeconds)
+        return None
+
+    def runSchedule(self, dueSeconds, scheduleId, callback, args):
+        latenessSeconds = monotonicSeconds() - dueSeconds
+        self.maxLatenessSeconds = max(self.maxLatenessSeconds, latenessSeconds)
+        if latenessSeconds > self.lateWarningSeconds:
+            logging.warning("Scheduled %s ran %.1f ms late" % (callback.__name__, latenessSeconds * 1000))
+        self.callbackCount = self.callbackCount + 1
+        try:
+            callback(*args)
+        except Exception:
+            # a failed signal mustn't stop the ones after it
+            logging.exception("Scheduled %s failed" % callback.__name__)
+
+    def stop(self):
+        self.isRunning = False
+        self.waker.wake()
@@ -0,0 +1,281 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The series scorer scores a club series of races for one fleet, using the Low Point System
+# of Appendix A of the Racing Rules of Sailing:
+#
+# - a boat scores points equal to her place in a race. Boats tied on corrected time share
+#   the points for the places they tie for, e.g. two boats tied for second score 2.5 each.
+# - a boat that did not finish (DNF), did not start (DNS), retired (RET) or was disqualified
+#   (DSQ) in a race, or did not come to the start area (DNC), scores the number of boats
+#   entered in the series plus one. A boat given a code doesn't keep a place, even if she
+#   has a finish time, so the boats behind her move up.
+# - a boat's worst scores are discarded. The number of discards depends on the number of
+#   races sailed, e.g. one discard after four races and two after eight.
+# - boats tied on net points are ranked on their scores from best to worst, without
+#   discards, and if still tied, on their scores in the last race, then the race before it,
+#   and so on, with discards.
+#
+# The points for each race are calculated once, when the race is scored, and cached. A
+# corrected finish rescores only its race; the series standings are recalculated from the
+# cached race points the next time they are asked for. Points for a code depend on the
+# number of boats entered in the series, so the cached race keeps the code rather than
+# its points.
+#
+# A race that is still being sailed can be scored live from the results engine. The series
+# listens to the race manager, and a change to a finish in the race's fleet, or to a finish
+# it scored before, marks just that race to be rescored when the standings are next asked for.
+#
+# A competitor is a boat's sail number, normalised, and class.
+#
+
+from collections import namedtuple
+
+from competitors import normaliseSailNumber
+
+DNC = "DNC"
+DNS = "DNS"
+DNF = "DNF"
+RET = "RET"
+DSQ = "DSQ"
+
+PENALTY_CODES = [DNC, DNS, DNF, RET, DSQ]
+
+SeriesStanding = namedtuple("SeriesStanding", ["place", "competitor", "scores", "discarded", "totalPoints", "netPoints"])
+
+
+class SeriesException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def competitorForBoat(boat):
+    return (normaliseSailNumber(boat.sailNumber), boat.boatClass)
+
+
+#
+# The points for each competitor that finished a race, from their corrected times. Tied
+# competitors share the average of the places they tie for.
+#
+def finishPoints(correctedTimes):
+    ordered = sorted(correctedTimes, key=lambda competitorTime: competitorTime[1])
+    points = {}
+    index = 0
+    while index < len(ordered):
+        tiedTo = index + 1
+        while tiedTo < len(ordered) and ordered[tiedTo][1] == ordered[index][1]:
+            tiedTo = tiedTo + 1
+        # places index + 1 to tiedTo, averaged
+        tiedPoints = (index + 1 + tiedTo) / 2.0
+        for competitor, corrected in ordered[index:tiedTo]:
+            points[competitor] = tiedPoints
+        index = tiedTo
+    return points
+
+
+#
+# The cached result of one race: the points of the competitors that finished, and the
+# codes of those that didn't
+#
+class RaceScore(object):
+
+    def __init__(self, raceId, points, codes):
+        self.raceId = raceId
+        self.points = points
+        self.codes = codes
+
+    def competitors(self):
+        return set(self.points) | set(self.codes)
+
+    def scoreFor(self, competitor, codePoints):
+        if competitor in self.points:
+            return (self.points[competitor], None)
+        # a competitor with no result in a race did not come to the start area
+        return (codePoints, self.codes.get(competitor, DNC))
+
+
+#
+# A race scored from the results engine as it is sailed
+#
+class LiveRace(object):
+
+    def __init__(self, series, raceId, resultsEngine, aFleet, codes=None):
+        self.series = series
+        self.raceId = raceId
+        self.resultsEngine = resultsEngine
+        self.fleet = aFleet
+        self.codes = codes
+        self.isChanged = True
+        # the ids of the finishes we last scored, so that we notice a finish moving out of our fleet
+        self.scoredFinishIds = set()
+        changed = resultsEngine.raceManager.changed
+        changed.connect("finishAdded", self.handleFinishChanged)
+        changed.connect("finishChanged", self.handleFinishChanged)
+        changed.connect("finishRemoved", self.handleFinishChanged)
+        changed.connect("finishesAdded", self.handleFinishesAdded)
+        changed.connect("fleetChanged", self.handleFleetChanged)
+        changed.connect("startSequenceReset", self.handleRaceChanged)
+
+    def isOurFinish(self, aFinish):
+        return ((aFinish.hasFleet() and aFinish.fleet.fleetId == self.fleet.fleetId)
+                or aFinish.finishId in self.scoredFinishIds)
+
+    def handleFinishChanged(self, aFinish):
+        if self.isOurFinish(aFinish):
+            self.handleRaceChanged()
+
+    def handleFinishesAdded(self, finishes):
+        for aFinish in finishes:
+            if self.isOurFinish(aFinish):
+                self.handleRaceChanged()
+                return
+
+    def handleFleetChanged(self, aFleet):
+        if aFleet.fleetId == self.fleet.fleetId:
+            self.handleRaceChanged()
+
+    def handleRaceChanged(self):
+        self.isChanged = True
+        self.series.standingsCache = None
+
+    def rescore(self):
+        self.isChanged = False
+        fleetResults = self.resultsEngine.resultsForFleet(self.fleet)
+        self.scoredFinishIds = set(row.finish.finishId for row in fleetResults.rows())
+        self.series.scoreFleetResults(self.raceId, fleetResults, self.codes)
+
+
+class Series(object):
+
+    #
+    # The discards are a list of (number of races sailed, number of discards), e.g.
+    # [(4, 1), (8, 2)] for one discard after four races and two after eight.
+    #
+    def __init__(self, name=None, discards=()):
+        self.name = name
+        self.discards = sorted(discards)
+        # the races in the order they were sailed, and their cached scores by raceId
+        self.raceIds = []
+        self.raceScores = {}
+        self.liveRaces = {}
+        # the competitors entered, including those that have yet to race
+        self.entries = set()
+        self.standingsCache = None
+        # the number of times we have scored a race, so that we can see what is recalculated
+        self.raceScoreCount = 0
+
+    def addEntry(self, competitor):
+        if not competitor in self.entries:
+            self.entries.add(competitor)
+            self.standingsCache = None
+
+    #
+    # Score a race from a list of (competitor, correctedSeconds) for the boats that finished,
+    # and a dictionary of the codes for those that didn't. A competitor with a code is scored
+    # on the code, even if she has a corrected time. Scoring a race again replaces its scores,
+    # e.g. after a finish is corrected.
+    #
+    def scoreRace(self, raceId, correctedTimes, codes=None):
+        codes = dict(codes or {})
+        for competitor, code in codes.items():
+            if not code in PENALTY_CODES:
+                raise SeriesException("Unknown scoring code %s for %s" % (code, competitor))
+        finishedTimes = [(competitor, corrected) for (competitor, corrected) in correctedTimes
+                         if not competitor in codes]
+        raceScore = RaceScore(raceId, finishPoints(finishedTimes), codes)
+        self.raceScoreCount = self.raceScoreCount + 1
+        if not raceId in self.raceScores:
+            self.raceIds.append(raceId)
+        self.raceScores[raceId] = raceScore
+        self.entries.update(raceScore.competitors())
+        self.standingsCache = None
+        return raceScore
+
+    #
+    # Score a race from its results in the results engine. Finishes without a boat
+    # can't be scored, and are left out.
+    #
+    def scoreFleetResults(self, raceId, fleetResults, codes=None):
+        correctedTimes = [(competitorForBoat(row.boat), row.correctedSeconds)
+                          for row in fleetResults.rows() if row.boat]
+        return self.scoreRace(raceId, correctedTimes, codes)
+
+    #
+    # Score a race live from the results engine, as it is sailed
+    #
+    def addLiveRace(self, raceId, resultsEngine, aFleet, codes=None):
+        self.liveRaces[raceId] = LiveRace(self, raceId, resultsEngine, aFleet, codes)
+        self.liveRaces[raceId].rescore()
+
+    def rescoreChangedRaces(self):
+        for raceId in self.raceIds:
+            liveRace = self.liveRaces.get(raceId)
+            if liveRace and liveRace.isChanged:
+                liveRace.rescore()
+
+    def removeRace(self, raceId):
+        self.liveRaces.pop(raceId, None)
+        if raceId in self.raceScores:
+            del self.raceScores[raceId]
+            self.raceIds.remove(raceId)
+            self.standingsCache = None
+
+    def numberRaces(self):
+        return len(self.raceIds)
+
+    def numberDiscards(self):
+        numberDiscards = 0
+        for (racesSailed, discards) in self.discards:
+            if self.numberRaces() >= racesSailed:
+                numberDiscards = discards
+        return numberDiscards
+
+    #
+    # The points scored by a boat that did not finish, start or come to the start area
+    #
+    def codePoints(self):
+        return len(self.entries) + 1
+
+    #
+    # The series standings, best first, calculated from the cached race scores
+    #
+    def standings(self):
+        self.rescoreChangedRaces()
+        if self.standingsCache is None:
+            self.standingsCache = self.calculateStandings()
+        return self.standingsCache
+
+    def calculateStandings(self):
+        codePoints = self.codePoints()
+        numberDiscards = self.numberDiscards()
+        raceScores = [self.raceScores[raceId] for raceId in self.raceIds]
+
+        rankings = []
+        for competitor in self.entries:
+            scores = [raceScore.scoreFor(competitor, codePoints) for raceScore in raceScores]
+            points = [score[0] for score in scores]
+            # discard the worst scores; of equal scores, the earliest race is discarded
+            worstFirst = sorted(range(len(points)), key=lambda index: (-points[index], index))
+            discarded = set(worstFirst[:numberDiscards])
+            keptPoints = sorted(points[index] for index in range(len(points)) if not index in discarded)
+            netPoints = sum(keptPoints)
+            tieBreak = (netPoints, keptPoints, list(reversed(points)))
+            rankings.append((tieBreak, competitor, scores, discarded, sum(points), netPoints))
+        rankings.sort(key=lambda ranking: (ranking[0], ranking[1]))
+
+        standings = []
+        previousTieBreak = None
+        place = 0
+        for index, (tieBreak, competitor, scores, discarded, totalPoints, netPoints) in enumerate(rankings):
+            if tieBreak != previousTieBreak:
+                place = index + 1
+                previousTieBreak = tieBreak
+            standings.append(SeriesStanding(place, competitor, scores, discarded, totalPoints, netPoints))
+        return standings
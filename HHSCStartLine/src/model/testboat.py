@@ -7,6 +7,7 @@ import unittest
 
 import model.race
 import datetime
+import pickle
 
 class BoatTest(unittest.TestCase):
     
@@ -32,6 +33,19 @@ class BoatTest(unittest.TestCase):
         boat.finish = finish1
         self.assertAlmostEqual(boat.calculatePyAdjustedSeconds(),2700 * 1000 / 1322,0) 
         
+    def testPickleBoatAndFinish(self):
+        boat = model.race.Boat("31618","topper",1365,"Toppers")
+        finish = self.raceManager.createFinish(fleet=self.fleet1, finishTime = (self.seedTime + datetime.timedelta(minutes=30)))
+        self.raceManager.assignBoatToFinish(boat,finish)
+        self.assertFalse(hasattr(finish,"__dict__"))
+        
+        recoveredFinish = pickle.loads(pickle.dumps(finish))
+        self.assertEqual(recoveredFinish.finishId, finish.finishId)
+        self.assertEqual(recoveredFinish.finishTime, finish.finishTime)
+        self.assertEqual(recoveredFinish.fleet.name, "small handicap")
+        self.assertEqual(recoveredFinish.boat.sailNumber, "31618")
+        self.assertTrue(recoveredFinish.boat.finish is recoveredFinish)
+        
         
 
 
@@ -0,0 +1,92 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import pickle
+
+import model.race
+from model.clock import SimulatedClock, MonotonicClock, WallClock
+
+class SimulatedClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.seedTime = datetime.datetime(2026, 6, 14, 11, 0, 0)
+        self.clock = SimulatedClock(self.seedTime)
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        for i in range(6):
+            self.raceManager.createFleet()
+
+    def testClockOnlyMovesWhenAdvanced(self):
+        self.assertEqual(self.clock.now(), self.seedTime)
+        self.clock.advance(90)
+        self.assertEqual(self.clock.now(), self.seedTime + datetime.timedelta(seconds=90))
+
+    def testSchedulesRunInTimeOrder(self):
+        fired = []
+        self.clock.after(2000, fired.append, "second")
+        self.clock.after(1000, fired.append, "first")
+        cancelled = self.clock.after(1500, fired.append, "cancelled")
+        self.clock.after_cancel(cancelled)
+        self.clock.advance(1)
+        self.assertEqual(fired, ["first"])
+        self.clock.advance(5)
+        self.assertEqual(fired, ["first", "second"])
+
+    def testFleetsUseRaceManagerClock(self):
+        self.raceManager.startRaceSequenceWithWarning()
+        firstFleet = self.raceManager.fleets[0]
+        self.assertEqual(firstFleet.deltaSecondsToStartTime(), -610)
+        self.clock.advance(611)
+        self.assertTrue(firstFleet.isStarted())
+        self.assertEqual(self.raceManager.lastFleetStarted(), firstFleet)
+
+    def testSixFleetSequenceWithRecalls(self):
+        self.raceManager.startRaceSequenceWithWarning()
+        firstFleet = self.raceManager.fleets[0]
+
+        # one second after the first start, recall the first fleet to the back of the queue
+        self.clock.advance(611)
+        self.raceManager.generalRecall()
+        self.assertEqual(self.raceManager.fleets[-1], firstFleet)
+
+        # run through every remaining start, recalling the last fleet once
+        self.clock.advance(300 * 6)
+        self.assertEqual(self.raceManager.lastFleetStarted(), firstFleet)
+        self.raceManager.generalRecall()
+        self.assertEqual(firstFleet.status(), "Waiting to start")
+
+        self.clock.advance(361)
+        self.assertTrue(all(fleet.isStarted() for fleet in self.raceManager.fleets))
+        self.assertEqual(self.raceManager.nextFleetToStart(), None)
+
+    def testFinishUsesRaceManagerClock(self):
+        finish = self.raceManager.createFinish()
+        self.assertEqual(finish.finishTime, self.seedTime)
+
+    def testClockNotPickled(self):
+        recovered = pickle.loads(pickle.dumps(self.raceManager))
+        self.assertTrue(isinstance(recovered.clock, WallClock))
+        self.assertTrue(recovered.fleets[0].clock is recovered.clock)
+
+
+class MonotonicClockTest(unittest.TestCase):
+
+    def testMonotonicClockTracksWallClock(self):
+        clock = MonotonicClock()
+        delta = abs(datetime.datetime.now() - clock.now())
+        self.assertTrue(delta < datetime.timedelta(seconds=1))
+
+    def testMonotonicClockNeverGoesBackwards(self):
+        clock = MonotonicClock()
+        previous = clock.now()
+        for i in range(1000):
+            current = clock.now()
+            self.assertTrue(current >= previous)
+            previous = current
+
+
+if __name__ == "__main__":
+    unittest.main()
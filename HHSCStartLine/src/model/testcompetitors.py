@@ -0,0 +1,101 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import time
+
+import model.race
+from model.clock import SimulatedClock
+from model.competitors import CompetitorRegistry, CompetitorException, readEntryList
+from model.results import ResultsEngine
+
+ENTRY_LIST = """Sail Number,Class,PY,Fleet
+31618,Topper,1365,Toppers
+31620,Topper,1365,Toppers
+2345,Laser,1100,Large handicap
+GBR 316,Solo,1142,Large handicap
+900,Mirror,,Small handicap
+""".splitlines()
+
+class CompetitorRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CompetitorRegistry(readEntryList(ENTRY_LIST))
+
+    def sailNumbers(self, boats):
+        return [boat.sailNumber for boat in boats]
+
+    def testLoadEntryList(self):
+        self.assertEqual(self.registry.numberBoats(), 5)
+        boat = self.registry.boatsWithSailNumber("31618")[0]
+        self.assertEqual(boat.boatClass, "Topper")
+        self.assertEqual(boat.py, 1365)
+        self.assertEqual(boat.fleetName, "Toppers")
+        self.assertEqual(self.registry.boatsWithSailNumber("900")[0].py, None)
+
+    def testMissingColumn(self):
+        self.assertRaises(CompetitorException, list, readEntryList(["Sail Number,PY", "1,1000"]))
+
+    def testBadPY(self):
+        try:
+            list(readEntryList(["Sail Number,Class,PY", "1,Laser,1100", "2,Laser,fast"]))
+            self.fail("A PY that isn't a number is an error")
+        except CompetitorException as e:
+            self.assertTrue("row 3" in str(e))
+            self.assertTrue("fast" in str(e))
+
+    def testIndexes(self):
+        self.assertEqual(self.sailNumbers(self.registry.boatsInClass("topper")), ["31618", "31620"])
+        self.assertEqual(self.registry.boatsWithSailNumber("gbr316")[0].boatClass, "Solo")
+
+    def testPrefixSearch(self):
+        self.assertEqual(self.sailNumbers(self.registry.search("3")), ["31618", "31620"])
+        self.assertEqual(self.sailNumbers(self.registry.search("3161")), ["31618"])
+        self.assertEqual(self.sailNumbers(self.registry.search("316")), ["31618", "31620"])
+        self.assertEqual(self.sailNumbers(self.registry.search("gbr")), ["GBR 316"])
+        self.assertEqual(self.registry.search("7"), [])
+        self.assertEqual(len(self.registry.search("")), 5)
+
+    def testSearchInFleet(self):
+        raceManager = model.race.RaceManager()
+        fleet = raceManager.createFleet("Large handicap")
+        self.assertEqual(self.sailNumbers(self.registry.search("", aFleet=fleet)), ["2345", "GBR 316"])
+
+    def testAddBoat(self):
+        self.registry.search("31")
+        self.registry.addBoat(model.race.Boat("3100", "Laser", 1100))
+        self.assertEqual(self.sailNumbers(self.registry.search("310")), ["3100"])
+
+    def testSearchLargeRegistry(self):
+        registry = CompetitorRegistry(model.race.Boat(str(sailNumber), "Laser", 1100)
+                                      for sailNumber in range(100000, 105000))
+        started = time.time()
+        for prefix in ["1", "10", "103", "1031", "10316", "103161"]:
+            matches = registry.search(prefix, limit=20)
+        self.assertEqual(self.sailNumbers(matches), ["103161"])
+        self.assertTrue(time.time() - started < 0.05)
+
+    def testAssignBoatToFinish(self):
+        clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        raceManager = model.race.RaceManager(clock=clock)
+        raceManager.createFleet("Large handicap")
+        toppers = raceManager.createFleet("Toppers")
+        raceManager.startRaceSequenceWithoutWarning()
+        engine = ResultsEngine(raceManager)
+        results = engine.resultsForFleet(toppers)
+
+        clock.advance(3600)
+        finish = raceManager.createFinish()
+        boat = self.registry.search("31618")[0]
+        raceManager.assignBoatToFinish(boat, finish)
+
+        self.assertEqual(finish.fleet, toppers)
+        self.assertEqual(boat.finish, finish)
+        self.assertEqual(results.rows()[0].boat, boat)
+
+
+if __name__ == "__main__":
+    unittest.main()
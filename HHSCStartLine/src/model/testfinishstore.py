@@ -0,0 +1,147 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import pickle
+import random
+
+import model.race
+from model.clock import SimulatedClock
+from model.finishstore import SortedFinishIndex
+
+class FinishStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        self.fleet1 = self.raceManager.createFleet("Large handicap")
+        self.fleet2 = self.raceManager.createFleet("Toppers")
+        self.finishes = []
+        for i in range(6):
+            self.clock.advance(1)
+            self.finishes.append(self.raceManager.createFinish())
+
+    def assignFleet(self, finish, fleet):
+        finish.fleet = fleet
+        self.raceManager.updateFinish(finish)
+
+    def testFinishesInTimeOrder(self):
+        self.assertEqual(list(self.raceManager.finishes), self.finishes)
+        self.assertEqual(len(self.raceManager.finishes), 6)
+        late = self.raceManager.createFinish(finishTime=self.finishes[2].finishTime)
+        self.assertEqual(list(self.raceManager.finishes).index(late), 3)
+
+    def testFinishWithId(self):
+        self.assertEqual(self.raceManager.finishWithId(self.finishes[3].finishId), self.finishes[3])
+        self.assertEqual(self.raceManager.finishWithId("99"), None)
+
+    def testNextFinishWithoutFleet(self):
+        self.assignFleet(self.finishes[1], self.fleet1)
+        self.assignFleet(self.finishes[2], self.fleet2)
+        self.assertEqual(self.raceManager.nextFinishWithoutFleetAfter(self.finishes[0]), self.finishes[3])
+        self.assignFleet(self.finishes[5], self.fleet1)
+        self.assertEqual(self.raceManager.nextFinishWithoutFleetAfter(self.finishes[4]), None)
+        # an assigned finish can ask too
+        self.assertEqual(self.raceManager.nextFinishWithoutFleetAfter(self.finishes[1]), self.finishes[3])
+
+    def testFinishesForFleet(self):
+        self.assignFleet(self.finishes[4], self.fleet1)
+        self.assignFleet(self.finishes[1], self.fleet1)
+        self.assignFleet(self.finishes[2], self.fleet2)
+        self.assertEqual(self.raceManager.finishesForFleet(self.fleet1), [self.finishes[1], self.finishes[4]])
+        # move a finish to another fleet
+        self.assignFleet(self.finishes[4], self.fleet2)
+        self.assertEqual(self.raceManager.finishesForFleet(self.fleet1), [self.finishes[1]])
+        self.assertEqual(self.raceManager.finishesForFleet(self.fleet2), [self.finishes[2], self.finishes[4]])
+
+    def testRemoveFinish(self):
+        self.assignFleet(self.finishes[2], self.fleet1)
+        self.raceManager.removeFinish(self.finishes[2])
+        self.raceManager.removeFinish(self.finishes[3])
+        self.assertEqual(len(self.raceManager.finishes), 4)
+        self.assertFalse(self.finishes[2] in self.raceManager.finishes)
+        self.assertEqual(self.raceManager.finishesForFleet(self.fleet1), [])
+        self.assertEqual(self.raceManager.nextFinishWithoutFleetAfter(self.finishes[1]), self.finishes[4])
+
+    def testCreateFinishes(self):
+        added = []
+        self.raceManager.changed.connect("finishesAdded", added.append)
+        now = self.clock.now()
+        times = [now + datetime.timedelta(seconds=2), None, now + datetime.timedelta(seconds=1)]
+        finishes = self.raceManager.createFinishes(times, self.fleet1)
+
+        # one signal for the whole burst, in finish time order
+        self.assertEqual(added, [finishes])
+        self.assertEqual([finish.finishTime for finish in finishes], sorted(time or now for time in times))
+        self.assertEqual(self.raceManager.finishesForFleet(self.fleet1), finishes)
+        self.assertEqual(list(self.raceManager.finishes)[6:], finishes)
+        self.assertEqual(len(set(finish.finishId for finish in finishes)), 3)
+
+        # no finishes, no signal
+        self.assertEqual(self.raceManager.createFinishes([]), [])
+        self.assertEqual(len(added), 1)
+
+    def testRemoveAllFinishes(self):
+        self.raceManager.removeAllFinishes()
+        self.assertEqual(len(self.raceManager.finishes), 0)
+
+    def testRecoverFinishList(self):
+        # recovery files written before the finish store pickled a list of finishes
+        state = self.raceManager.__getstate__()
+        state["finishes"] = list(self.raceManager.finishes)
+        state["finishesById"] = {}
+        recovered = model.race.RaceManager()
+        recovered.__setstate__(state)
+        self.assertEqual(list(recovered.finishes), self.finishes)
+        self.assertFalse("finishesById" in recovered.__dict__)
+
+    def testPickle(self):
+        self.assignFleet(self.finishes[1], self.fleet1)
+        recovered = pickle.loads(pickle.dumps(self.raceManager))
+        self.assertEqual(len(recovered.finishes), 6)
+        self.assertEqual(len(recovered.finishesForFleet(recovered.fleets[0])), 1)
+
+
+class SortedFinishIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SortedFinishIndex()
+        # small blocks, so that they are split and emptied
+        self.index.blockSize = 4
+
+    def testMatchesSortedList(self):
+        generator = random.Random(42)
+        expected = []
+        for sequence in range(200):
+            key = (generator.randint(0, 50), sequence)
+            self.index.add(key, key)
+            expected.append(key)
+            if generator.random() < 0.3:
+                removed = expected.pop(generator.randrange(len(expected)))
+                self.index.remove(removed)
+        expected.sort()
+        self.assertEqual(list(self.index), expected)
+        self.assertEqual(len(self.index), len(expected))
+        self.assertTrue(len(self.index.keyBlocks) > 1)
+        self.assertEqual([self.index[i] for i in [0, 17, -1]], [expected[0], expected[17], expected[-1]])
+        self.assertEqual(self.index[-3:], expected[-3:])
+        for key in expected[:-1]:
+            self.assertEqual(self.index.firstAfter(key), expected[expected.index(key) + 1])
+        self.assertEqual(self.index.firstAfter(expected[-1]), None)
+
+    def testRemoveEverything(self):
+        for sequence in range(20):
+            self.index.add((0, sequence), sequence)
+        for sequence in range(20):
+            self.index.remove((0, sequence))
+        self.index.remove((0, 0))
+        self.assertEqual(list(self.index), [])
+        self.assertEqual(self.index.firstAfter((0, 0)), None)
+        self.assertRaises(IndexError, self.index.__getitem__, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
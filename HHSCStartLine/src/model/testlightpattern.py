@@ -0,0 +1,40 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+
+from model.lightpattern import compileLightPattern, relayMask, LightPatternException, DEFAULT_LIGHT_PATTERN
+
+class LightPatternTest(unittest.TestCase):
+
+    def testRelayMask(self):
+        self.assertEqual(relayMask("00000"), 0)
+        self.assertEqual(relayMask("11000"), 3)
+        self.assertEqual(relayMask("00001"), 16)
+        self.assertEqual(relayMask("11111111"), 255)
+
+    def testDefaultPattern(self):
+        self.assertEqual(DEFAULT_LIGHT_PATTERN[:6], ((300, 31), (240, 15), (180, 7), (120, 3), (60, 1), (30, 0)))
+        self.assertEqual(DEFAULT_LIGHT_PATTERN[-3:], ((1.0, 0), (0.5, 1), (0, 0)))
+        self.assertEqual(len(DEFAULT_LIGHT_PATTERN), 5 + 60 + 1)
+
+    def testPatternSortedInTimeOrder(self):
+        self.assertEqual(compileLightPattern("0:000, 60:100,180:111 ,120:110", ""),
+                         ((180, 7), (120, 3), (60, 1), (0, 0)))
+
+    def testFlashReplacesSteps(self):
+        pattern = compileLightPattern("60:11111111,1:00000001,0:00000000", "2:10000000")
+        self.assertEqual(pattern, ((60, 255), (2, 0), (1.5, 1), (1, 0), (0.5, 1), (0, 0)))
+
+    def testBadPatterns(self):
+        self.assertRaises(LightPatternException, compileLightPattern, "300:11211", "")
+        self.assertRaises(LightPatternException, compileLightPattern, "300", "")
+        self.assertRaises(LightPatternException, compileLightPattern, "-5:1", "")
+        self.assertRaises(LightPatternException, compileLightPattern, "300:111111111", "")
+        self.assertRaises(LightPatternException, compileLightPattern, "300:11111", "thirty:1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+
+import model.race
+from model.clock import SimulatedClock
+from model.results import ResultsEngine
+
+class ResultsEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        self.fleet = self.raceManager.createFleet("Large handicap")
+        self.otherFleet = self.raceManager.createFleet("Toppers")
+        self.raceManager.startRaceSequenceWithoutWarning()
+        self.startTime = self.fleet.startTime
+
+        # three boats finish after 50, 51 and 52 minutes
+        self.boats = [model.race.Boat("2345", "Laser", 1100),
+                      model.race.Boat("31618", "Topper", 1365),
+                      model.race.Boat("900", "Solo", 1142)]
+        for minutes, boat in zip([50, 51, 52], self.boats):
+            boat.finish = self.raceManager.createFinish(
+                fleet=self.fleet, finishTime=self.startTime + datetime.timedelta(minutes=minutes))
+
+        self.engine = ResultsEngine(self.raceManager, self.boats)
+
+    def testBatchResults(self):
+        results = self.engine.resultsForFleet(self.fleet)
+        self.assertEqual([row.boat.sailNumber for row in results.rows()], ["31618", "2345", "900"])
+        self.assertEqual(results.places(), [1, 2, 3])
+        for row in results.rows():
+            self.assertAlmostEqual(row.correctedSeconds, row.boat.calculatePyAdjustedSeconds())
+        self.assertEqual(results.gaps()[0], 0)
+        self.assertAlmostEqual(results.gaps()[1], 3000 * 1000 / 1100.0 - 3060 * 1000 / 1365.0)
+
+    def testFinishAssignedToFleetIsRanked(self):
+        results = self.engine.resultsForFleet(self.fleet)
+        finish = self.raceManager.createFinish(finishTime=self.startTime + datetime.timedelta(minutes=40))
+        boat = model.race.Boat("1", "Laser", 1100)
+        boat.finish = finish
+        self.engine.addBoat(boat)
+        self.assertEqual(len(results), 3)
+
+        finish.fleet = self.fleet
+        self.raceManager.updateFinish(finish)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results.rows()[0].boat, boat)
+
+        # moving the finish to another fleet takes it out of our results
+        finish.fleet = self.otherFleet
+        self.raceManager.updateFinish(finish)
+        self.assertEqual(len(results), 3)
+
+    def testFinishWithoutBoatUsesElapsedTime(self):
+        results = self.engine.resultsForFleet(self.fleet)
+        finish = self.raceManager.createFinish(fleet=self.fleet,
+                                               finishTime=self.startTime + datetime.timedelta(minutes=45))
+        # 2700 seconds puts it between the Topper and the Laser
+        self.assertEqual(results.rows()[1].finish, finish)
+        self.assertEqual(results.rows()[1].correctedSeconds, 2700)
+
+    def testTiesSharePlace(self):
+        boat = model.race.Boat("2346", "Laser", 1100)
+        boat.finish = self.raceManager.createFinish(fleet=self.fleet, finishTime=self.boats[0].finish.finishTime)
+        self.engine.addBoat(boat)
+        self.assertEqual(self.engine.resultsForFleet(self.fleet).places(), [1, 2, 2, 4])
+
+    def testRemoveFinish(self):
+        results = self.engine.resultsForFleet(self.fleet)
+        self.raceManager.removeFinish(self.boats[1].finish)
+        self.assertEqual([row.boat.sailNumber for row in results.rows()], ["2345", "900"])
+
+    def testGeneralRecallRecalculates(self):
+        results = self.engine.resultsForFleet(self.fleet)
+        self.raceManager.updateFleetStartTime(self.fleet, self.startTime - datetime.timedelta(minutes=10))
+        self.assertFalse(self.engine.resultsForFleet(self.fleet) is results)
+        self.assertEqual(self.engine.resultsForFleet(self.fleet).rows()[0].elapsedSeconds, 3660)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import threading
+import time
+
+from model.clock import Waker, monotonicSeconds
+from model.scheduler import RealTimeScheduler
+
+class RealTimeSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RealTimeScheduler()
+        self.thread = threading.Thread(target=self.scheduler.run)
+        self.thread.daemon = True
+        self.calls = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.thread.join(2)
+
+    def record(self, name):
+        self.calls.append((name, time.time()))
+
+    def testRunsInTimeOrder(self):
+        self.scheduler.after(60, self.record, "second")
+        self.scheduler.after(20, self.record, "first")
+        self.scheduler.after(100, self.done.set)
+        self.thread.start()
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual([name for (name, calledAt) in self.calls], ["first", "second"])
+
+    def testCancel(self):
+        scheduleId = self.scheduler.after(20, self.record, "cancelled")
+        self.scheduler.after(40, self.done.set)
+        self.scheduler.after_cancel(scheduleId)
+        # cancelling a schedule that has already gone does nothing
+        self.scheduler.after_cancel(scheduleId)
+        self.thread.start()
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.scheduler.pendingCount(), 0)
+
+    def testOnTimeWhileAnotherThreadIsBusy(self):
+        self.thread.start()
+        scheduledAt = time.time()
+        self.scheduler.after(100, self.record, "gun")
+        self.scheduler.after(100, self.done.set)
+        # this thread is busy, as Tk is with a modal dialog
+        time.sleep(0.5)
+        self.assertTrue(self.done.is_set())
+        self.assertTrue(self.calls[0][1] - scheduledAt < 0.2)
+
+    def testEarlierScheduleWakesScheduler(self):
+        self.thread.start()
+        self.scheduler.after(5000, self.record, "later")
+        time.sleep(0.05)
+        self.scheduler.after(10, self.done.set)
+        self.assertTrue(self.done.wait(1))
+
+    def testWakesOnceForEachDeadline(self):
+        waits = []
+        wait = self.scheduler.waker.wait
+        def countedWait(timeoutSeconds=None):
+            waits.append(timeoutSeconds)
+            wait(timeoutSeconds)
+        self.scheduler.waker.wait = countedWait
+        self.scheduler.after(300, self.done.set)
+        self.thread.start()
+        self.assertTrue(self.done.wait(2))
+        # woken by the schedule, then the deadline, then waiting for the next schedule. A
+        # polling wait would have woken every 50 ms.
+        self.assertTrue(len(waits) <= 3, waits)
+        self.assertTrue(self.scheduler.maxLatenessSeconds < 0.02, self.scheduler.maxLatenessSeconds)
+
+    def testFailedCallbackDoesNotStopScheduler(self):
+        self.scheduler.after(10, lambda: 1 / 0)
+        self.scheduler.after(20, self.done.set)
+        self.thread.start()
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.scheduler.callbackCount, 2)
+
+
+class WakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.waker = Waker()
+
+    def tearDown(self):
+        self.waker.close()
+
+    def testWaitsForTimeout(self):
+        startSeconds = monotonicSeconds()
+        self.waker.wait(0.2)
+        self.assertTrue(monotonicSeconds() - startSeconds >= 0.19)
+
+    def testWakeBeforeWaitIsNotLost(self):
+        self.waker.wake()
+        self.waker.wake()
+        startSeconds = monotonicSeconds()
+        self.waker.wait(2)
+        self.assertTrue(monotonicSeconds() - startSeconds < 0.1)
+        # and both wakes were used up
+        startSeconds = monotonicSeconds()
+        self.waker.wait(0.1)
+        self.assertTrue(monotonicSeconds() - startSeconds >= 0.09)
+
+    def testWakeFromAnotherThread(self):
+        timer = threading.Timer(0.05, self.waker.wake)
+        timer.start()
+        startSeconds = monotonicSeconds()
+        self.waker.wait(2)
+        self.assertTrue(monotonicSeconds() - startSeconds < 0.5)
+        timer.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
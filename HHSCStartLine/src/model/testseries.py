@@ -0,0 +1,144 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import time
+
+import model.race
+from model.clock import SimulatedClock
+from model.results import ResultsEngine
+from model.series import Series, SeriesException, DNF, DNS, DNC, DSQ, finishPoints, competitorForBoat
+
+A = ("1", "Laser")
+B = ("2", "Laser")
+C = ("3", "Laser")
+D = ("4", "Laser")
+
+class SeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.series = Series("Summer", discards=[(4, 1), (8, 2)])
+
+    def pointsFor(self, competitor):
+        for standing in self.series.standings():
+            if standing.competitor == competitor:
+                return [score[0] for score in standing.scores]
+
+    def testTiedFinishesSharePoints(self):
+        self.assertEqual(finishPoints([(A, 100), (B, 90), (C, 90), (D, 120)]),
+                         {B: 1.5, C: 1.5, A: 3, D: 4})
+
+    def testCodesScoreEntriesPlusOne(self):
+        self.series.addEntry(D)
+        self.series.scoreRace(1, [(A, 100), (B, 110)], {C: DNF})
+        standings = self.series.standings()
+        self.assertEqual([standing.competitor for standing in standings], [A, B, C, D])
+        self.assertEqual(standings[2].scores, [(5, DNF)])
+        # a competitor with no result did not come to the start area
+        self.assertEqual(standings[3].scores, [(5, DNC)])
+
+    def testCodedFinisherLosesPlace(self):
+        raceScore = self.series.scoreRace(1, [(A, 100), (B, 200), (C, 300)], {A: DSQ})
+        self.assertEqual(raceScore.points, {B: 1.0, C: 2.0})
+        standings = self.series.standings()
+        self.assertEqual([standing.competitor for standing in standings], [B, C, A])
+        self.assertEqual(standings[2].scores, [(4, DSQ)])
+
+    def testUnknownCode(self):
+        self.assertRaises(SeriesException, self.series.scoreRace, 1, [], {A: "XYZ"})
+
+    def testDiscards(self):
+        for raceId, times in enumerate([[(A, 100), (B, 110)], [(B, 100), (A, 110)],
+                                        [(A, 100), (B, 110)], [(A, 100)]]):
+            self.series.scoreRace(raceId, times, {B: DNS} if raceId == 3 else None)
+        standings = self.series.standings()
+        self.assertEqual(self.series.numberDiscards(), 1)
+        # B's DNS is discarded; A discards the first of its second places
+        self.assertEqual((standings[0].competitor, standings[0].netPoints, standings[0].discarded), (A, 3, set([1])))
+        self.assertEqual((standings[1].competitor, standings[1].netPoints, standings[1].discarded), (B, 5, set([3])))
+
+    def testTieBrokenOnBestScores(self):
+        self.series.scoreRace(1, [(A, 100), (B, 110), (C, 120)])
+        self.series.scoreRace(2, [(B, 100), (C, 110), (A, 120)])
+        self.series.scoreRace(3, [(C, 100), (A, 110), (B, 120)])
+        # all three score six; each has a first, so the tie goes to the last race
+        standings = self.series.standings()
+        self.assertEqual([(standing.place, standing.competitor) for standing in standings],
+                         [(1, C), (2, A), (3, B)])
+
+    def testCorrectedRaceRescoredAlone(self):
+        for raceId in range(10):
+            self.series.scoreRace(raceId, [(A, 100), (B, 110)])
+        self.series.standings()
+        self.assertEqual(self.series.raceScoreCount, 10)
+        self.series.scoreRace(4, [(A, 120), (B, 110)])
+        self.assertEqual(self.series.raceScoreCount, 11)
+        self.assertEqual(self.pointsFor(A)[4], 2)
+
+    def testSeasonScoredQuickly(self):
+        # five fleets of 60 boats, racing 20 races
+        serieses = [Series(discards=[(4, 1), (8, 2), (12, 3)]) for fleet in range(5)]
+        startSeconds = time.time()
+        for series in serieses:
+            boats = [(str(sailNumber), "Laser") for sailNumber in range(60)]
+            for boat in boats:
+                series.addEntry(boat)
+            for raceId in range(20):
+                series.scoreRace(raceId, [(boat, (sailNumber * 7 + raceId * 13) % 61)
+                                          for sailNumber, boat in enumerate(boats[:55])],
+                                 dict((boat, DNF) for boat in boats[55:58]))
+            self.assertEqual(len(series.standings()), 60)
+        self.assertTrue(time.time() - startSeconds < 1)
+
+
+class LiveRaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        self.fleet = self.raceManager.createFleet("Large handicap")
+        self.raceManager.startRaceSequenceWithoutWarning()
+        self.boats = [model.race.Boat("2345", "Laser", 1100), model.race.Boat("900", "Solo", 1142)]
+        for minutes, boat in zip([50, 52], self.boats):
+            boat.finish = self.raceManager.createFinish(
+                fleet=self.fleet, finishTime=self.fleet.startTime + datetime.timedelta(minutes=minutes))
+        self.resultsEngine = ResultsEngine(self.raceManager, self.boats)
+        self.series = Series("Summer")
+        self.series.scoreRace("earlier", [(competitorForBoat(self.boats[1]), 100)])
+
+    def testCorrectedFinishRescoresRace(self):
+        self.series.addLiveRace("today", self.resultsEngine, self.fleet)
+        standings = self.series.standings()
+        self.assertEqual(standings[0].competitor, competitorForBoat(self.boats[1]))
+        self.assertEqual(self.series.raceScoreCount, 2)
+
+        # the Solo finished first after all
+        self.boats[1].finish.finishTime = self.fleet.startTime + datetime.timedelta(minutes=45)
+        self.raceManager.updateFinish(self.boats[1].finish)
+        standings = self.series.standings()
+        self.assertEqual(self.series.raceScoreCount, 3)
+        self.assertEqual([score[0] for score in standings[0].scores], [1, 1])
+
+    def testOtherFleetDoesNotRescore(self):
+        otherFleet = self.raceManager.createFleet("Toppers")
+        self.series.addLiveRace("today", self.resultsEngine, self.fleet)
+        self.series.standings()
+        self.assertEqual(self.series.raceScoreCount, 2)
+        otherFinish = self.raceManager.createFinish(fleet=otherFleet)
+        self.raceManager.updateFinish(otherFinish)
+        self.series.standings()
+        self.assertEqual(self.series.raceScoreCount, 2)
+
+        # a finish moved out of our fleet rescores the race
+        self.boats[0].finish.fleet = otherFleet
+        self.raceManager.updateFinish(self.boats[0].finish)
+        standings = self.series.standings()
+        self.assertEqual(self.series.raceScoreCount, 3)
+        self.assertEqual(standings[0].scores, [(1, None), (1, None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+
+import model.race
+from model.utils import Signal, PRIORITY_CRITICAL, PRIORITY_BACKGROUND
+from model.clock import SimulatedClock
+
+class SignalBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.signal = Signal()
+        self.events = []
+        self.genericCalls = []
+        self.signal.connect("finishAdded", lambda finish: self.events.append(("finishAdded", finish)))
+        self.signal.connect("finishRemoved", lambda finish: self.events.append(("finishRemoved", finish)))
+        self.signal.connect(None, lambda *args: self.genericCalls.append(args))
+
+    def testFireWithoutBatch(self):
+        self.signal.fire("finishAdded", 1)
+        self.assertEqual(self.events, [("finishAdded", 1)])
+        self.assertEqual(self.genericCalls, [(1,)])
+
+    def testEventsDeliveredAtEndOfBatch(self):
+        with self.signal.batch():
+            self.signal.fire("finishAdded", 1)
+            self.signal.fire("finishRemoved", 2)
+            self.assertEqual(self.events, [])
+        self.assertEqual(self.events, [("finishAdded", 1), ("finishRemoved", 2)])
+        # the generic handlers see every event too
+        self.assertEqual(self.genericCalls, [(1,), (2,)])
+
+    def testDuplicatesCollapsed(self):
+        with self.signal.batch():
+            self.signal.fire("finishAdded", 1)
+            self.signal.fire("finishAdded", 2)
+            self.signal.fire("finishAdded", 1)
+        self.assertEqual(self.events, [("finishAdded", 2), ("finishAdded", 1)])
+        self.assertEqual(self.genericCalls, [(2,), (1,)])
+
+    def testFailedBatchDropsEvents(self):
+        def failingBatch():
+            with self.signal.batch():
+                self.signal.fire("finishAdded", 1)
+                raise ValueError()
+        self.assertRaises(ValueError, failingBatch)
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.genericCalls, [])
+        self.assertFalse(self.signal.isBatching())
+
+    def testFailedNestedBatchKeepsOuterEvents(self):
+        with self.signal.batch():
+            self.signal.fire("finishAdded", 1)
+            try:
+                with self.signal.batch():
+                    self.signal.fire("finishRemoved", 2)
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEqual(self.events, [("finishAdded", 1)])
+
+    def testNestedBatches(self):
+        with self.signal.batch():
+            with self.signal.batch():
+                self.signal.fire("finishAdded", 1)
+            self.assertEqual(self.events, [])
+            self.assertTrue(self.signal.isBatching())
+        self.assertEqual(self.events, [("finishAdded", 1)])
+        self.assertFalse(self.signal.isBatching())
+
+    def testEmptyBatch(self):
+        with self.signal.batch():
+            pass
+        self.assertEqual(self.genericCalls, [])
+
+    def testResetWritesOnce(self):
+        clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        raceManager = model.race.RaceManager(clock=clock)
+        raceManager.createFleet("Toppers")
+        raceManager.startRaceSequenceWithoutWarning()
+        for i in range(10):
+            raceManager.createFinish()
+        changes = []
+        scheduled = []
+        raceManager.changed.setBackgroundScheduler(scheduled.append)
+        raceManager.changed.connect(None, lambda *args: changes.append(args), PRIORITY_BACKGROUND)
+        raceManager.resetStartSequence()
+        for backgroundCalls in scheduled:
+            backgroundCalls()
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(len(raceManager.finishes), 0)
+
+
+class SignalPriorityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.signal = Signal()
+        self.calls = []
+
+    def handler(self, name):
+        return lambda *args: self.calls.append(name)
+
+    def testCriticalHandlersFirst(self):
+        self.signal.connect(None, self.handler("persistence"), PRIORITY_BACKGROUND)
+        self.signal.connect("generalRecall", self.handler("screen"))
+        self.signal.connect("generalRecall", self.handler("gun"), PRIORITY_CRITICAL)
+        self.signal.connect(None, self.handler("generic"))
+        self.signal.fire("generalRecall", None)
+        self.assertEqual(self.calls, ["gun", "generic", "screen", "persistence"])
+
+    def testCriticalHandlersFirstInBatch(self):
+        self.signal.connect("fleetChanged", self.handler("screen"))
+        self.signal.connect("generalRecall", self.handler("gun"), PRIORITY_CRITICAL)
+        with self.signal.batch():
+            self.signal.fire("fleetChanged", 1)
+            self.signal.fire("generalRecall", 1)
+        self.assertEqual(self.calls, ["gun", "screen"])
+
+    def testBackgroundScheduler(self):
+        scheduled = []
+        self.signal.setBackgroundScheduler(scheduled.append)
+        self.signal.connect(None, self.handler("persistence"), PRIORITY_BACKGROUND)
+        self.signal.connect("finishAdded", self.handler("screen"))
+        self.signal.fire("finishAdded", 1)
+        self.signal.fire("finishAdded", 2)
+        self.assertEqual(self.calls, ["screen", "screen"])
+        # one run scheduled, which writes once
+        self.assertEqual(len(scheduled), 1)
+        scheduled[0]()
+        self.assertEqual(self.calls, ["screen", "screen", "persistence"])
+
+    def testHandlerTimings(self):
+        self.signal.connect("finishAdded", self.handleFinishAdded)
+        self.signal.fire("finishAdded", 1)
+        self.signal.fire("finishAdded", 2)
+        timings = self.signal.handlerTimings()
+        self.assertEqual(len(timings), 1)
+        (name, calls, totalSeconds, maxSeconds) = timings[0]
+        self.assertEqual(name, "SignalPriorityTest.handleFinishAdded")
+        self.assertEqual(calls, 2)
+        self.assertTrue(totalSeconds >= maxSeconds >= 0)
+
+    def handleFinishAdded(self, finish):
+        pass
+
+
+if __name__ == "__main__":
+    unittest.main()
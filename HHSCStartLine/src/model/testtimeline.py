@@ -0,0 +1,194 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import math
+
+import model.race
+from model.clock import SimulatedClock
+from model.timeline import WARNING, PREPARATORY, ONE_MINUTE, START, FLAG_DOWN
+from model.lightpattern import compileLightPattern
+
+class StartTimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        for i in range(3):
+            self.raceManager.createFleet()
+
+    def linearNextFleetToStart(self):
+        for fleet in self.raceManager.fleets:
+            if fleet.isStarting() or fleet.isWaitingToStart():
+                return fleet
+        return None
+
+    def linearLastFleetStarted(self):
+        for fleet in reversed(self.raceManager.fleets):
+            if fleet.isStarted():
+                return fleet
+        return None
+
+    def testNoSequence(self):
+        self.assertEqual(self.raceManager.nextFleetToStart(), None)
+        self.assertEqual(self.raceManager.lastFleetStarted(), None)
+        self.assertEqual(self.raceManager.currentSequencePhase(), None)
+
+    def testMatchesLinearScanThroughSequenceWithRecall(self):
+        self.raceManager.startRaceSequenceWithWarning()
+        for second in range(0, 2000, 7):
+            if second == 616:
+                self.raceManager.generalRecall()
+            self.assertEqual(self.raceManager.nextFleetToStart(), self.linearNextFleetToStart())
+            self.assertEqual(self.raceManager.lastFleetStarted(), self.linearLastFleetStarted())
+            self.clock.advance(7)
+
+    def testSignalsWithWarning(self):
+        self.raceManager.startRaceSequenceWithWarning()
+        firstFleet = self.raceManager.fleets[0]
+
+        # F flag goes up at 10 seconds and the first fleet warning is at 310 seconds
+        kinds = []
+        event = self.raceManager.nextSequenceEvent()
+        while event and event.fleet in (None, firstFleet):
+            kinds.append(event.kind)
+            self.clock.setNow(event.eventTime)
+            event = self.raceManager.nextSequenceEvent()
+        self.assertEqual(kinds, [FLAG_DOWN, WARNING, PREPARATORY, ONE_MINUTE, START])
+        # the second fleet's warning signal is at the same time as the first fleet's start
+        self.assertEqual(self.raceManager.currentSequencePhase(), WARNING)
+
+    def testTimelineRebuiltOnReset(self):
+        self.raceManager.startRaceSequenceWithoutWarning()
+        self.assertTrue(self.raceManager.nextFleetToStart())
+        self.raceManager.resetStartSequence()
+        self.assertEqual(self.raceManager.nextFleetToStart(), None)
+        self.assertEqual(self.raceManager.nextSequenceEvent(), None)
+
+
+class RaceSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        for i in range(3):
+            self.raceManager.createFleet()
+
+    def testSnapshotBeforeSequence(self):
+        snapshot = self.raceManager.snapshot()
+        self.assertEqual([aState.status for aState in snapshot.fleetStates], ["Pending"] * 3)
+        self.assertFalse(snapshot.hasSequenceStarted())
+        self.assertFalse(snapshot.hasStartedFleet())
+
+    def testSnapshotAgreesWithFleets(self):
+        self.raceManager.startRaceSequenceWithoutWarning()
+        self.clock.advance(311)
+        snapshot = self.raceManager.snapshot()
+        self.assertEqual(snapshot.at, self.clock.now())
+        for aFleet in self.raceManager.fleets:
+            aState = snapshot.stateForFleet(aFleet)
+            self.assertEqual(aState.status, aFleet.status())
+            self.assertEqual(aState.deltaSeconds, aFleet.deltaSecondsToStartTime())
+        self.assertEqual(snapshot.lastFleetStarted, self.raceManager.fleets[0])
+        self.assertEqual(snapshot.nextFleetToStart, self.raceManager.fleets[1])
+
+    def testSnapshotAtAnInstant(self):
+        self.raceManager.startRaceSequenceWithoutWarning()
+        firstStart = self.raceManager.fleets[0].startTime
+        snapshot = self.raceManager.snapshot(firstStart + datetime.timedelta(seconds=1))
+        self.assertEqual(snapshot.fleetStates[0].deltaSeconds, 1)
+        self.assertEqual(snapshot.fleetStates[0].status, "Started")
+        # the clock has not moved
+        self.assertEqual(self.raceManager.fleets[0].status(), "Waiting to start")
+
+
+class LightsTimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = model.race.RaceManager(clock=self.clock)
+        for i in range(3):
+            self.raceManager.createFleet()
+
+    #
+    # The lights as they were calculated when the lights were refreshed every 500 milliseconds
+    #
+    def polledLights(self):
+        return (1 << self.polledLightsOn()) - 1
+
+    def polledLightsOn(self):
+        snapshot = self.raceManager.snapshot()
+        if not snapshot.nextFleetToStart:
+            return 0
+        secondsToStart = -1 * snapshot.stateForFleet(snapshot.nextFleetToStart).adjustedDeltaSeconds
+        if secondsToStart > 300:
+            return 0
+        if secondsToStart > 30:
+            return int(math.ceil(secondsToStart / 60.0))
+        if int(secondsToStart * 2) % 2 == 0:
+            return 1
+        return 0
+
+    def testNoLightsWithoutSequence(self):
+        timeline = self.raceManager.timeline()
+        self.assertEqual(timeline.lightsAt(self.clock.now()), 0)
+        self.assertEqual(timeline.nextLightChange(self.clock.now()), None)
+
+    def testMatchesPolledLightsWithRecall(self):
+        self.raceManager.startRaceSequenceWithWarning()
+        # sample between the half seconds, where the polled lights are well defined
+        self.clock.advance(0.25)
+        for tick in range(0, 2000 * 2):
+            if tick == 616 * 2:
+                self.raceManager.generalRecall()
+            self.assertEqual(self.raceManager.timeline().lightsAt(self.clock.now()), self.polledLights())
+            self.clock.advance(0.5)
+
+    def testFlashChangesOnTheHalfSecond(self):
+        self.raceManager.startRaceSequenceWithoutWarning()
+        timeline = self.raceManager.timeline()
+        firstStart = self.raceManager.fleets[0].startTime
+        changes = [lightChange for lightChange in timeline.lightChanges if lightChange.changeTime < firstStart]
+        # five lights, four, three, two, one, then the first light off and on each half second
+        self.assertEqual([lightChange.lights for lightChange in changes], [31, 15, 7, 3, 1] + [0, 1] * 30)
+        for lightChange in changes[5:]:
+            self.assertEqual((firstStart - lightChange.changeTime).total_seconds() % 0.5, 0)
+
+    def testNextFleetLightsAtStart(self):
+        self.raceManager.startRaceSequenceWithoutWarning()
+        timeline = self.raceManager.timeline()
+        firstStart = self.raceManager.fleets[0].startTime
+        # the second fleet's five lights go on as the first fleet starts
+        self.assertEqual(timeline.lightsAt(firstStart), 31)
+        lastStart = self.raceManager.fleets[-1].startTime
+        self.assertEqual(timeline.lightsAt(lastStart), 0)
+        self.assertEqual(timeline.nextLightChange(lastStart), None)
+
+    def testConfiguredLightPattern(self):
+        self.raceManager.setLightPattern(compileLightPattern("180:111,120:110,60:100,0:000", ""))
+        self.raceManager.startRaceSequenceWithoutWarning()
+        timeline = self.raceManager.timeline()
+        lastStart = self.raceManager.fleets[-1].startTime
+        lastChanges = [(lightChange.changeTime, lightChange.lights) for lightChange in timeline.lightChanges[-4:]]
+        self.assertEqual(lastChanges, [(lastStart - datetime.timedelta(seconds=seconds), lights)
+                                       for (seconds, lights) in [(180, 7), (120, 3), (60, 1), (0, 0)]])
+
+    def testLightsOffAfterPatternWithoutStartStep(self):
+        self.raceManager.setLightPattern(compileLightPattern("180:111,120:110,60:100", ""))
+        self.raceManager.startRaceSequenceWithoutWarning()
+        timeline = self.raceManager.timeline()
+        firstStart = self.raceManager.fleets[0].startTime
+        lastStart = self.raceManager.fleets[-1].startTime
+        # the lights are off between the first start and the next fleet's lights
+        self.assertEqual(timeline.lightsAt(firstStart), 0)
+        self.assertEqual(timeline.lightsAt(lastStart - datetime.timedelta(seconds=1)), 1)
+        self.assertEqual(timeline.lightsAt(lastStart), 0)
+        self.assertEqual(timeline.lightChanges[-1], (lastStart, 0))
+        self.assertEqual(timeline.nextLightChange(lastStart), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The start timeline is a compiled, read only view of the start sequence. The race
+# manager builds it from its fleets when the sequence changes (a fleet start time changes,
+# a general recall, a reset) and then answers "what is happening now?" questions by
+# bisection instead of asking every fleet in turn.
+#
+# The timeline holds three sorted tuples:
+#
+# - the start times of the fleets that have a start time, for next fleet to start and
+#   last fleet started
+# - every signal in the sequence: each fleet's warning, preparatory, one minute and start
+#   signals, plus the F flag coming down if the sequence was started with a warning
+# - every change of the start lights, as a relay bitmask, from the light pattern. The
+#   lights count down to the next fleet to start, so each fleet's lights run from the
+#   previous fleet's start to its own start. A fleet's lights go off at its start, unless
+#   the pattern says what they show at the start.
+#
+# Signal times are adjusted by the race manager test speed ratio in the same way as the
+# guns, so that the timeline matches what the race officer hears.
+#
+
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from lightpattern import DEFAULT_LIGHT_PATTERN, LIGHTS_OFF
+
+WARNING = "warning"
+PREPARATORY = "preparatory"
+ONE_MINUTE = "oneMinute"
+START = "start"
+FLAG_DOWN = "flagDown"
+
+#
+# The signals for each fleet, as (kind, seconds before the start)
+#
+FLEET_SIGNALS = [(WARNING, 300), (PREPARATORY, 240), (ONE_MINUTE, 60), (START, 0)]
+
+TimelineEvent = namedtuple("TimelineEvent", ["eventTime", "kind", "fleet"])
+
+LightChange = namedtuple("LightChange", ["changeTime", "lights"])
+
+
+class StartTimeline(object):
+
+    #
+    # The light pattern is a compiled tuple of (seconds before the start, relay bitmask)
+    #
+    def __init__(self, fleets, flagDownTime=None, lightPattern=DEFAULT_LIGHT_PATTERN):
+        startEntries = []
+        eventEntries = []
+
+        for position, fleet in enumerate(fleets):
+            if fleet.hasStartTime():
+                startEntries.append((fleet.startTime, position, fleet))
+                for signalNumber, (kind, secondsBefore) in enumerate(FLEET_SIGNALS):
+                    eventEntries.append((fleet.adjustedTimeBeforeStart(secondsBefore),
+                                         position, signalNumber, kind, fleet))
+
+        if flagDownTime:
+            eventEntries.append((flagDownTime, -1, -1, FLAG_DOWN, None))
+
+        # sort on time, then position in the fleets list, so that we never compare fleets
+        startEntries.sort(key=lambda entry: entry[:2])
+        eventEntries.sort(key=lambda entry: entry[:3])
+
+        self.startTimes = tuple(entry[0] for entry in startEntries)
+        self.startFleets = tuple(entry[2] for entry in startEntries)
+
+        self.events = tuple(TimelineEvent(entry[0], entry[3], entry[4]) for entry in eventEntries)
+        self.eventTimes = tuple(event.eventTime for event in self.events)
+
+        self.lightChanges = self.compileLightChanges(lightPattern)
+        self.lightChangeTimes = tuple(lightChange.changeTime for lightChange in self.lightChanges)
+
+    #
+    # Compile every change of the start lights, in time order. A fleet's lights start at
+    # the previous fleet's start, so a fleet whose start is five minutes after the previous
+    # fleet's puts on five lights as the previous fleet's go out.
+    #
+    def compileLightChanges(self, lightPattern):
+        # a pattern without a step at the start, e.g. 300:11111,...,60:10000, turns the lights
+        # off at the start, so that the last fleet's lights don't stay on
+        if not [secondsBefore for (secondsBefore, lights) in lightPattern if secondsBefore == 0]:
+            lightPattern = tuple(lightPattern) + ((0, LIGHTS_OFF),)
+        lightEntries = []
+        previousStartTime = None
+        for startOrder, fleet in enumerate(self.startFleets):
+            for (secondsBefore, lights) in lightPattern:
+                changeTime = fleet.adjustedTimeBeforeStart(secondsBefore)
+                if previousStartTime is None or changeTime >= previousStartTime:
+                    lightEntries.append((changeTime, startOrder, lights))
+            previousStartTime = fleet.startTime
+        lightEntries.sort(key=lambda entry: entry[:2])
+
+        lightChanges = []
+        for (changeTime, startOrder, lights) in lightEntries:
+            # at the same time, the later fleet's lights win
+            if lightChanges and lightChanges[-1].changeTime == changeTime:
+                lightChanges.pop()
+            if lightChanges and lightChanges[-1].lights == lights:
+                continue
+            if not lightChanges and lights == LIGHTS_OFF:
+                continue
+            lightChanges.append(LightChange(changeTime, lights))
+        return tuple(lightChanges)
+
+    #
+    # The first fleet that has not yet started, i.e. its start time is now or in the future.
+    # Returns None if there is no such fleet.
+    #
+    def nextFleetToStart(self, now):
+        index = bisect_left(self.startTimes, now)
+        if index < len(self.startFleets):
+            return self.startFleets[index]
+        return None
+
+    #
+    # The most recent fleet whose start time is in the past. Returns None if no fleet
+    # has started.
+    #
+    def lastFleetStarted(self, now):
+        index = bisect_left(self.startTimes, now)
+        if index > 0:
+            return self.startFleets[index - 1]
+        return None
+
+    #
+    # The most recent signal at or before now, or None if the sequence hasn't reached
+    # its first signal
+    #
+    def lastEvent(self, now):
+        index = bisect_right(self.eventTimes, now)
+        if index > 0:
+            return self.events[index - 1]
+        return None
+
+    #
+    # The next signal after now, or None if the sequence is complete
+    #
+    def nextEvent(self, now):
+        index = bisect_right(self.eventTimes, now)
+        if index < len(self.events):
+            return self.events[index]
+        return None
+
+    #
+    # The current phase of the sequence is the kind of the most recent signal,
+    # or None before the first signal.
+    #
+    def currentPhase(self, now):
+        event = self.lastEvent(now)
+        if event:
+            return event.kind
+        return None
+
+    #
+    # The start lights now, as a relay bitmask
+    #
+    def lightsAt(self, now):
+        index = bisect_right(self.lightChangeTimes, now)
+        if index > 0:
+            return self.lightChanges[index - 1].lights
+        return LIGHTS_OFF
+
+    #
+    # The next change of the start lights after now, or None if the lights won't change again
+    #
+    def nextLightChange(self, now):
+        index = bisect_right(self.lightChangeTimes, now)
+        if index < len(self.lightChanges):
+            return self.lightChanges[index]
+        return None
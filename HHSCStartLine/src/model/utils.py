@@ -3,22 +3,86 @@ Created on 8 Feb 2014
 
 @author: MBradley
 '''
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from collections import OrderedDict
+import logging
+
+from clock import monotonicSeconds
+
+EPOCH = datetime(1970,1,1)
+
+#
+# Convert a naive datetime to integer microseconds since the epoch, and back. We use
+# these to store times compactly.
+#
+def datetimeToEpochMicros(aTime):
+    delta = aTime - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def epochMicrosToDatetime(micros):
+    if micros is None:
+        return None
+    return EPOCH + timedelta(microseconds=micros)
+
 #
 # Our event handling mechanism,
 # from http://codereview.stackexchange.com/questions/20938/the-observer-design-pattern-in-python-in-a-more-pythonic-way-plus-unit-testing
 #
+# A signal can also be put into batch mode, e.g.
+#
+#    with raceManager.changed.batch():
+#        ...
+#
+# Events fired in a batch are queued and delivered when the outermost batch ends. An event
+# fired more than once with the same arguments is delivered once, in the position it was last
+# fired. Every event delivered goes to the generic handlers as well as its specific handlers,
+# just as it would outside a batch. If the body of a batch raises an exception, the events it
+# fired are dropped rather than delivered.
+#
+# Handlers are connected in a priority lane. For each event, the CRITICAL handlers (guns and
+# lights) are called first, then the NORMAL handlers (the screen), then the BACKGROUND handlers
+# (persistence). Within a lane, generic handlers are called before specific handlers, each in
+# the order they were connected. If the signal is given a background scheduler, e.g. the Tk
+# root's after_idle, BACKGROUND handlers are not called straight away but when the scheduler
+# runs them, in the order they were fired. A generic BACKGROUND handler waiting to run is only
+# run once, with the arguments of the last event, so a bulk operation costs one recovery file
+# write, not one per change.
+#
+# The signal times every handler call. A handler that takes longer than slowHandlerSeconds
+# is logged as a warning, and handlerTimings reports the calls and times for each handler.
+#
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
 class Signal(object):
+    
+    slowHandlerSeconds = 0.02
+    
     def __init__(self):
         self._handlers = {}
         self._genericHandlers =[]
+        self._nextConnection = 0
+        self._batchDepth = 0
+        self._pendingEvents = []
+        self._backgroundScheduler = None
+        self._pendingBackgroundCalls = OrderedDict()
+        self._nextBackgroundCall = 0
+        # [calls, total seconds, max seconds] for each handler name
+        self._handlerStats = {}
 
     #
     # connect to this signal object, specifying the event and the handler. If event
     # is None, then the handler will be called 
     #
-    def connect(self, event,handler):
+    def connect(self, event,handler,priority=PRIORITY_NORMAL):
+        # handlers are kept sorted on (priority, generic before specific, order connected)
+        connection = (priority, event is not None, self._nextConnection, handler)
+        self._nextConnection = self._nextConnection + 1
         if event is None:
-            self._genericHandlers.append(handler)
+            self._genericHandlers.append(connection)
+            self._genericHandlers.sort(key=lambda c: c[:3])
         else:
             if event in self._handlers:
                 # do nothing, we've got a list of handlers for this event
@@ -26,14 +90,128 @@ class Signal(object):
             else:
                 self._handlers[event] = []
              
-            self._handlers[event].append(handler)
+            self._handlers[event].append(connection)
+            self._handlers[event].sort(key=lambda c: c[:3])
+
+    #
+    # Run BACKGROUND handlers through a scheduler, a callable taking a function and its
+    # arguments, e.g. Tk after_idle. None calls them straight away.
+    #
+    def setBackgroundScheduler(self, scheduler):
+        self._backgroundScheduler = scheduler
+
+    #
+    # Deliver events fired within this context when the outermost batch ends
+    #
+    @contextmanager
+    def batch(self):
+        firstEvent = len(self._pendingEvents)
+        self._batchDepth = self._batchDepth + 1
+        try:
+            yield self
+        except:
+            # drop the events fired in this batch, and nothing that an enclosing batch fired before it
+            self._batchDepth = self._batchDepth - 1
+            del self._pendingEvents[firstEvent:]
+            raise
+        self._batchDepth = self._batchDepth - 1
+        if self._batchDepth == 0:
+            self._commit()
+
+    def isBatching(self):
+        return self._batchDepth > 0
+
+    def _commit(self):
+        pendingEvents = self._pendingEvents
+        self._pendingEvents = []
+        if not pendingEvents:
+            return
+
+        # collapse duplicate events, keeping the last of each. Arguments are compared by
+        # identity, e.g. the same finish changed twice.
+        collapsedEvents = []
+        seenEvents = set()
+        for (event, args) in reversed(pendingEvents):
+            key = (event, tuple(id(arg) for arg in args))
+            if not key in seenEvents:
+                seenEvents.add(key)
+                collapsedEvents.append((event, args))
+        collapsedEvents.reverse()
+
+        # call the handlers lane by lane, so that the critical handlers for every event
+        # in the batch are called before any of the others. Within a lane, each event goes
+        # to the generic handlers and then its specific handlers, as it does when fired.
+        calls = []
+        for (eventNumber, (event, args)) in enumerate(collapsedEvents):
+            for connection in self._genericHandlers + self._handlers.get(event, []):
+                calls.append((connection[0], eventNumber, connection[1], connection[2], connection[3], args))
+        calls.sort(key=lambda c: c[:4])
+
+        for (priority, eventNumber, isSpecific, connectionNumber, handler, args) in calls:
+            self._dispatch(priority, not isSpecific, handler, args)
 
     def fire(self, event, *args):
-        # call the generic handlers
-        # then call the specific event handlers
-        for handler in self._genericHandlers:
+        if self._batchDepth:
+            self._pendingEvents.append((event, args))
+            return
+
+        # call the handlers in each lane in turn: the generic handlers
+        # then the specific event handlers
+        connections = self._genericHandlers + self._handlers.get(event, [])
+        connections.sort(key=lambda c: c[:3])
+        for (priority, isSpecific, connectionNumber, handler) in connections:
+            self._dispatch(priority, not isSpecific, handler, args)
+
+    def _dispatch(self, priority, isGeneric, handler, args):
+        if priority == PRIORITY_BACKGROUND and self._backgroundScheduler:
+            if isGeneric:
+                key = (handler,)
+            else:
+                # every specific call is run
+                key = (handler, self._nextBackgroundCall)
+                self._nextBackgroundCall = self._nextBackgroundCall + 1
+            if not self._pendingBackgroundCalls:
+                self._backgroundScheduler(self._runBackgroundCalls)
+            self._pendingBackgroundCalls[key] = (handler, args)
+        else:
+            self._callHandler(handler, args)
+
+    def _runBackgroundCalls(self):
+        pendingCalls = self._pendingBackgroundCalls
+        self._pendingBackgroundCalls = OrderedDict()
+        for (handler, args) in pendingCalls.values():
+            self._callHandler(handler, args)
+
+    def _callHandler(self, handler, args):
+        startSeconds = monotonicSeconds()
+        try:
             handler(*args)
-        
-        if event in self._handlers:
-            for handler in self._handlers[event]:
-                handler(*args)
+        finally:
+            elapsedSeconds = monotonicSeconds() - startSeconds
+            name = handlerName(handler)
+            stats = self._handlerStats.get(name)
+            if stats is None:
+                stats = [0, 0.0, 0.0]
+                self._handlerStats[name] = stats
+            stats[0] = stats[0] + 1
+            stats[1] = stats[1] + elapsedSeconds
+            stats[2] = max(stats[2], elapsedSeconds)
+            if elapsedSeconds > self.slowHandlerSeconds:
+                logging.warning("Slow signal handler %s took %.3f seconds", name, elapsedSeconds)
+
+    #
+    # Return a list of (handler name, calls, total seconds, max seconds), slowest first
+    #
+    def handlerTimings(self):
+        timings = [(name, stats[0], stats[1], stats[2]) for (name, stats) in self._handlerStats.items()]
+        timings.sort(key=lambda timing: timing[2], reverse=True)
+        return timings
+
+    def resetHandlerTimings(self):
+        self._handlerStats = {}
+
+
+def handlerName(handler):
+    if hasattr(handler, "im_self") and handler.im_self is not None:
+        return "%s.%s" % (handler.im_self.__class__.__name__, handler.__name__)
+    return getattr(handler, "__name__", repr(handler))
@@ -0,0 +1,361 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The race archive keeps a permanent record of every race in a local SQLite database, so that
+# a regatta's races, start times, recalls and finishes survive the end of the day. The recovery
+# file is deleted when we exit; the archive is not.
+#
+# A race archiver listens to a race manager and turns each change into rows. A race starts
+# when the start sequence starts and ends when the sequence is reset. The rows are queued for
+# the archive's writer thread, which inserts them in batches with one commit for each batch,
+# so that the Tk event loop never waits on the disk. A batch the database can't take for now, e.g.
+# because it is locked or the disk is full, is kept and written with the next batch, or retried
+# after retrySeconds.
+#
+# The tables are:
+#
+# races - raceId, courseName, startedAt, resetAt
+# fleets - raceId, fleetId, name
+# fleetStarts - raceId, fleetId, startTime, recordedAt. Every start time a fleet is given.
+# recalls - raceId, fleetId, recalledAt
+# finishes - raceId, finishId, finishTime, fleetId, sailNumber, boatClass, py, removed
+#
+# Times are integer microseconds since the epoch. A removed finish is kept, marked as removed,
+# for protests.
+#
+
+import logging
+import sqlite3
+import threading
+import Queue
+
+from model.utils import PRIORITY_BACKGROUND, datetimeToEpochMicros, epochMicrosToDatetime
+
+SCHEMA = [
+    """create table if not exists races (
+        raceId integer primary key, courseName text, startedAt integer, resetAt integer)""",
+    """create table if not exists fleets (
+        raceId integer, fleetId text, name text, primary key (raceId, fleetId))""",
+    """create table if not exists fleetStarts (
+        raceId integer, fleetId text, startTime integer, recordedAt integer)""",
+    """create table if not exists recalls (
+        raceId integer, fleetId text, recalledAt integer)""",
+    """create table if not exists finishes (
+        raceId integer, finishId text, finishTime integer, fleetId text,
+        sailNumber text, boatClass text, py integer, removed integer default 0,
+        primary key (raceId, finishId))""",
+    "create index if not exists racesStartedAt on races (startedAt)",
+    "create index if not exists fleetStartsRaceFleet on fleetStarts (raceId, fleetId)",
+    "create index if not exists recallsRace on recalls (raceId)",
+    "create index if not exists finishesRaceFleet on finishes (raceId, fleetId, finishTime)",
+    "create index if not exists finishesTime on finishes (finishTime)",
+    "create index if not exists finishesSailNumber on finishes (sailNumber)",
+]
+
+INSERT_RACE = "insert into races (raceId, courseName, startedAt) values (?, ?, ?)"
+RESET_RACE = "update races set resetAt = ? where raceId = ?"
+INSERT_FLEET = "insert or replace into fleets (raceId, fleetId, name) values (?, ?, ?)"
+INSERT_FLEET_START = "insert into fleetStarts (raceId, fleetId, startTime, recordedAt) values (?, ?, ?, ?)"
+INSERT_RECALL = "insert into recalls (raceId, fleetId, recalledAt) values (?, ?, ?)"
+INSERT_FINISH = """insert or replace into finishes
+    (raceId, finishId, finishTime, fleetId, sailNumber, boatClass, py, removed)
+    values (?, ?, ?, ?, ?, ?, ?, 0)"""
+REMOVE_FINISH = "update finishes set removed = 1 where raceId = ? and finishId = ?"
+
+
+def timeToMicros(aTime):
+    if aTime is None:
+        return None
+    return datetimeToEpochMicros(aTime)
+
+
+class RaceArchive:
+
+    # the most rows we insert in one transaction
+    maxBatchSize = 1000
+    # how long we wait before we retry a batch that failed
+    retrySeconds = 5
+
+    def __init__(self, databaseFilename):
+        self.databaseFilename = databaseFilename
+        self.rowQueue = Queue.Queue()
+        # set here rather than in run, so that stopping before the thread gets going still stops it
+        self.isRunning = True
+        # set when the thread has written everything and ended
+        self.stopped = threading.Event()
+        self.connection = None
+        # the rows of a batch that failed, which are written before any others
+        self.failedRows = []
+
+        # create the tables and find the next race id on the caller's thread, once, at startup
+        connection = sqlite3.connect(self.databaseFilename)
+        try:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            self.nextRaceId = (connection.execute("select max(raceId) from races").fetchone()[0] or 0) + 1
+        finally:
+            connection.close()
+
+    def newRaceId(self):
+        raceId = self.nextRaceId
+        self.nextRaceId = self.nextRaceId + 1
+        return raceId
+
+    #
+    # Queue a row to be written by a statement
+    #
+    def queueRow(self, statement, row):
+        self.rowQueue.put((statement, row))
+
+    #
+    # This method gets called in its own thread
+    #
+    def run(self):
+        while self.isRunning:
+            try:
+                # wait with a timeout so that the thread can be interrupted, and
+                # finishes writing before we quit
+                firstRow = self.rowQueue.get(block=True, timeout=self.retrySeconds if self.failedRows else 0.25)
+            except Queue.Empty:
+                if self.failedRows:
+                    self.writeRows([])
+                continue
+            self.writeRows([firstRow] + self.takeQueued(self.maxBatchSize - 1))
+        self.writeQueued()
+        if self.failedRows:
+            logging.error("Lost %d rows that could not be written to the race archive" % len(self.failedRows))
+        self.closeConnection()
+        self.stopped.set()
+
+    def takeQueued(self, maxRows):
+        rows = []
+        while len(rows) < maxRows:
+            try:
+                rows.append(self.rowQueue.get(block=False))
+            except Queue.Empty:
+                break
+        return rows
+
+    #
+    # Write everything that is queued, on the caller's thread
+    #
+    def writeQueued(self):
+        rows = self.takeQueued(self.maxBatchSize)
+        while rows or self.failedRows:
+            self.writeRows(rows)
+            if self.failedRows:
+                # the database won't take them yet, so we leave the rest queued
+                return
+            rows = self.takeQueued(self.maxBatchSize)
+
+    #
+    # Write a batch of rows, after any that failed before, in one transaction. Consecutive
+    # rows for the same statement are inserted together with executemany.
+    #
+    def writeRows(self, rows):
+        rows = self.failedRows + rows
+        self.failedRows = []
+        if not self.connection:
+            self.connection = sqlite3.connect(self.databaseFilename)
+        try:
+            statementRows = []
+            for (statement, row) in rows:
+                if statementRows and statementRows[0] != statement:
+                    self.connection.executemany(statementRows[0], statementRows[1])
+                    statementRows = []
+                if not statementRows:
+                    statementRows = [statement, []]
+                statementRows[1].append(row)
+            self.connection.executemany(statementRows[0], statementRows[1])
+            self.connection.commit()
+        except sqlite3.OperationalError:
+            # e.g. the database is locked or the disk is full. We keep the rows and try again.
+            logging.exception("Failed to write %d rows to the race archive, will retry" % len(rows))
+            self.connection.rollback()
+            self.failedRows = rows
+        except sqlite3.Error:
+            # a row the database will never take. We drop it, and write the others one at a time.
+            logging.exception("Failed to write %d rows to the race archive, writing them one at a time" % len(rows))
+            self.connection.rollback()
+            self.writeRowsSeparately(rows)
+
+    def writeRowsSeparately(self, rows):
+        for (index, (statement, row)) in enumerate(rows):
+            try:
+                self.connection.execute(statement, row)
+            except sqlite3.OperationalError:
+                logging.exception("Failed to write a row to the race archive, will retry")
+                self.failedRows = rows[index:]
+                break
+            except sqlite3.Error:
+                logging.exception("Dropped a row the race archive will not take: %s %s" % (statement, row))
+        self.connection.commit()
+
+    def closeConnection(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    #
+    # Stop the writer thread. If waitSeconds is given, we wait up to that long for it to write
+    # what is queued.
+    #
+    def stop(self, waitSeconds=None):
+        self.isRunning = False
+        if waitSeconds is not None:
+            if not self.stopped.wait(waitSeconds):
+                logging.error("The race archive did not finish writing within %s seconds" % waitSeconds)
+
+    #
+    # Queries. These open their own connection, so they can be made from any thread.
+    #
+    def query(self, statement, parameters=()):
+        connection = sqlite3.connect(self.databaseFilename)
+        try:
+            return connection.execute(statement, parameters).fetchall()
+        finally:
+            connection.close()
+
+    #
+    # Returns a list of (raceId, courseName, startedAt, resetAt), oldest first
+    #
+    def races(self):
+        return [(raceId, courseName, epochMicrosToDatetime(startedAt), epochMicrosToDatetime(resetAt))
+                for (raceId, courseName, startedAt, resetAt)
+                in self.query("select raceId, courseName, startedAt, resetAt from races order by startedAt")]
+
+    #
+    # Returns a list of (fleetId, startTime) for a race, in the order the start times were given
+    #
+    def fleetStartsForRace(self, raceId):
+        return [(fleetId, epochMicrosToDatetime(startTime)) for (fleetId, startTime) in
+                self.query("select fleetId, startTime from fleetStarts where raceId = ? order by rowid", (raceId,))]
+
+    def recallsForRace(self, raceId):
+        return [(fleetId, epochMicrosToDatetime(recalledAt)) for (fleetId, recalledAt) in
+                self.query("select fleetId, recalledAt from recalls where raceId = ? order by recalledAt", (raceId,))]
+
+    #
+    # Returns a list of (finishId, finishTime, fleetId, sailNumber) for a race, in finish time
+    # order, optionally for one fleet. Removed finishes are not included.
+    #
+    def finishesForRace(self, raceId, fleetId=None):
+        statement = "select finishId, finishTime, fleetId, sailNumber from finishes where raceId = ? and removed = 0"
+        parameters = [raceId]
+        if fleetId is not None:
+            statement = statement + " and fleetId = ?"
+            parameters.append(fleetId)
+        return [(finishId, epochMicrosToDatetime(finishTime), aFleetId, sailNumber)
+                for (finishId, finishTime, aFleetId, sailNumber)
+                in self.query(statement + " order by finishTime", parameters)]
+
+    #
+    # Returns a list of (raceId, finishId, finishTime) for every finish of a boat, e.g. for a protest
+    #
+    def finishesForSailNumber(self, sailNumber):
+        return [(raceId, finishId, epochMicrosToDatetime(finishTime)) for (raceId, finishId, finishTime) in
+                self.query("select raceId, finishId, finishTime from finishes where sailNumber = ? and removed = 0 "
+                           "order by finishTime", (sailNumber,))]
+
+
+#
+# The race archiver records the changes to a race manager in the race archive
+#
+class RaceArchiver:
+
+    def __init__(self, raceArchive, raceManager, courseName=None):
+        self.raceArchive = raceArchive
+        self.raceManager = raceManager
+        self.courseName = courseName
+        # the race we are recording, None until the start sequence starts
+        self.raceId = None
+        # True while we hear about the finishes a reset removes
+        self.isResetting = False
+        self.wireArchiver()
+
+    def wireArchiver(self):
+        changed = self.raceManager.changed
+        changed.connect("sequenceStartedWithWarning", self.handleSequenceStarted, PRIORITY_BACKGROUND)
+        changed.connect("sequenceStartedWithoutWarning", self.handleSequenceStarted, PRIORITY_BACKGROUND)
+        changed.connect("startSequenceResetting", self.handleStartSequenceResetting, PRIORITY_BACKGROUND)
+        changed.connect("startSequenceReset", self.handleStartSequenceReset, PRIORITY_BACKGROUND)
+        changed.connect("fleetAdded", self.handleFleetAdded, PRIORITY_BACKGROUND)
+        changed.connect("fleetChanged", self.handleFleetChanged, PRIORITY_BACKGROUND)
+        changed.connect("generalRecall", self.handleGeneralRecall, PRIORITY_BACKGROUND)
+        changed.connect("finishAdded", self.handleFinishChanged, PRIORITY_BACKGROUND)
+        changed.connect("finishesAdded", self.handleFinishesAdded, PRIORITY_BACKGROUND)
+        changed.connect("finishChanged", self.handleFinishChanged, PRIORITY_BACKGROUND)
+        changed.connect("finishRemoved", self.handleFinishRemoved, PRIORITY_BACKGROUND)
+
+    def now(self):
+        return timeToMicros(self.raceManager.clock.now())
+
+    #
+    # The race we are recording. If we are given a change before the sequence has started,
+    # e.g. a recovered race, we start a race for it.
+    #
+    def currentRaceId(self):
+        if self.raceId is None:
+            self.raceId = self.raceArchive.newRaceId()
+            self.raceArchive.queueRow(INSERT_RACE, (self.raceId, self.courseName, self.now()))
+            for aFleet in self.raceManager.fleets:
+                self.raceArchive.queueRow(INSERT_FLEET, (self.raceId, aFleet.fleetId, aFleet.name))
+        return self.raceId
+
+    def handleSequenceStarted(self):
+        # the start times have already been recorded against the race, so we start it now
+        self.currentRaceId()
+
+    def handleStartSequenceResetting(self):
+        self.isResetting = True
+
+    def handleStartSequenceReset(self):
+        self.isResetting = False
+        if self.raceId is not None:
+            self.raceArchive.queueRow(RESET_RACE, (self.now(), self.raceId))
+            self.raceId = None
+
+    #
+    # A fleet added before the sequence starts is recorded when the race starts
+    #
+    def handleFleetAdded(self, aFleet):
+        if self.raceId is not None:
+            self.raceArchive.queueRow(INSERT_FLEET, (self.raceId, aFleet.fleetId, aFleet.name))
+
+    def handleFleetChanged(self, aFleet):
+        raceId = self.currentRaceId()
+        self.raceArchive.queueRow(INSERT_FLEET, (raceId, aFleet.fleetId, aFleet.name))
+        if aFleet.hasStartTime():
+            self.raceArchive.queueRow(INSERT_FLEET_START, (raceId, aFleet.fleetId, timeToMicros(aFleet.startTime), self.now()))
+
+    def handleGeneralRecall(self, aFleet):
+        self.raceArchive.queueRow(INSERT_RECALL, (self.currentRaceId(), aFleet.fleetId, self.now()))
+
+    def handleFinishChanged(self, aFinish):
+        fleetId = None
+        if aFinish.hasFleet():
+            fleetId = aFinish.fleet.fleetId
+        (sailNumber, boatClass, py) = (None, None, None)
+        if aFinish.boat:
+            (sailNumber, boatClass, py) = (aFinish.boat.sailNumber, aFinish.boat.boatClass, aFinish.boat.py)
+        self.raceArchive.queueRow(INSERT_FINISH, (self.currentRaceId(), aFinish.finishId,
+                                                  timeToMicros(aFinish.finishTime), fleetId, sailNumber, boatClass, py))
+
+    def handleFinishesAdded(self, finishes):
+        for aFinish in finishes:
+            self.handleFinishChanged(aFinish)
+
+    #
+    # Resetting the start sequence removes all of the finishes, between the startSequenceResetting
+    # and startSequenceReset events. These are kept as the finishes of the race that has ended,
+    # rather than marked as removed.
+    #
+    def handleFinishRemoved(self, aFinish):
+        if self.isResetting:
+            return
+        self.raceArchive.queueRow(REMOVE_FINISH, (self.currentRaceId(), aFinish.finishId))
@@ -0,0 +1,126 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# Benchmark for recovering after a crash. For race days of 10, 1,000 and 20,000 finishes,
+# we write a recovery file (a snapshot with a tail of journal records, as it would be part
+# way through the day) and measure:
+#
+# recover - loading the snapshot and replaying the journal
+# pickle - loading the same race manager from a pickle, as recovery used to
+# snapshot size - the size of the snapshot in the race file format, and pickled
+# first frame - recovering, building the window and the screen controller, and Tk drawing
+#   the first frame. This needs a display, and is skipped without one. It doesn't need the
+#   audio libraries.
+#
+# Run from the src directory:
+#
+#   python -m persistence.benchmark
+#
+
+import datetime
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+from model.race import RaceManager
+from model.clock import SimulatedClock
+from persistence.recovery import RaceRecoveryManager
+from persistence import journal, raceformat
+
+RACE_SIZES = [10, 1000, 20000]
+
+# the share of the finishes written to the journal after the last snapshot
+JOURNAL_TAIL = 0.1
+
+
+#
+# Write the recovery files for a race with a number of finishes
+#
+def writeRace(pickleFilename, numberFinishes):
+    clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+    raceManager = RaceManager(clock=clock)
+    for name in ["Large handicap", "Small handicap", "Toppers"]:
+        raceManager.createFleet(name)
+    raceManager.startRaceSequenceWithWarning()
+    clock.advance(1800)
+
+    recoveryManager = RaceRecoveryManager(pickleFilename, raceManager)
+    recoveryManager.compactAfterRecords = max(1, int(numberFinishes * (1 - JOURNAL_TAIL)))
+    for finishNumber in range(numberFinishes):
+        clock.advance(1)
+        fleet = raceManager.fleets[finishNumber % len(raceManager.fleets)]
+        raceManager.createFinish(fleet=fleet)
+    recoveryManager.recoveryWriter.writeQueued()
+    recoveryManager.closeJournal()
+    return raceManager
+
+
+def timeRecover(pickleFilename):
+    startSeconds = time.time()
+    raceManager = RaceRecoveryManager(pickleFilename, None).recoverRaceManager()
+    return (time.time() - startSeconds, raceManager)
+
+
+def timePickle(raceManager):
+    pickledRaceManager = pickle.dumps(raceManager, pickle.HIGHEST_PROTOCOL)
+    startSeconds = time.time()
+    pickle.loads(pickledRaceManager)
+    return time.time() - startSeconds
+
+
+def snapshotSizes(raceManager):
+    snapshot = journal.takeSnapshot(raceManager, 0)
+    return (len(raceformat.encodeSnapshot(snapshot)), len(pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)))
+
+
+def timeFirstFrame(pickleFilename):
+    try:
+        from screenui.raceview import StartLineFrame
+        from controllers.controllers import ScreenController
+    except ImportError as e:
+        return "skipped (%s)" % e
+
+    startSeconds = time.time()
+    raceManager = RaceRecoveryManager(pickleFilename, None).recoverRaceManager()
+    try:
+        app = StartLineFrame()
+    except Exception as e:
+        return "skipped (%s)" % e
+    screenController = ScreenController(app, raceManager, None, None, None, [], 10)
+    screenController.start()
+    app.update_idletasks()
+    app.update()
+    firstFrameSeconds = time.time() - startSeconds
+    app.master.destroy()
+    return "%.3f s" % firstFrameSeconds
+
+
+def runBenchmark():
+    directory = tempfile.mkdtemp()
+    try:
+        for numberFinishes in RACE_SIZES:
+            pickleFilename = os.path.join(directory, "race%d.dmp" % numberFinishes)
+            raceManager = writeRace(pickleFilename, numberFinishes)
+            (recoverSeconds, recovered) = timeRecover(pickleFilename)
+            assert len(recovered.finishes) == numberFinishes
+            pickleSeconds = timePickle(raceManager)
+            (formatSize, pickleSize) = snapshotSizes(raceManager)
+            firstFrame = timeFirstFrame(pickleFilename)
+            sys.stdout.write("%6d finishes: recover %.3f s, pickle %.3f s, snapshot %d bytes (pickled %d), first frame %s\n" %
+                             (numberFinishes, recoverSeconds, pickleSeconds, formatSize, pickleSize, firstFrame))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    runBenchmark()
@@ -0,0 +1,268 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The results exporter writes a race's results to a CSV, JSON lines or HTML file, fleet by
+# fleet in place order, with finishes that have no fleet at the end.
+#
+# The export is a pipeline of generators: resultRows generates a row for each finish, and a
+# formatter (csvLines, jsonLines or htmlLines) generates the text for each row, which is
+# written to the file as it is generated. Nothing holds the whole export in memory.
+#
+# Taking a copy of the race is the only part done on the Tk thread. It copies the fleets'
+# and finishes' ids, names and times into tuples, which is cheap, and gives the exporter's
+# thread a consistent copy that the race manager can't change underneath it. Calculating
+# the results and writing the file are done on the exporter's own thread, so that exporting
+# a full day of finishes never stalls the start line.
+#
+
+import cgi
+import csv
+import datetime
+import json
+import logging
+import os
+import Queue
+from collections import namedtuple
+
+from model.results import rankFinishes, placesForCorrectedSeconds
+
+CSV = "csv"
+JSON_LINES = "jsonl"
+HTML = "html"
+
+FORMATS_BY_EXTENSION = {".csv": CSV, ".jsonl": JSON_LINES, ".json": JSON_LINES, ".html": HTML, ".htm": HTML}
+
+ExportFleet = namedtuple("ExportFleet", ["fleetId", "name", "startTime"])
+ExportFinish = namedtuple("ExportFinish", ["finishId", "finishTime", "fleetId", "sailNumber", "boatClass", "py"])
+RaceCopy = namedtuple("RaceCopy", ["fleets", "finishes"])
+
+ExportRow = namedtuple("ExportRow", ["fleetName", "place", "finishId", "sailNumber", "boatClass", "py",
+                                     "finishTime", "elapsedSeconds", "correctedSeconds"])
+
+COLUMN_TITLES = ["Fleet", "Place", "Finish", "Sail number", "Class", "PY",
+                 "Finish time", "Elapsed", "Corrected"]
+
+
+#
+# Copy the fleets and finishes of a race manager, on the Tk thread
+#
+def copyRace(raceManager):
+    fleets = [ExportFleet(aFleet.fleetId, aFleet.name, aFleet.startTime) for aFleet in raceManager.fleets]
+    finishes = []
+    for aFinish in raceManager.finishes:
+        fleetId = None
+        if aFinish.hasFleet():
+            fleetId = aFinish.fleet.fleetId
+        aBoat = aFinish.boat
+        if aBoat:
+            finishes.append(ExportFinish(aFinish.finishId, aFinish.finishTime, fleetId,
+                                         aBoat.sailNumber, aBoat.boatClass, aBoat.py))
+        else:
+            finishes.append(ExportFinish(aFinish.finishId, aFinish.finishTime, fleetId, None, None, None))
+    return RaceCopy(fleets, finishes)
+
+
+def formatForFilename(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return FORMATS_BY_EXTENSION.get(extension, CSV)
+
+
+#
+# Generate the result rows for a copy of a race. A fleet's finishes are ranked and placed as the
+# results engine does, so finishes with the same corrected time share a place. A fleet that
+# hasn't started, and finishes without a fleet, have no place or times.
+#
+def resultRows(raceCopy):
+    finishesByFleetId = {}
+    for aFinish in raceCopy.finishes:
+        finishesByFleetId.setdefault(aFinish.fleetId, []).append(aFinish)
+
+    for aFleet in raceCopy.fleets:
+        for row in fleetRows(aFleet, finishesByFleetId.pop(aFleet.fleetId, [])):
+            yield row
+
+    # finishes without a fleet, or for a fleet that has been removed
+    for fleetId in sorted(finishesByFleetId, key=lambda fleetId: fleetId is not None):
+        for aFinish in finishesByFleetId[fleetId]:
+            yield ExportRow(None, None, aFinish.finishId, aFinish.sailNumber, aFinish.boatClass, aFinish.py,
+                            aFinish.finishTime, None, None)
+
+
+def fleetRows(aFleet, finishes):
+    if aFleet.startTime is None:
+        for aFinish in finishes:
+            yield ExportRow(aFleet.name, None, aFinish.finishId, aFinish.sailNumber, aFinish.boatClass, aFinish.py,
+                            aFinish.finishTime, None, None)
+        return
+
+    rankedFinishes = rankFinishes([((aFinish.finishTime - aFleet.startTime).total_seconds(), aFinish.py, aFinish)
+                                   for aFinish in finishes])
+    places = placesForCorrectedSeconds([corrected for (corrected, elapsed, aFinish) in rankedFinishes])
+    for place, (corrected, elapsed, aFinish) in zip(places, rankedFinishes):
+        yield ExportRow(aFleet.name, place, aFinish.finishId, aFinish.sailNumber, aFinish.boatClass, aFinish.py,
+                        aFinish.finishTime, elapsed, corrected)
+
+
+#
+# Format a number of seconds as h:mm:ss
+#
+def formatSeconds(seconds):
+    if seconds is None:
+        return ""
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+def formatTime(aTime):
+    if aTime is None:
+        return ""
+    return aTime.strftime("%H:%M:%S")
+
+
+def textValues(row):
+    return [row.fleetName or "", row.place or "", row.finishId, row.sailNumber or "", row.boatClass or "",
+            row.py or "", formatTime(row.finishTime), formatSeconds(row.elapsedSeconds),
+            formatSeconds(row.correctedSeconds)]
+
+
+def encodeText(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+#
+# csv.writer writes to a file. We give it one that keeps the last line, so that we can
+# generate the lines one at a time.
+#
+class LastLine(object):
+
+    def __init__(self):
+        self.line = None
+
+    def write(self, line):
+        self.line = line
+
+
+def csvLines(rows):
+    lastLine = LastLine()
+    writer = csv.writer(lastLine)
+    writer.writerow(COLUMN_TITLES)
+    yield lastLine.line
+    for row in rows:
+        writer.writerow([encodeText(value) for value in textValues(row)])
+        yield lastLine.line
+
+
+def jsonLines(rows):
+    for row in rows:
+        values = row._asdict()
+        if row.finishTime is not None:
+            values["finishTime"] = row.finishTime.isoformat()
+        yield json.dumps(values) + "\n"
+
+
+def htmlLines(rows, title="Results"):
+    yield "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+    yield "<title>%s</title>\n</head>\n<body>\n<h1>%s</h1>\n" % (htmlText(title), htmlText(title))
+    fleetName = False
+    for row in rows:
+        if row.fleetName != fleetName:
+            if fleetName is not False:
+                yield "</table>\n"
+            fleetName = row.fleetName
+            yield "<h2>%s</h2>\n<table>\n" % htmlText(fleetName or "No fleet")
+            yield "<tr>%s</tr>\n" % "".join("<th>%s</th>" % htmlText(columnTitle) for columnTitle in COLUMN_TITLES[1:])
+        yield "<tr>%s</tr>\n" % "".join("<td>%s</td>" % htmlText(value) for value in textValues(row)[1:])
+    if fleetName is not False:
+        yield "</table>\n"
+    yield "</body>\n</html>\n"
+
+
+def htmlText(value):
+    return encodeText(cgi.escape(value if isinstance(value, unicode) else str(value), quote=True))
+
+
+def exportLines(raceCopy, exportFormat, title="Results"):
+    rows = resultRows(raceCopy)
+    if exportFormat == JSON_LINES:
+        return jsonLines(rows)
+    if exportFormat == HTML:
+        return htmlLines(rows, title)
+    return csvLines(rows)
+
+
+#
+# Write the lines of an export to a file as they are generated. We write to a temporary file
+# and rename it, so that a failed export doesn't leave half a results file.
+#
+def writeExport(lines, filename):
+    temporaryFilename = filename + ".tmp"
+    exportFile = open(temporaryFilename, "wb")
+    try:
+        for line in lines:
+            exportFile.write(line)
+    finally:
+        exportFile.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporaryFilename, filename)
+
+
+#
+# The results exporter writes the exports queued to it in its own thread. It is shared by
+# all of the courses.
+#
+class ResultsExporter:
+
+    def __init__(self):
+        self.exportQueue = Queue.Queue()
+        # set here rather than in run, so that stopping before the thread gets going still stops it
+        self.isRunning = True
+        self.exportCount = 0
+
+    #
+    # Queue an export of a race manager. This is called on the Tk thread, and only copies the race.
+    #
+    def exportRace(self, raceManager, filename, exportFormat=None, title="Results"):
+        if exportFormat is None:
+            exportFormat = formatForFilename(filename)
+        self.exportQueue.put((copyRace(raceManager), filename, exportFormat, title))
+
+    #
+    # This method gets called in its own thread
+    #
+    def run(self):
+        while self.isRunning:
+            try:
+                # wait with a timeout so that the thread can be interrupted
+                export = self.exportQueue.get(block=True, timeout=0.25)
+            except Queue.Empty:
+                continue
+            self.export(*export)
+        self.exportQueued()
+
+    #
+    # Write everything that is queued, on the caller's thread
+    #
+    def exportQueued(self):
+        while True:
+            try:
+                export = self.exportQueue.get(block=False)
+            except Queue.Empty:
+                return
+            self.export(*export)
+
+    def export(self, raceCopy, filename, exportFormat, title):
+        try:
+            writeExport(exportLines(raceCopy, exportFormat, title), filename)
+            self.exportCount = self.exportCount + 1
+            logging.info("Exported %d finishes to %s" % (len(raceCopy.finishes), filename))
+        except (IOError, OSError) as e:
+            logging.exception("Failed to export results to %s: %s" % (filename, e))
+
+    def stop(self):
+        self.isRunning = False
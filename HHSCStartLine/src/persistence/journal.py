@@ -0,0 +1,240 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The journal is an append-only log of the changes made to a race manager. Rather than
+# pickling the whole race manager every time a finish is added, the recovery manager appends
+# a small record for each change to the journal file. From time to time it compacts the
+# journal: it writes a snapshot of the race manager and starts an empty journal.
+#
+# To recover, we load the snapshot and replay the journal records written after it.
+#
+# Each record is a tuple of the journal sequence number, the kind of record, and plain values
+# (ids, names, times as integer microseconds since the epoch). Records never hold model
+# objects, so that a record is small and is not affected by later changes to the model.
+#
+# fleetAdded - fleetId, name, startTime
+# fleetRemoved - fleetId
+# fleetChanged - fleetId, startTime
+# sequenceStarted - fFlagDownTime
+# startSequenceReset
+# finishAdded - finishId, finishTime, fleetId, boat
+# finishChanged - finishId, fleetId, boat
+# finishRemoved - finishId
+#
+# A boat is recorded as (sailNumber, boatClass, py, fleetName), or None.
+#
+# Records are written one after another into the journal file in the race file format, see
+# persistence.raceformat. A record torn by a crash part way through a write is the last record
+# in the file, and is ignored when the journal is read.
+#
+# A snapshot is written in the same terms: the records that build the race manager from
+# scratch, with the journal sequence number and the race manager's next ids. Taking a
+# snapshot only copies ids, names and times, so it is cheap enough to do on the Tk thread,
+# and gives the recovery writer a consistent copy of the race to serialise on its own thread.
+#
+
+import logging
+
+from model.race import Fleet, Finish, Boat
+from model.finishstore import FinishStore
+from model.utils import datetimeToEpochMicros, epochMicrosToDatetime
+
+FLEET_ADDED = "fleetAdded"
+FLEET_REMOVED = "fleetRemoved"
+FLEET_CHANGED = "fleetChanged"
+SEQUENCE_STARTED = "sequenceStarted"
+START_SEQUENCE_RESET = "startSequenceReset"
+FINISH_ADDED = "finishAdded"
+FINISH_CHANGED = "finishChanged"
+FINISH_REMOVED = "finishRemoved"
+
+# the largest py the race file format can hold
+MAX_PY = 0xffff
+
+
+def timeToMicros(aTime):
+    if aTime is None:
+        return None
+    return datetimeToEpochMicros(aTime)
+
+
+def fleetIdForFinish(aFinish):
+    if aFinish.hasFleet():
+        return aFinish.fleet.fleetId
+    return None
+
+
+def boatRecord(aBoat):
+    if aBoat is None:
+        return None
+    return (aBoat.sailNumber, aBoat.boatClass, pyRecord(aBoat.py), aBoat.fleetName)
+
+#
+# A py is recorded as a whole number from 1 to MAX_PY, or None. A py we can't record is
+# logged and recorded as None, rather than stopping the journal.
+#
+def pyRecord(py):
+    if py is None or py == "":
+        return None
+    if isinstance(py, float) and py.is_integer():
+        py = int(py)
+    try:
+        wholePY = int(str(py).strip())
+    except ValueError:
+        wholePY = 0
+    if not 0 < wholePY <= MAX_PY:
+        logging.warning("Recording a PY of %r as no PY" % (py,))
+        return None
+    return wholePY
+
+
+#
+# Functions that create the record (without its sequence number) for a change
+#
+def fleetAddedRecord(aFleet):
+    return (FLEET_ADDED, aFleet.fleetId, aFleet.name, timeToMicros(aFleet.startTime))
+
+def fleetRemovedRecord(aFleet):
+    return (FLEET_REMOVED, aFleet.fleetId)
+
+def fleetChangedRecord(aFleet):
+    return (FLEET_CHANGED, aFleet.fleetId, timeToMicros(aFleet.startTime))
+
+def sequenceStartedRecord(raceManager):
+    return (SEQUENCE_STARTED, timeToMicros(raceManager.fFlagDownTime))
+
+def startSequenceResetRecord():
+    return (START_SEQUENCE_RESET,)
+
+def finishAddedRecord(aFinish):
+    return (FINISH_ADDED, aFinish.finishId, timeToMicros(aFinish.finishTime),
+            fleetIdForFinish(aFinish), boatRecord(aFinish.boat))
+
+def finishChangedRecord(aFinish):
+    return (FINISH_CHANGED, aFinish.finishId, fleetIdForFinish(aFinish), boatRecord(aFinish.boat))
+
+def finishRemovedRecord(aFinish):
+    return (FINISH_REMOVED, aFinish.finishId)
+
+
+#
+# A snapshot of a race manager, as of a journal sequence number
+#
+class Snapshot(object):
+
+    def __init__(self, sequence, nextFleetId, nextFinishId, records):
+        self.sequence = sequence
+        self.nextFleetId = nextFleetId
+        self.nextFinishId = nextFinishId
+        self.records = records
+
+    def __getstate__(self):
+        return (self.sequence, self.nextFleetId, self.nextFinishId, self.records)
+
+    def __setstate__(self, state):
+        (self.sequence, self.nextFleetId, self.nextFinishId, self.records) = state
+
+    #
+    # Build a new race manager from the snapshot. The finishes in a snapshot are in finish
+    # time order, so we build them in bulk rather than replaying them one at a time.
+    #
+    def restore(self, raceManager):
+        finishes = []
+        for record in self.records:
+            if record[0] == FINISH_ADDED:
+                (finishId, finishTime, fleetId, boat) = record[1:]
+                aFinish = Finish(finishTime=epochMicrosToDatetime(finishTime),
+                                 fleet=raceManager.fleetWithId(fleetId), finishId=finishId)
+                replayBoat(aFinish, boat)
+                finishes.append(aFinish)
+            else:
+                replayRecord(raceManager, record[0], record[1:])
+        raceManager.finishes = FinishStore(finishes)
+        raceManager.nextFleetId = self.nextFleetId
+        raceManager.nextFinishId = self.nextFinishId
+        return raceManager
+
+
+def takeSnapshot(raceManager, sequence):
+    records = [fleetAddedRecord(aFleet) for aFleet in raceManager.fleets]
+    records.append(sequenceStartedRecord(raceManager))
+    records.extend(finishAddedRecord(aFinish) for aFinish in raceManager.finishes)
+    return Snapshot(sequence, raceManager.nextFleetId, raceManager.nextFinishId, records)
+
+
+#
+# Replay the records after a sequence number onto a race manager. Returns the sequence
+# number of the last record replayed.
+#
+def replayRecords(raceManager, records, afterSequence=0):
+    lastSequence = afterSequence
+    for record in records:
+        sequence = record[0]
+        if sequence <= afterSequence:
+            continue
+        replayRecord(raceManager, record[1], record[2:])
+        lastSequence = sequence
+    return lastSequence
+
+
+def replayRecord(raceManager, kind, values):
+    if kind == FLEET_ADDED:
+        (fleetId, name, startTime) = values
+        aFleet = Fleet(name=name, startTime=epochMicrosToDatetime(startTime), fleetId=fleetId)
+        raceManager.addFleet(aFleet)
+        raceManager.nextFleetId = max(raceManager.nextFleetId, int(fleetId) + 1)
+
+    elif kind == FLEET_REMOVED:
+        aFleet = raceManager.fleetWithId(values[0])
+        if aFleet:
+            raceManager.removeFleet(aFleet)
+
+    elif kind == FLEET_CHANGED:
+        (fleetId, startTime) = values
+        aFleet = raceManager.fleetWithId(fleetId)
+        if aFleet:
+            raceManager.updateFleetStartTime(aFleet, epochMicrosToDatetime(startTime))
+
+    elif kind == SEQUENCE_STARTED:
+        raceManager.fFlagDownTime = epochMicrosToDatetime(values[0])
+        raceManager.invalidateTimeline()
+
+    elif kind == START_SEQUENCE_RESET:
+        raceManager.resetStartSequence()
+
+    elif kind == FINISH_ADDED:
+        (finishId, finishTime, fleetId, boat) = values
+        aFinish = Finish(finishTime=epochMicrosToDatetime(finishTime),
+                         fleet=raceManager.fleetWithId(fleetId), finishId=finishId)
+        replayBoat(aFinish, boat)
+        raceManager.addFinish(aFinish)
+        raceManager.nextFinishId = max(raceManager.nextFinishId, int(finishId) + 1)
+
+    elif kind == FINISH_CHANGED:
+        (finishId, fleetId, boat) = values
+        aFinish = raceManager.finishWithId(finishId)
+        if aFinish:
+            aFinish.fleet = raceManager.fleetWithId(fleetId)
+            replayBoat(aFinish, boat)
+            raceManager.updateFinish(aFinish)
+
+    elif kind == FINISH_REMOVED:
+        aFinish = raceManager.finishWithId(values[0])
+        if aFinish:
+            raceManager.removeFinish(aFinish)
+
+    else:
+        logging.warning("Ignoring unknown journal record %s" % kind)
+
+
+def replayBoat(aFinish, boat):
+    if boat is None:
+        aFinish.boat = None
+    else:
+        aBoat = Boat(*boat)
+        aBoat.finish = aFinish
+        aFinish.boat = aBoat
@@ -0,0 +1,123 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# Migrate the recovery files pickled by versions before the race file format. Recovery only
+# reads the race file format, as loading a pickle runs whatever code the file asks it to, so
+# a race in progress when we upgrade can only be recovered after the operator has migrated
+# its recovery files, from media they trust. Run from the src directory:
+#
+#   python -m persistence.migrate c:\users\mbradley\var\startline\currentRace.dmp
+#
+# The snapshot and the journal are rewritten in the race file format. The pickled files are
+# kept alongside, with .pickled added to their names. Files already in the race file format
+# are left alone.
+#
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import os
+import sys
+
+from model.race import RaceManager
+from persistence import journal, raceformat
+from persistence.recovery import RaceRecoveryManager
+
+PICKLED_SUFFIX = ".pickled"
+
+
+#
+# Read a pickled snapshot. Returns the sequence number of the last journal record in it and
+# the race manager.
+#
+def readPickledSnapshot(snapshotFilename):
+    snapshotFile = open(snapshotFilename, "rb")
+    try:
+        snapshot = pickle.load(snapshotFile)
+    finally:
+        snapshotFile.close()
+    if isinstance(snapshot, journal.Snapshot):
+        return (snapshot.sequence, snapshot.restore(RaceManager()))
+    # the first recovery files with a journal hold a tuple of the sequence number and the
+    # race manager, and before the journal, just the race manager
+    if isinstance(snapshot, tuple):
+        return snapshot
+    return (0, snapshot)
+
+
+#
+# Generate the records in a pickled journal, stopping at the end of the file or at a torn record
+#
+def readPickledRecords(journalFile):
+    while True:
+        try:
+            record = pickle.load(journalFile)
+        except EOFError:
+            return
+        except Exception:
+            sys.stderr.write("Ignoring torn record at the end of the journal\n")
+            return
+        yield record
+
+
+def isPickledFile(filename):
+    return os.path.exists(filename) and os.path.getsize(filename) > 0 and not raceformat.isRaceFormatFile(filename)
+
+
+def keepPickledFile(filename):
+    os.rename(filename, filename + PICKLED_SUFFIX)
+
+
+#
+# Migrate the recovery files for a recovery filename. Returns the names of the files migrated.
+#
+def migrateRecoveryFiles(pickleFilename):
+    recoveryManager = RaceRecoveryManager(pickleFilename, None)
+    migrated = []
+
+    # as in recovery, we read the temporary file if we crashed before renaming it
+    snapshotFilename = pickleFilename
+    if not os.path.exists(snapshotFilename):
+        snapshotFilename = recoveryManager.temporaryFilename()
+    if isPickledFile(snapshotFilename):
+        (sequence, raceManager) = readPickledSnapshot(snapshotFilename)
+        contents = raceformat.encodeSnapshot(journal.takeSnapshot(raceManager, sequence))
+        keepPickledFile(snapshotFilename)
+        snapshotFile = open(pickleFilename, "wb")
+        try:
+            snapshotFile.write(contents)
+        finally:
+            snapshotFile.close()
+        migrated.append(snapshotFilename)
+
+    journalFilename = recoveryManager.journalFilename
+    if isPickledFile(journalFilename):
+        journalFile = open(journalFilename, "rb")
+        try:
+            records = list(readPickledRecords(journalFile))
+        finally:
+            journalFile.close()
+        keepPickledFile(journalFilename)
+        journalFile = open(journalFilename, "wb")
+        try:
+            raceformat.JournalWriter(journalFile, True).writeRecords(records)
+        finally:
+            journalFile.close()
+        migrated.append(journalFilename)
+    return migrated
+
+
+if __name__ == '__main__':
+    if not len(sys.argv) == 2:
+        sys.stderr.write("Usage: python -m persistence.migrate recoveryFilename\n")
+        exit(1)
+    migratedFilenames = migrateRecoveryFiles(sys.argv[1])
+    for filename in migratedFilenames:
+        sys.stdout.write("Migrated %s, the pickled file is kept as %s%s\n" % (filename, filename, PICKLED_SUFFIX))
+    if not migratedFilenames:
+        sys.stdout.write("Nothing to migrate\n")
@@ -0,0 +1,315 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The race file format is a versioned binary format for the recovery snapshot and journal. It
+# replaces pickle, which is slow, tied to the layout of our classes and unsafe to load from
+# a file we didn't write.
+#
+# A file starts with a header:
+#
+#   magic - 4 bytes, "HSRF"
+#   version - unsigned short, currently 1
+#   file type - unsigned byte, 1 for a snapshot, 2 for a journal
+#   reserved - unsigned byte, 0
+#
+# followed by records. Each record has a header of its type code (unsigned byte) and the
+# length of its body (unsigned short), then the body: fixed width fields, followed by any
+# strings. All numbers are little endian.
+#
+#   1 fleetAdded - sequence I, fleetId I, startTime q, then name
+#   2 fleetRemoved - sequence I, fleetId I
+#   3 fleetChanged - sequence I, fleetId I, startTime q
+#   4 sequenceStarted - sequence I, fFlagDownTime q
+#   5 startSequenceReset - sequence I
+#   6 finishAdded - sequence I, finishId I, finishTime q, fleetId I, hasBoat B, then a boat
+#   7 finishChanged - sequence I, finishId I, fleetId I, hasBoat B, then a boat
+#   8 finishRemoved - sequence I, finishId I
+#   9 snapshot - sequence I, nextFleetId I, nextFinishId I, number of records I
+#
+# where a boat, if hasBoat is 1, is py H then sailNumber, boatClass and fleetName.
+#
+# Times are signed milliseconds since the epoch, with the smallest long long for no time. A
+# fleetId of 0 is no fleet, and a py of 0 is no py. A string is its length in bytes (unsigned
+# byte) followed by the string in UTF-8, cut to 255 bytes on a character boundary. A string is
+# read back as a str if it is ASCII, and as unicode if it isn't.
+#
+# A snapshot file holds a snapshot record followed by the records that build the race manager,
+# with a sequence of 0. A journal file holds the records in the order they were written.
+#
+# A reader skips records with a type code it doesn't know, and ignores any bytes at the end of
+# a record body it doesn't understand, so that a later version can add record types and fields.
+# A record torn by a crash part way through a write is the last in the file, and is ignored.
+#
+
+import struct
+
+from persistence import journal
+
+MAGIC = "HSRF"
+VERSION = 1
+
+SNAPSHOT_FILE = 1
+JOURNAL_FILE = 2
+
+SNAPSHOT = "snapshot"
+
+FILE_HEADER = struct.Struct("<4sHBB")
+RECORD_HEADER = struct.Struct("<BH")
+
+NO_TIME = -2 ** 63
+
+PY = struct.Struct("<H")
+
+RECORD_TYPES = [
+    (1, journal.FLEET_ADDED, struct.Struct("<IIq")),
+    (2, journal.FLEET_REMOVED, struct.Struct("<II")),
+    (3, journal.FLEET_CHANGED, struct.Struct("<IIq")),
+    (4, journal.SEQUENCE_STARTED, struct.Struct("<Iq")),
+    (5, journal.START_SEQUENCE_RESET, struct.Struct("<I")),
+    (6, journal.FINISH_ADDED, struct.Struct("<IIqIB")),
+    (7, journal.FINISH_CHANGED, struct.Struct("<IIIB")),
+    (8, journal.FINISH_REMOVED, struct.Struct("<II")),
+    (9, SNAPSHOT, struct.Struct("<IIII")),
+]
+
+RECORD_TYPES_BY_KIND = dict((kind, (code, recordStruct)) for (code, kind, recordStruct) in RECORD_TYPES)
+RECORD_TYPES_BY_CODE = dict((code, (kind, recordStruct)) for (code, kind, recordStruct) in RECORD_TYPES)
+
+
+class RaceFormatException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def microsToMillis(micros):
+    if micros is None:
+        return NO_TIME
+    return micros // 1000
+
+def millisToMicros(millis):
+    if millis == NO_TIME:
+        return None
+    return millis * 1000
+
+def idToNumber(anId):
+    if anId is None:
+        return 0
+    return int(anId)
+
+def numberToId(number):
+    if number == 0:
+        return None
+    return str(number)
+
+def encodeString(aString):
+    if aString is None:
+        aString = ""
+    if isinstance(aString, unicode):
+        aString = aString.encode("utf-8")
+    aString = str(aString)
+    if len(aString) > 255:
+        # don't leave part of a character at the end
+        aString = aString[:255].decode("utf-8", "ignore").encode("utf-8")
+    return chr(len(aString)) + aString
+
+#
+# Decode the string at an offset in a record body. Returns the string and the offset after it.
+#
+def decodeString(body, offset):
+    length = ord(body[offset])
+    aString = body[offset + 1:offset + 1 + length]
+    if len(aString) < length:
+        raise RaceFormatException("String is cut short")
+    aString = aString.decode("utf-8", "ignore")
+    try:
+        aString = aString.encode("ascii")
+    except UnicodeEncodeError:
+        pass
+    return (aString, offset + 1 + length)
+
+def encodePY(py):
+    if py is None:
+        return PY.pack(0)
+    if not isinstance(py, (int, long)) or not 0 < py <= journal.MAX_PY:
+        raise RaceFormatException("Cannot encode a PY of %r" % (py,))
+    return PY.pack(py)
+
+def encodeBoat(boat):
+    (sailNumber, boatClass, py, fleetName) = boat
+    return encodePY(py) + encodeString(sailNumber) + encodeString(boatClass) + encodeString(fleetName)
+
+def decodeBoat(hasBoat, body, offset):
+    if not hasBoat:
+        return None
+    (py,) = PY.unpack_from(body, offset)
+    (sailNumber, offset) = decodeString(body, offset + PY.size)
+    (boatClass, offset) = decodeString(body, offset)
+    (fleetName, offset) = decodeString(body, offset)
+    return (sailNumber, boatClass, py or None, fleetName or None)
+
+
+#
+# Encode a journal record, a tuple of (sequence, kind, values...), as bytes
+#
+def encodeRecord(record):
+    sequence = record[0]
+    kind = record[1]
+    values = record[2:]
+    strings = ""
+
+    if kind == journal.FLEET_ADDED:
+        (fleetId, name, startTime) = values
+        fields = (sequence, idToNumber(fleetId), microsToMillis(startTime))
+        strings = encodeString(name)
+    elif kind in (journal.FLEET_REMOVED, journal.FINISH_REMOVED):
+        fields = (sequence, idToNumber(values[0]))
+    elif kind == journal.FLEET_CHANGED:
+        (fleetId, startTime) = values
+        fields = (sequence, idToNumber(fleetId), microsToMillis(startTime))
+    elif kind == journal.SEQUENCE_STARTED:
+        fields = (sequence, microsToMillis(values[0]))
+    elif kind == journal.START_SEQUENCE_RESET:
+        fields = (sequence,)
+    elif kind == journal.FINISH_ADDED:
+        (finishId, finishTime, fleetId, boat) = values
+        fields = (sequence, idToNumber(finishId), microsToMillis(finishTime), idToNumber(fleetId), boat is not None)
+        if boat is not None:
+            strings = encodeBoat(boat)
+    elif kind == journal.FINISH_CHANGED:
+        (finishId, fleetId, boat) = values
+        fields = (sequence, idToNumber(finishId), idToNumber(fleetId), boat is not None)
+        if boat is not None:
+            strings = encodeBoat(boat)
+    elif kind == SNAPSHOT:
+        fields = (sequence,) + tuple(values)
+    else:
+        raise RaceFormatException("Cannot encode record %s" % kind)
+
+    (code, recordStruct) = RECORD_TYPES_BY_KIND[kind]
+    return RECORD_HEADER.pack(code, recordStruct.size + len(strings)) + recordStruct.pack(*fields) + strings
+
+
+#
+# Decode the body of a record back to a tuple of (sequence, kind, values...)
+#
+def decodeRecord(kind, recordStruct, body):
+    fields = recordStruct.unpack_from(body)
+    sequence = fields[0]
+
+    if kind == journal.FLEET_ADDED:
+        (fleetId, startTime) = fields[1:]
+        (name, offset) = decodeString(body, recordStruct.size)
+        values = (numberToId(fleetId), name, millisToMicros(startTime))
+    elif kind in (journal.FLEET_REMOVED, journal.FINISH_REMOVED):
+        values = (numberToId(fields[1]),)
+    elif kind == journal.FLEET_CHANGED:
+        values = (numberToId(fields[1]), millisToMicros(fields[2]))
+    elif kind == journal.SEQUENCE_STARTED:
+        values = (millisToMicros(fields[1]),)
+    elif kind == journal.START_SEQUENCE_RESET:
+        values = ()
+    elif kind == journal.FINISH_ADDED:
+        values = (numberToId(fields[1]), millisToMicros(fields[2]), numberToId(fields[3]),
+                  decodeBoat(fields[4], body, recordStruct.size))
+    elif kind == journal.FINISH_CHANGED:
+        values = (numberToId(fields[1]), numberToId(fields[2]), decodeBoat(fields[3], body, recordStruct.size))
+    else:
+        values = tuple(fields[1:])
+    return (sequence, kind) + values
+
+
+def encodeFileHeader(fileType):
+    return FILE_HEADER.pack(MAGIC, VERSION, fileType, 0)
+
+
+#
+# Does a file start with our magic? Used to find the files pickled by earlier versions, which
+# are migrated by persistence.migrate.
+#
+def isRaceFormatFile(filename):
+    aFile = open(filename, "rb")
+    try:
+        return aFile.read(len(MAGIC)) == MAGIC
+    finally:
+        aFile.close()
+
+
+#
+# Generate the records in a file, as tuples of (sequence, kind, values...)
+#
+def readRecords(aFile, fileType):
+    header = aFile.read(FILE_HEADER.size)
+    if not header:
+        return
+    if len(header) < FILE_HEADER.size:
+        raise RaceFormatException("Race file header is incomplete")
+    (magic, version, headerFileType, reserved) = FILE_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise RaceFormatException("Not a race file. A recovery file from an earlier version must first be "
+                                  "migrated with python -m persistence.migrate")
+    if version > VERSION:
+        raise RaceFormatException("Race file version %d is newer than %d" % (version, VERSION))
+    if headerFileType != fileType:
+        raise RaceFormatException("Race file has type %d, expected %d" % (headerFileType, fileType))
+
+    while True:
+        recordHeader = aFile.read(RECORD_HEADER.size)
+        if not recordHeader:
+            return
+        if len(recordHeader) < RECORD_HEADER.size:
+            return
+        (code, length) = RECORD_HEADER.unpack(recordHeader)
+        body = aFile.read(length)
+        if len(body) < length:
+            # torn by a crash part way through a write
+            return
+        if not code in RECORD_TYPES_BY_CODE:
+            continue
+        (kind, recordStruct) = RECORD_TYPES_BY_CODE[code]
+        try:
+            record = decodeRecord(kind, recordStruct, body)
+        except (struct.error, IndexError):
+            raise RaceFormatException("Record %s is too short" % kind)
+        yield record
+
+
+#
+# Write journal records to a file. The file header is written first if the file is empty.
+#
+class JournalWriter:
+
+    def __init__(self, aFile, isEmpty):
+        self.file = aFile
+        if isEmpty:
+            self.file.write(encodeFileHeader(JOURNAL_FILE))
+
+    def writeRecords(self, records):
+        self.file.write("".join(encodeRecord(record) for record in records))
+
+
+def encodeSnapshot(snapshot):
+    parts = [encodeFileHeader(SNAPSHOT_FILE),
+             encodeRecord((snapshot.sequence, SNAPSHOT, snapshot.nextFleetId, snapshot.nextFinishId,
+                           len(snapshot.records)))]
+    parts.extend(encodeRecord((0,) + record) for record in snapshot.records)
+    return "".join(parts)
+
+
+def readSnapshot(aFile):
+    records = readRecords(aFile, SNAPSHOT_FILE)
+    for firstRecord in records:
+        if firstRecord[1] != SNAPSHOT:
+            raise RaceFormatException("Snapshot file does not start with a snapshot")
+        (sequence, kind, nextFleetId, nextFinishId, numberRecords) = firstRecord
+        snapshotRecords = [record[1:] for record in records]
+        if len(snapshotRecords) < numberRecords:
+            raise RaceFormatException("Snapshot has %d of %d records" % (len(snapshotRecords), numberRecords))
+        return journal.Snapshot(sequence, nextFleetId, nextFinishId, snapshotRecords)
+    raise RaceFormatException("Snapshot file is empty")
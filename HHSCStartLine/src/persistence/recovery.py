@@ -5,74 +5,449 @@ Created on 29 Jul 2014
 '''
 
 #
-# This module contains classes for persisting the StartLine racemanager to disk. It gets notified when the race manager changes and writes a pickled
-# race manager (without its signal object) to the pickle file. 
+# This module contains classes for persisting the StartLine racemanager to disk. It gets notified when the race manager changes and appends
+# a record of the change to a journal file. From time to time it compacts the journal by writing a snapshot of the race manager to
+# the recovery file and starting a new journal. See persistence.journal.
+#
+# The snapshot and the journal are written in the race file format, see persistence.raceformat. We only read that format: recovery
+# files pickled by earlier versions are refused rather than unpickled, and must be converted with persistence.migrate.
 #
 
 #
-# The race recovery manager uses the pickle module to dump the race manager to a string whenever the race changes. The manager writes to
-# file in its own thread to minimise the risk of IO issues on the user interface TK event queue.
+# The race recovery manager builds the journal records and snapshots on the TK event queue, which is cheap, and hands them to the
+# recovery writer. A journal record is built as its change is fired, so that the journal always keeps up with the race manager.
+# Compacting takes a snapshot of the whole race manager, so it is done in the background lane, after every record for the changes
+# so far has been queued; a snapshot then holds exactly the changes up to its sequence number. The writer encodes and writes them to file in its own thread to minimise the risk of IO issues on the user interface
+# TK event queue. When we run more than one start line, the race recovery managers share one recovery writer thread.
+#
+# The writer coalesces: a change waits up to maxStalenessSeconds before it is written, so that a burst of changes costs one write.
+# Journal records are all written, in order. Only the latest snapshot is written, and the journal records it already holds are dropped.
+#
+# The snapshot holds the sequence number of the last journal record in it, so that records already in the snapshot are not replayed
+# if we crash between writing a snapshot and starting the new journal.
+#
+# A snapshot is written to a temporary file, which is renamed over the pickle file, so that a power cut part way through a write
+# leaves the previous snapshot in place. Windows can't rename over an existing file, so there we remove the pickle file first; if
+# we crash between the two, recovery reads the temporary file. Whatever the fsync policy, the snapshot and the rename are forced
+# to disk before the journal is truncated, as a truncated journal with a snapshot that never reached the disk loses the race.
+#
+# The fsync policy says when the writer forces what it has written to disk:
+#
+# always - after every write. Writes that are coalesced share one fsync (group commit).
+# interval - at most every fsyncIntervalMillis, and fsyncIntervalMillis after the last write
+#
+# There is no policy that only syncs at shutdown: the recovery files are removed when we shut down
+# cleanly, so such a policy would never make anything durable.
 #
 
 import os
-import pickle
 import logging
-import Queue
+import sys
+import threading
+
+from model.clock import monotonicSeconds, Waker
+from model.race import RaceManager
+from model.utils import PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from persistence import journal, raceformat
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL)
+
+#
+# The recovery writer writes recovery files in its own thread. It is shared by all of the race
+# recovery managers in the process, so that several start lines share one persistence thread.
+#
+class RecoveryWriter:
+    
+    # the longest a change waits before it is written
+    maxStalenessSeconds = 0.25
+    
+    fsyncPolicy = FSYNC_ALWAYS
+    fsyncIntervalMillis = 1000
+    
+    def __init__(self):
+        # guards the pending changes, and the waker wakes the writer thread when there are some
+        self.lock = threading.Lock()
+        self.waker = Waker()
+        # held while we write, so that a recovery manager can stop without racing a write
+        self.writeLock = threading.Lock()
+        # the journal records and latest snapshot waiting to be written, for each recovery manager
+        self.pendingRecords = {}
+        self.pendingSnapshots = {}
+        # when the oldest change waiting to be written was queued
+        self.dirtySince = None
+        self.isRunning = False
+        self.writeCount = 0
+        # the recovery managers with journal records written but not synced to disk
+        self.unsyncedManagers = set()
+        self.lastSyncSeconds = monotonicSeconds()
+        self.syncCount = 0
+        
+    def queueRecord(self,recoveryManager,record):
+        self.lock.acquire()
+        try:
+            self.pendingRecords.setdefault(recoveryManager,[]).append(record)
+            self.markDirty()
+        finally:
+            self.lock.release()
+    
+    #
+    # Queue a snapshot. It replaces any snapshot waiting to be written, along with the
+    # journal records it holds.
+    #
+    def queueSnapshot(self,recoveryManager,snapshot):
+        self.lock.acquire()
+        try:
+            self.pendingSnapshots[recoveryManager] = snapshot
+            records = self.pendingRecords.get(recoveryManager,[])
+            self.pendingRecords[recoveryManager] = [record for record in records if record[0] > snapshot.sequence]
+            self.markDirty()
+        finally:
+            self.lock.release()
+            
+    def markDirty(self):
+        if self.dirtySince is None:
+            self.dirtySince = monotonicSeconds()
+            self.waker.wake()
+            
+    def takePending(self):
+        pending = [(recoveryManager,self.pendingSnapshots.pop(recoveryManager,None),records)
+                   for (recoveryManager,records) in self.pendingRecords.items()]
+        pending.extend((recoveryManager,snapshot,[]) for (recoveryManager,snapshot) in self.pendingSnapshots.items())
+        self.pendingRecords = {}
+        self.pendingSnapshots = {}
+        self.dirtySince = None
+        return pending
+        
+    #
+    # This method gets called in its own thread
+    #
+    def run(self):
+
+        self.isRunning = True
+        while self.isRunning:
+            logging.debug("Waiting for changes to write")
+            while True:
+                self.lock.acquire()
+                try:
+                    waitSeconds = self.secondsUntilWriteDue()
+                    if waitSeconds is not None and waitSeconds <= 0:
+                        pending = self.takePending()
+                        break
+                finally:
+                    self.lock.release()
+                # we wait outside the lock, until we are woken or the write is due
+                self.waker.wait(waitSeconds)
+            self.write(pending)
+            
+        # make sure that everything we have written is on disk
+        self.writeQueued()
+        self.sync()
+        self.waker.close()
+        
+    #
+    # How long the writer thread waits before it writes, or None if it waits until it is woken.
+    # Changes wait a little so that they coalesce, and written journals wait for their sync.
+    #
+    def secondsUntilWriteDue(self):
+        if not self.isRunning:
+            return 0
+        if self.dirtySince is not None:
+            return self.dirtySince + self.maxStalenessSeconds - monotonicSeconds()
+        if self.fsyncPolicy == FSYNC_INTERVAL and self.unsyncedManagers:
+            return self.secondsUntilSyncDue()
+        return None
+            
+    #
+    # Write everything that is queued, on the caller's thread
+    #
+    def writeQueued(self):
+        self.lock.acquire()
+        try:
+            pending = self.takePending()
+        finally:
+            self.lock.release()
+        self.write(pending)
+        
+    def write(self,pending):
+        self.writeLock.acquire()
+        try:
+            for (recoveryManager,snapshot,records) in pending:
+                if recoveryManager.isStopped:
+                    continue
+                if snapshot:
+                    recoveryManager.writeRecoveryFile(raceformat.encodeSnapshot(snapshot))
+                if records:
+                    recoveryManager.writeJournalRecords(records)
+                    self.unsyncedManagers.add(recoveryManager)
+                self.writeCount = self.writeCount + 1
+        finally:
+            self.writeLock.release()
+            
+        if self.fsyncPolicy == FSYNC_ALWAYS or self.isSyncDue():
+            self.sync()
+            
+    def isSyncDue(self):
+        return (self.fsyncPolicy == FSYNC_INTERVAL and self.unsyncedManagers
+                and self.secondsUntilSyncDue() <= 0)
+    
+    def secondsUntilSyncDue(self):
+        if self.fsyncPolicy != FSYNC_INTERVAL or not self.unsyncedManagers:
+            return 1
+        return self.lastSyncSeconds + self.fsyncIntervalMillis / 1000.0 - monotonicSeconds()
+            
+    #
+    # Force the journals we have written to disk, one fsync for each journal
+    #
+    def sync(self):
+        self.writeLock.acquire()
+        try:
+            for recoveryManager in self.unsyncedManagers:
+                if not recoveryManager.isStopped:
+                    recoveryManager.syncJournal()
+                    self.syncCount = self.syncCount + 1
+            self.unsyncedManagers = set()
+            self.lastSyncSeconds = monotonicSeconds()
+        finally:
+            self.writeLock.release()
+            
+    def stop(self):
+        self.lock.acquire()
+        try:
+            self.isRunning = False
+        finally:
+            self.lock.release()
+        self.waker.wake()
+        
 
 class RaceRecoveryManager:
-    def __init__(self,pickleFilename,raceManager):
+    
+    # the number of journal records we write before we compact the journal into a new snapshot
+    compactAfterRecords = 1000
+    
+    def __init__(self,pickleFilename,raceManager,recoveryWriter=None):
         self.pickleFilename = pickleFilename
+        self.journalFilename = pickleFilename + ".journal"
+        self.journalFile = None
+        self.journalWriter = None
+        self.isStopped = False
+        # the sequence number of the last journal record, and the number since the last snapshot
+        self.journalSequence = 0
+        self.recordsSinceSnapshot = 0
+        # if we aren't given a writer to share, we have our own
+        self.ownsRecoveryWriter = recoveryWriter is None
+        if self.ownsRecoveryWriter:
+            recoveryWriter = RecoveryWriter()
+        self.recoveryWriter = recoveryWriter
+        self.raceManager = None
+        if raceManager:
+            self.setRaceManager(raceManager)
+        
+    #
+    # Start recording a race manager. We write a snapshot of it straight away, so that
+    # any journal left over from an earlier race is discarded.
+    #
+    def setRaceManager(self,raceManager):
         self.raceManager = raceManager
-        self.saveQueue = Queue.Queue() 
+        self.wireRecoveryManager()
+        self.compact()
+        
+    #
+    # The journal records are built in the normal lane, as the changes are fired. We compact in the
+    # background lane, which runs after the normal lane for every change fired so far.
+    #
+    def wireRecoveryManager(self):
+        changed = self.raceManager.changed
+        changed.connect("fleetAdded",self.handleFleetAdded,PRIORITY_NORMAL)
+        changed.connect("fleetRemoved",self.handleFleetRemoved,PRIORITY_NORMAL)
+        changed.connect("fleetChanged",self.handleFleetChanged,PRIORITY_NORMAL)
+        changed.connect("sequenceStartedWithWarning",self.handleSequenceStarted,PRIORITY_NORMAL)
+        changed.connect("sequenceStartedWithoutWarning",self.handleSequenceStarted,PRIORITY_NORMAL)
+        changed.connect("startSequenceReset",self.handleStartSequenceReset,PRIORITY_NORMAL)
+        changed.connect("finishAdded",self.handleFinishAdded,PRIORITY_NORMAL)
+        changed.connect("finishesAdded",self.handleFinishesAdded,PRIORITY_NORMAL)
+        changed.connect("finishChanged",self.handleFinishChanged,PRIORITY_NORMAL)
+        changed.connect("finishRemoved",self.handleFinishRemoved,PRIORITY_NORMAL)
+        changed.connect(None,self.handleChanged,PRIORITY_BACKGROUND)
         
     def hasRecoveryFile(self):
-        return os.path.exists(self.pickleFilename)
+        return (os.path.exists(self.pickleFilename) or os.path.exists(self.temporaryFilename())
+                or os.path.exists(self.journalFilename))
     
+    def temporaryFilename(self):
+        return self.pickleFilename + ".tmp"
     
-    def readPickledRaceManager(self):
-        pickleFile = open(self.pickleFilename,"r")
-        pickledRaceManager = pickle.load(pickleFile)
-        pickleFile.close()
-        
-        return pickledRaceManager
+    #
+    # Read the snapshot from the recovery file
+    #
+    def readSnapshot(self):
+        snapshotFilename = self.pickleFilename
+        # we crashed on Windows between removing the old snapshot and renaming the new one,
+        # or while writing the very first snapshot
+        if not os.path.exists(snapshotFilename):
+            snapshotFilename = self.temporaryFilename()
+        snapshotFile = open(snapshotFilename,"rb")
+        try:
+            snapshot = raceformat.readSnapshot(snapshotFile)
+        except Exception:
+            if snapshotFilename == self.pickleFilename:
+                raise
+            logging.warning("Ignoring incomplete snapshot %s" % snapshotFilename)
+            return (0,RaceManager())
+        finally:
+            snapshotFile.close()
+        return (snapshot.sequence,snapshot.restore(RaceManager()))
+    
+    #
+    # Recover the race manager from the snapshot and the journal. Returns the race manager,
+    # which we don't start recording until we are given it with setRaceManager.
+    #
+    def recoverRaceManager(self):
+        if os.path.exists(self.pickleFilename) or os.path.exists(self.temporaryFilename()):
+            (snapshotSequence,raceManager) = self.readSnapshot()
+        else:
+            (snapshotSequence,raceManager) = (0,RaceManager())
+            
+        self.journalSequence = snapshotSequence
+        if os.path.exists(self.journalFilename):
+            journalFile = open(self.journalFilename,"rb")
+            try:
+                records = raceformat.readRecords(journalFile,raceformat.JOURNAL_FILE)
+                self.journalSequence = journal.replayRecords(raceManager,records,snapshotSequence)
+            finally:
+                journalFile.close()
+        logging.info("Recovered race manager from snapshot %d and journal to %d" % (snapshotSequence,self.journalSequence))
+        return raceManager
+    
+    #
+    # Append a record for a change to the journal
+    #
+    def appendRecord(self,record):
+        self.journalSequence = self.journalSequence + 1
+        self.recordsSinceSnapshot = self.recordsSinceSnapshot + 1
+        self.recoveryWriter.queueRecord(self,(self.journalSequence,) + record)
+    
+    #
+    # Compact the journal if it is long enough. This is only called when the journal has
+    # caught up with the race manager, so the snapshot matches the journal sequence.
+    #
+    def compactIfDue(self):
+        if self.recordsSinceSnapshot >= self.compactAfterRecords:
+            self.compact()
+            
+    #
+    # Queue a snapshot of the race manager, after which the journal starts again
+    #
+    def compact(self):
+        self.recordsSinceSnapshot = 0
+        self.recoveryWriter.queueSnapshot(self,journal.takeSnapshot(self.raceManager,self.journalSequence))
+    
+    #
+    # These methods get called in the recovery writer's thread
+    #
+    def writeJournalRecords(self,records):
+        if not self.journalWriter:
+            isEmpty = not os.path.exists(self.journalFilename) or os.path.getsize(self.journalFilename) == 0
+            self.journalFile = open(self.journalFilename,"ab")
+            self.journalWriter = raceformat.JournalWriter(self.journalFile,isEmpty)
+        self.journalWriter.writeRecords(records)
+        self.journalFile.flush()
     
     def writeRecoveryFile(self,fileContents):
         #
+        # write the new snapshot alongside the old one, then swap it in
         #
-        recoveryFile = open(self.pickleFilename,"w") 
+        recoveryFile = open(self.temporaryFilename(),"wb") 
         recoveryFile.write(fileContents)
+        recoveryFile.flush()
+        os.fsync(recoveryFile.fileno())
         recoveryFile.close()
         
-    def raceManagerChanged(self,aRaceManager):
-        self.writePickleRaceManager(aRaceManager)
+        if sys.platform == "win32" and os.path.exists(self.pickleFilename):
+            os.remove(self.pickleFilename)
+        os.rename(self.temporaryFilename(),self.pickleFilename)
+        self.syncDirectory()
+        
+        # the snapshot has everything in the journal, and is on disk, so we start a new one
+        self.closeJournal()
+        open(self.journalFilename,"wb").close()
+        
+    #
+    # Force the rename of the snapshot to disk. Windows can't open a directory, and
+    # its renames are written through, so there is nothing to do there.
+    #
+    def syncDirectory(self):
+        if sys.platform == "win32":
+            return
+        directory = os.open(os.path.dirname(os.path.abspath(self.pickleFilename)),os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        
+    def syncJournal(self):
+        if self.journalFile:
+            os.fsync(self.journalFile.fileno())
+        
+    def closeJournal(self):
+        if self.journalFile:
+            self.journalFile.close()
+            self.journalFile = None
+            self.journalWriter = None
+        
+    def handleChanged(self,*args):
+        self.compactIfDue()
+        
+    def handleFleetAdded(self,aFleet):
+        self.appendRecord(journal.fleetAddedRecord(aFleet))
+        
+    def handleFleetRemoved(self,aFleet):
+        self.appendRecord(journal.fleetRemovedRecord(aFleet))
+        
+    def handleFleetChanged(self,aFleet):
+        self.appendRecord(journal.fleetChangedRecord(aFleet))
         
-    def handleRaceManagerChanged(self,*args):
+    def handleSequenceStarted(self):
+        self.appendRecord(journal.sequenceStartedRecord(self.raceManager))
         
-        self.saveQueue.put(pickle.dumps(self.raceManager))
+    def handleStartSequenceReset(self):
+        self.appendRecord(journal.startSequenceResetRecord())
+        
+    def handleFinishAdded(self,aFinish):
+        self.appendRecord(journal.finishAddedRecord(aFinish))
+        
+    def handleFinishesAdded(self,finishes):
+        for aFinish in finishes:
+            self.handleFinishAdded(aFinish)
+        
+    def handleFinishChanged(self,aFinish):
+        self.appendRecord(journal.finishChangedRecord(aFinish))
+        
+    def handleFinishRemoved(self,aFinish):
+        self.appendRecord(journal.finishRemovedRecord(aFinish))
         
     #
-    # This method gets called in its own thread
+    # This method gets called in its own thread if we have our own recovery writer
     #
     def run(self):
-
-        self.isRunning = True
-        while self.isRunning:
-            try:
-                logging.debug("Waiting on save queue")
-                pickledRaceManager = self.saveQueue.get(block=True)
-                self.writeRecoveryFile(pickledRaceManager)
-                
-            except Queue.Empty:
-                # we do nothing if the queue is empty. This should never happen, because we are
-                # blocking for ever.
-                pass
+        self.recoveryWriter.run()
     
     #
-    # when we are asked to stop, we delete the recovery file
+    # when we are asked to stop, we delete the recovery file and the journal
     #
     def stop(self):
         
-        self.isRunning = False
+        if self.ownsRecoveryWriter:
+            self.recoveryWriter.stop()
         
-        if self.hasRecoveryFile():
-            os.remove(self.pickleFilename)
\ No newline at end of file
+        # wait for any write in progress, and don't write again
+        self.recoveryWriter.writeLock.acquire()
+        try:
+            self.isStopped = True
+            self.closeJournal()
+            for filename in [self.pickleFilename,self.temporaryFilename(),self.journalFilename]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+        finally:
+            self.recoveryWriter.writeLock.release()
@@ -0,0 +1,125 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from model.race import RaceManager, Boat
+from model.clock import SimulatedClock
+from persistence.archive import RaceArchive, RaceArchiver, INSERT_RACE
+
+class RaceArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.databaseFilename = os.path.join(self.directory, "races.db")
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = RaceManager(clock=self.clock)
+        self.raceManager.createFleet("Large handicap")
+        self.raceManager.createFleet("Toppers")
+        self.raceArchive = RaceArchive(self.databaseFilename)
+        self.raceArchiver = RaceArchiver(self.raceArchive, self.raceManager, "Inner")
+
+    def tearDown(self):
+        self.raceArchive.closeConnection()
+        shutil.rmtree(self.directory)
+
+    def runRace(self):
+        self.raceManager.startRaceSequenceWithoutWarning()
+        self.clock.advance(400)
+        self.raceManager.generalRecall()
+        self.clock.advance(1800)
+        finishes = self.raceManager.createFinishes([None, None, None], self.raceManager.fleets[0])
+        self.raceManager.assignBoatToFinish(Boat("1234", "Laser", 1100), finishes[1])
+        self.raceManager.removeFinish(finishes[2])
+        self.raceArchive.writeQueued()
+        return finishes
+
+    def testRaceRecorded(self):
+        finishes = self.runRace()
+        races = self.raceArchive.races()
+        self.assertEqual(len(races), 1)
+        (raceId, courseName, startedAt, resetAt) = races[0]
+        self.assertEqual((raceId, courseName, resetAt), (1, "Inner", None))
+
+        # two fleets started, and the recalled fleet started again
+        self.assertEqual(len(self.raceArchive.fleetStartsForRace(raceId)), 3)
+        self.assertEqual([fleetId for (fleetId, recalledAt) in self.raceArchive.recallsForRace(raceId)], ["1"])
+
+        # the removed finish is not included
+        self.assertEqual([finish[0] for finish in self.raceArchive.finishesForRace(raceId)],
+                         [finishes[0].finishId, finishes[1].finishId])
+        # after the recall, the Toppers start first
+        self.assertEqual(len(self.raceArchive.finishesForRace(raceId, "2")), 2)
+        self.assertEqual(self.raceArchive.finishesForRace(raceId, "1"), [])
+        self.assertEqual([finish[1] for finish in self.raceArchive.finishesForSailNumber("1234")], [finishes[1].finishId])
+
+    def testResetEndsRace(self):
+        self.runRace()
+        self.raceManager.resetStartSequence()
+        self.runRace()
+        races = self.raceArchive.races()
+        self.assertEqual([race[0] for race in races], [1, 2])
+        self.assertTrue(races[0][3] is not None)
+        # the finishes of the first race are kept
+        self.assertEqual(len(self.raceArchive.finishesForRace(1)), 2)
+
+    def testResetArchivedAfterNextStart(self):
+        self.runRace()
+        scheduled = []
+        self.raceManager.changed.setBackgroundScheduler(scheduled.append)
+        self.raceManager.resetStartSequence()
+        # the next sequence starts before Tk is idle and the archiver hears about the reset
+        self.raceManager.startRaceSequenceWithoutWarning()
+        for backgroundCalls in scheduled:
+            backgroundCalls()
+        self.raceArchive.writeQueued()
+        self.assertEqual(len(self.raceArchive.finishesForRace(1)), 2)
+
+    def testRaceIdsContinue(self):
+        self.runRace()
+        self.raceArchive.closeConnection()
+        self.assertEqual(RaceArchive(self.databaseFilename).newRaceId(), 2)
+
+    def testFailedBatchRetried(self):
+        # another connection holds the database, and we don't wait for it
+        self.raceArchive.connection = sqlite3.connect(self.databaseFilename, timeout=0)
+        otherConnection = sqlite3.connect(self.databaseFilename)
+        otherConnection.execute("begin exclusive")
+        self.runRace()
+        # the batch is kept rather than dropped
+        self.assertTrue(self.raceArchive.failedRows)
+        otherConnection.rollback()
+        otherConnection.close()
+        self.raceArchive.writeQueued()
+        self.assertEqual(self.raceArchive.failedRows, [])
+        self.assertEqual(len(self.raceArchive.finishesForRace(1)), 2)
+
+    def testBadRowDropped(self):
+        self.runRace()
+        # a second race with the same id
+        self.raceArchive.queueRow(INSERT_RACE, (1, "Inner", 0))
+        self.raceArchive.queueRow(INSERT_RACE, (2, "Outer", 0))
+        self.raceArchive.writeQueued()
+        self.assertEqual(sorted(race[1] for race in self.raceArchive.races()), ["Inner", "Outer"])
+        self.assertEqual(self.raceArchive.failedRows, [])
+
+    def testStopWritesQueuedRows(self):
+        archiveThread = threading.Thread(target=self.raceArchive.run)
+        archiveThread.daemon = True
+        archiveThread.start()
+        self.raceManager.startRaceSequenceWithoutWarning()
+        self.raceArchive.stop(2)
+        self.assertTrue(self.raceArchive.stopped.is_set())
+        self.assertEqual(len(self.raceArchive.races()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
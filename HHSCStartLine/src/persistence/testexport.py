@@ -0,0 +1,111 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import csv
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from model.race import RaceManager, Boat
+from model.clock import SimulatedClock
+from model.results import ResultsEngine
+from persistence import export
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = RaceManager(clock=self.clock)
+        self.raceManager.createFleet("Large handicap")
+        self.raceManager.createFleet("Toppers")
+        self.raceManager.startRaceSequenceWithWarning()
+        self.clock.advance(1800)
+        large = self.raceManager.fleets[0]
+        finishes = self.raceManager.createFinishes([None, None], fleet=large)
+        # the second finisher wins on corrected time
+        self.raceManager.assignBoatToFinish(Boat("1234", "Laser", 1100), finishes[0])
+        self.clock.advance(10)
+        self.raceManager.assignBoatToFinish(Boat("567", "Mirror", 1390), finishes[1])
+        finishes[1].finishTime = self.clock.now()
+        self.raceManager.createFinish()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testResultRows(self):
+        rows = list(export.resultRows(export.copyRace(self.raceManager)))
+        self.assertEqual([(row.fleetName, row.place, row.sailNumber) for row in rows],
+                         [("Large handicap", 1, "567"), ("Large handicap", 2, "1234"), (None, None, None)])
+
+    def testPlacesMatchResultsEngine(self):
+        large = self.raceManager.fleets[0]
+        # a tie with the winner on corrected time
+        self.raceManager.createFinishes([None], fleet=large)
+        self.raceManager.assignBoatToFinish(Boat("890", "Mirror", 1390), self.raceManager.finishes[-1])
+        fleetResults = ResultsEngine(self.raceManager).resultsForFleet(large)
+        rows = [row for row in export.resultRows(export.copyRace(self.raceManager)) if row.fleetName == large.name]
+        self.assertEqual([(row.place, row.finishId) for row in rows],
+                         [(row.place, row.finish.finishId) for row in fleetResults.rows()])
+        self.assertEqual([row.place for row in rows], [1, 1, 3])
+
+    def testRowsAreGenerated(self):
+        # the rows are generated as they are asked for, not built up front
+        rows = export.resultRows(export.copyRace(self.raceManager))
+        self.assertEqual(next(rows).place, 1)
+
+    def testCopyIsUnchangedByRace(self):
+        raceCopy = export.copyRace(self.raceManager)
+        self.raceManager.createFinish()
+        self.assertEqual(len(list(export.resultRows(raceCopy))), 3)
+
+    def testCsv(self):
+        filename = os.path.join(self.directory, "results.csv")
+        export.writeExport(export.exportLines(export.copyRace(self.raceManager), export.CSV), filename)
+        csvFile = open(filename, "rb")
+        lines = list(csv.reader(csvFile))
+        csvFile.close()
+        self.assertEqual(lines[0], export.COLUMN_TITLES)
+        self.assertEqual(lines[1][:3], ["Large handicap", "1", self.raceManager.finishes[1].finishId])
+        self.assertEqual(len(lines), 4)
+
+    def testJsonLines(self):
+        lines = list(export.exportLines(export.copyRace(self.raceManager), export.JSON_LINES))
+        values = json.loads(lines[0])
+        self.assertEqual((values["place"], values["sailNumber"], values["py"]), (1, "567", 1390))
+
+    def testHtml(self):
+        self.raceManager.fleets[1].name = "<Toppers>"
+        self.raceManager.finishes[2].fleet = self.raceManager.fleets[1]
+        html = "".join(export.exportLines(export.copyRace(self.raceManager), export.HTML, "Race 1"))
+        self.assertTrue("<h2>Large handicap</h2>" in html)
+        self.assertTrue("<h2>&lt;Toppers&gt;</h2>" in html)
+        self.assertEqual(html.count("<table>"), html.count("</table>"))
+
+    def testFormatForFilename(self):
+        self.assertEqual(export.formatForFilename("results.HTML"), export.HTML)
+        self.assertEqual(export.formatForFilename("results.jsonl"), export.JSON_LINES)
+        self.assertEqual(export.formatForFilename("results"), export.CSV)
+
+    def testExportOnOwnThread(self):
+        exporter = export.ResultsExporter()
+        exporterThread = threading.Thread(target=exporter.run)
+        exporterThread.daemon = True
+        exporterThread.start()
+        filename = os.path.join(self.directory, "results.html")
+        exporter.exportRace(self.raceManager, filename)
+        exporter.stop()
+        exporterThread.join(2)
+        self.assertEqual(exporter.exportCount, 1)
+        self.assertTrue(os.path.exists(filename))
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,254 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from model.race import RaceManager, Boat
+from model.clock import SimulatedClock
+from persistence import recovery
+from persistence.recovery import RaceRecoveryManager, RecoveryWriter, FSYNC_INTERVAL
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pickleFilename = os.path.join(self.directory, "currentRace.dmp")
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = RaceManager(clock=self.clock)
+        self.raceManager.createFleet("Large handicap")
+        self.recoveryManager = RaceRecoveryManager(self.pickleFilename, self.raceManager)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def recover(self):
+        self.recoveryManager.recoveryWriter.writeQueued()
+        self.recoveryManager.closeJournal()
+        return RaceRecoveryManager(self.pickleFilename, None).recoverRaceManager()
+
+    def runRace(self):
+        self.raceManager.createFleet("Toppers")
+        self.raceManager.startRaceSequenceWithWarning()
+        self.clock.advance(900)
+        self.raceManager.generalRecall()
+        self.clock.advance(1800)
+        finishes = self.raceManager.createFinishes([None, None, None])
+        finishes[0].fleet = self.raceManager.fleets[0]
+        self.raceManager.updateFinish(finishes[0])
+        self.raceManager.assignBoatToFinish(Boat("1234", "Laser", 1100), finishes[1])
+        self.raceManager.removeFinish(finishes[2])
+        self.raceManager.createFinish()
+
+    def assertSameRace(self, recovered):
+        self.assertEqual([(fleet.fleetId, fleet.name, fleet.startTime) for fleet in recovered.fleets],
+                         [(fleet.fleetId, fleet.name, fleet.startTime) for fleet in self.raceManager.fleets])
+        self.assertEqual([(finish.finishId, finish.finishTime, finish.fleet and finish.fleet.fleetId)
+                          for finish in recovered.finishes],
+                         [(finish.finishId, finish.finishTime, finish.fleet and finish.fleet.fleetId)
+                          for finish in self.raceManager.finishes])
+        self.assertEqual(recovered.fFlagDownTime, self.raceManager.fFlagDownTime)
+        self.assertEqual(recovered.nextFleetId, self.raceManager.nextFleetId)
+        self.assertEqual(recovered.nextFinishId, self.raceManager.nextFinishId)
+
+    def testReplayJournal(self):
+        self.runRace()
+        recovered = self.recover()
+        self.assertSameRace(recovered)
+        boat = recovered.finishWithId(self.raceManager.finishes[1].finishId).boat
+        self.assertEqual((boat.sailNumber, boat.py), ("1234", 1100))
+
+    def testReplayAfterCompaction(self):
+        self.recoveryManager.compactAfterRecords = 4
+        self.runRace()
+        recovered = self.recover()
+        self.assertSameRace(recovered)
+
+    def testCompactionWithBackgroundScheduler(self):
+        # as with Tk after_idle, the background lane runs after several changes have been made
+        idleCalls = []
+        self.raceManager.changed.setBackgroundScheduler(idleCalls.append)
+        self.recoveryManager.compactAfterRecords = 3
+        for i in range(5):
+            self.raceManager.createFinish()
+        while idleCalls:
+            idleCalls.pop(0)()
+        self.assertEqual(len(self.recover().finishes), 5)
+
+    def testCompactionPartWayThroughBurst(self):
+        for compactAfterRecords in [3, 5, 6, 7]:
+            self.recoveryManager.stop()
+            self.raceManager = RaceManager(clock=self.clock)
+            self.recoveryManager = RaceRecoveryManager(self.pickleFilename, self.raceManager)
+            self.recoveryManager.compactAfterRecords = compactAfterRecords
+            self.raceManager.createFinishes([None] * 5)
+            self.raceManager.createFinishes([None] * 5)
+            self.assertEqual(len(self.recover().finishes), 10)
+
+    def testSnapshotWithoutNewJournal(self):
+        # we crash after writing a snapshot but before starting a new journal
+        self.runRace()
+        self.recoveryManager.recoveryWriter.writeQueued()
+        journalFile = open(self.recoveryManager.journalFilename, "rb")
+        oldJournal = journalFile.read()
+        journalFile.close()
+        self.recoveryManager.compact()
+        self.recoveryManager.recoveryWriter.writeQueued()
+        journalFile = open(self.recoveryManager.journalFilename, "wb")
+        journalFile.write(oldJournal)
+        journalFile.close()
+        self.assertSameRace(self.recover())
+
+    def testTornRecordIgnored(self):
+        self.runRace()
+        self.recoveryManager.recoveryWriter.writeQueued()
+        self.recoveryManager.closeJournal()
+        journalFile = open(self.recoveryManager.journalFilename, "ab")
+        journalFile.write("\x80\x02(K")
+        journalFile.close()
+        self.assertSameRace(self.recover())
+
+    def testStopRemovesFiles(self):
+        self.runRace()
+        self.recoveryManager.recoveryWriter.writeQueued()
+        self.assertTrue(self.recoveryManager.hasRecoveryFile())
+        self.recoveryManager.stop()
+        self.assertFalse(self.recoveryManager.hasRecoveryFile())
+
+
+class RecoveryWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pickleFilename = os.path.join(self.directory, "currentRace.dmp")
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = RaceManager(clock=self.clock)
+        self.raceManager.createFleet("Large handicap")
+        self.recoveryWriter = RecoveryWriter()
+        self.recoveryManager = RaceRecoveryManager(self.pickleFilename, self.raceManager, self.recoveryWriter)
+
+    def tearDown(self):
+        self.recoveryWriter.stop()
+        shutil.rmtree(self.directory)
+
+    def testLatestSnapshotWins(self):
+        self.recoveryManager.compactAfterRecords = 2
+        for i in range(10):
+            self.raceManager.createFinish()
+        # the only snapshot left holds every finish, and the journal it covers is dropped
+        snapshot = self.recoveryWriter.pendingSnapshots[self.recoveryManager]
+        self.assertEqual(snapshot.sequence, 10)
+        self.assertEqual(self.recoveryWriter.pendingRecords[self.recoveryManager], [])
+        self.recoveryWriter.writeQueued()
+        self.assertEqual(self.recoveryWriter.writeCount, 1)
+        recovered = RaceRecoveryManager(self.pickleFilename, None).recoverRaceManager()
+        self.assertEqual(len(recovered.finishes), 10)
+
+    def testSnapshotIsConsistentCopy(self):
+        self.raceManager.createFinish()
+        # a change after the snapshot is taken is not in the snapshot
+        self.recoveryManager.compact()
+        self.raceManager.fleets[0].name = "Changed"
+        snapshot = self.recoveryWriter.pendingSnapshots[self.recoveryManager]
+        self.assertEqual(snapshot.records[0][2], "Large handicap")
+
+    def testBurstCoalescedInOneWrite(self):
+        self.recoveryWriter.maxStalenessSeconds = 0.1
+        writerThread = threading.Thread(target=self.recoveryWriter.run)
+        writerThread.daemon = True
+        writerThread.start()
+        self.raceManager.createFinishes([None] * 5)
+        for i in range(5):
+            self.raceManager.createFinish()
+        time.sleep(0.5)
+        self.assertEqual(self.recoveryWriter.writeCount, 1)
+        self.recoveryWriter.stop()
+        writerThread.join(2)
+        self.recoveryManager.closeJournal()
+        recovered = RaceRecoveryManager(self.pickleFilename, None).recoverRaceManager()
+        self.assertEqual(len(recovered.finishes), 10)
+
+    def testWriterWokenByChangesAndStop(self):
+        self.recoveryWriter.maxStalenessSeconds = 0.05
+        writerThread = threading.Thread(target=self.recoveryWriter.run)
+        writerThread.daemon = True
+        writerThread.start()
+        time.sleep(0.1)
+        writeCount = self.recoveryWriter.writeCount
+        self.raceManager.createFinish()
+        time.sleep(0.2)
+        self.assertEqual(self.recoveryWriter.writeCount, writeCount + 1)
+        # the idle writer stops as soon as it is told to
+        stopSeconds = time.time()
+        self.recoveryWriter.stop()
+        writerThread.join(2)
+        self.assertFalse(writerThread.isAlive())
+        self.assertTrue(time.time() - stopSeconds < 0.5)
+
+    def testGroupCommit(self):
+        for i in range(10):
+            self.raceManager.createFinish()
+        self.recoveryWriter.writeQueued()
+        # ten records and a snapshot, written and synced together
+        self.assertEqual(self.recoveryWriter.syncCount, 1)
+
+    def testSyncInterval(self):
+        self.recoveryWriter.fsyncPolicy = FSYNC_INTERVAL
+        self.recoveryWriter.fsyncIntervalMillis = 60000
+        self.recoveryWriter.writeQueued()
+        self.raceManager.createFinish()
+        self.recoveryWriter.writeQueued()
+        self.assertEqual(self.recoveryWriter.syncCount, 0)
+        self.assertTrue(self.recoveryWriter.secondsUntilSyncDue() > 0)
+        self.recoveryWriter.fsyncIntervalMillis = 0
+        self.assertTrue(self.recoveryWriter.isSyncDue())
+        self.recoveryWriter.writeQueued()
+        self.assertEqual(self.recoveryWriter.syncCount, 1)
+
+    def testSnapshotSyncedBeforeJournalTruncated(self):
+        self.recoveryWriter.fsyncPolicy = FSYNC_INTERVAL
+        self.recoveryWriter.fsyncIntervalMillis = 60000
+        self.raceManager.createFinish()
+        self.recoveryManager.compact()
+        events = []
+        def fsync(fileno):
+            events.append("fsync")
+        def closeJournal():
+            events.append("closeJournal")
+        originalFsync = recovery.os.fsync
+        recovery.os.fsync = fsync
+        self.recoveryManager.closeJournal = closeJournal
+        try:
+            self.recoveryWriter.writeQueued()
+        finally:
+            recovery.os.fsync = originalFsync
+        # the snapshot file and its directory are synced, even when the journal sync isn't due,
+        # before we start a new journal
+        self.assertEqual(events, ["fsync", "fsync", "closeJournal"])
+
+    def testIncompleteSnapshotLeavesPrevious(self):
+        self.raceManager.createFinish()
+        self.recoveryWriter.writeQueued()
+        # a power cut part way through writing the next snapshot
+        temporaryFile = open(self.recoveryManager.temporaryFilename(), "wb")
+        temporaryFile.write("\x80\x02")
+        temporaryFile.close()
+        self.recoveryManager.closeJournal()
+        recovered = RaceRecoveryManager(self.pickleFilename, None).recoverRaceManager()
+        self.assertEqual(len(recovered.finishes), 1)
+
+    def testSnapshotRenamedIntoPlace(self):
+        self.recoveryWriter.writeQueued()
+        self.assertTrue(os.path.exists(self.pickleFilename))
+        self.assertFalse(os.path.exists(self.recoveryManager.temporaryFilename()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from model.race import RaceManager, Boat
+from model.clock import SimulatedClock
+from model.competitors import normaliseSailNumber
+from persistence import journal, raceformat
+from persistence.recovery import RaceRecoveryManager
+from persistence.migrate import migrateRecoveryFiles
+
+class RaceFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock(datetime.datetime(2026, 6, 14, 11, 0, 0))
+        self.raceManager = RaceManager(clock=self.clock)
+        self.raceManager.createFleet("Large handicap")
+        self.raceManager.createFleet(u"Sm\xe5ll handicap")
+        self.raceManager.startRaceSequenceWithWarning()
+        self.clock.advance(1800)
+        finishes = self.raceManager.createFinishes([None, None])
+        self.raceManager.assignBoatToFinish(Boat("1234", "Laser", 1100, "Large handicap"), finishes[0])
+
+    def testRecordRoundTrip(self):
+        records = [(1, journal.FLEET_ADDED, "1", "Large handicap", 1781434800000000),
+                   (2, journal.FLEET_REMOVED, "1"),
+                   (3, journal.FLEET_CHANGED, "2", None),
+                   (4, journal.SEQUENCE_STARTED, 1781434800000000),
+                   (5, journal.START_SEQUENCE_RESET),
+                   (6, journal.FINISH_ADDED, "3", 1781436600000000, None, None),
+                   (7, journal.FINISH_CHANGED, "3", "2", ("1234", "Laser", 1100, None)),
+                   (8, journal.FINISH_REMOVED, "3")]
+        aFile = StringIO()
+        raceformat.JournalWriter(aFile, True).writeRecords(records)
+        aFile.seek(0)
+        self.assertEqual(list(raceformat.readRecords(aFile, raceformat.JOURNAL_FILE)), records)
+
+    def testSnapshotRoundTrip(self):
+        snapshot = journal.takeSnapshot(self.raceManager, 7)
+        recovered = raceformat.readSnapshot(StringIO(raceformat.encodeSnapshot(snapshot)))
+        self.assertEqual((recovered.sequence, recovered.nextFleetId, recovered.nextFinishId),
+                         (7, self.raceManager.nextFleetId, self.raceManager.nextFinishId))
+        self.assertEqual(recovered.records, snapshot.records)
+
+    def testUnknownRecordSkipped(self):
+        # a record type added by a later version
+        contents = (raceformat.encodeFileHeader(raceformat.JOURNAL_FILE) +
+                    raceformat.RECORD_HEADER.pack(200, 3) + "abc" +
+                    raceformat.encodeRecord((1, journal.FINISH_REMOVED, "3")))
+        records = list(raceformat.readRecords(StringIO(contents), raceformat.JOURNAL_FILE))
+        self.assertEqual(records, [(1, journal.FINISH_REMOVED, "3")])
+
+    def testLongerRecordRead(self):
+        # a later version adds a field to the end of a record
+        (code, recordStruct) = raceformat.RECORD_TYPES_BY_KIND[journal.FINISH_REMOVED]
+        contents = (raceformat.encodeFileHeader(raceformat.JOURNAL_FILE) +
+                    raceformat.RECORD_HEADER.pack(code, recordStruct.size + 2) +
+                    recordStruct.pack(1, 3) + "\x01\x02")
+        records = list(raceformat.readRecords(StringIO(contents), raceformat.JOURNAL_FILE))
+        self.assertEqual(records, [(1, journal.FINISH_REMOVED, "3")])
+
+    def testTornRecordIgnored(self):
+        contents = (raceformat.encodeFileHeader(raceformat.JOURNAL_FILE) +
+                    raceformat.encodeRecord((1, journal.FINISH_REMOVED, "3")) +
+                    raceformat.encodeRecord((2, journal.FINISH_REMOVED, "4"))[:-3])
+        records = list(raceformat.readRecords(StringIO(contents), raceformat.JOURNAL_FILE))
+        self.assertEqual(records, [(1, journal.FINISH_REMOVED, "3")])
+
+    def testNewerVersionRejected(self):
+        contents = raceformat.FILE_HEADER.pack(raceformat.MAGIC, raceformat.VERSION + 1, raceformat.JOURNAL_FILE, 0)
+        records = raceformat.readRecords(StringIO(contents), raceformat.JOURNAL_FILE)
+        self.assertRaises(raceformat.RaceFormatException, list, records)
+
+    def testIncompleteSnapshotRejected(self):
+        contents = raceformat.encodeSnapshot(journal.takeSnapshot(self.raceManager, 7))
+        self.assertRaises(raceformat.RaceFormatException, raceformat.readSnapshot, StringIO(contents[:-10]))
+
+    def testNonAsciiStrings(self):
+        boat = (u"\xc5L 12", "Laser", 1100, u"Sm\xe5ll handicap")
+        record = (1, journal.FINISH_CHANGED, "3", "2", boat)
+        aFile = StringIO()
+        raceformat.JournalWriter(aFile, True).writeRecords([record])
+        aFile.seek(0)
+        [recovered] = list(raceformat.readRecords(aFile, raceformat.JOURNAL_FILE))
+        self.assertEqual(recovered, record)
+        # an ASCII string comes back as a str
+        self.assertTrue(isinstance(recovered[4][1], str))
+        self.assertEqual(normaliseSailNumber(recovered[4][0]), "\xc3\x85L12")
+        # a long string is cut on a character boundary
+        (longString, offset) = raceformat.decodeString(raceformat.encodeString(u"\xe5" * 200), 0)
+        self.assertEqual(longString, u"\xe5" * 127)
+
+    def testBadPY(self):
+        self.assertEqual([journal.pyRecord(py) for py in [None, "", 1100, "1100", 1100.0, "fast", 0, 70000, 1100.5]],
+                         [None, None, 1100, 1100, 1100, None, None, None, None])
+        self.assertRaises(raceformat.RaceFormatException, raceformat.encodeBoat, ("1", "Laser", 70000, None))
+        self.assertRaises(raceformat.RaceFormatException, raceformat.encodeBoat, ("1", "Laser", "1100", None))
+
+    def writePickledRecoveryFiles(self, pickleFilename):
+        # a race in progress when we upgrade from a version that pickled the recovery file
+        pickleFile = open(pickleFilename, "wb")
+        pickle.dump(journal.takeSnapshot(self.raceManager, 0), pickleFile, pickle.HIGHEST_PROTOCOL)
+        pickleFile.close()
+        journalFile = open(pickleFilename + ".journal", "wb")
+        pickle.dump((1,) + journal.finishRemovedRecord(self.raceManager.finishes[1]), journalFile,
+                    pickle.HIGHEST_PROTOCOL)
+        journalFile.close()
+
+    def testPickledRecoveryFileRefused(self):
+        directory = tempfile.mkdtemp()
+        try:
+            pickleFilename = os.path.join(directory, "currentRace.dmp")
+            self.writePickledRecoveryFiles(pickleFilename)
+            self.assertRaises(raceformat.RaceFormatException,
+                              RaceRecoveryManager(pickleFilename, None).recoverRaceManager)
+            # and a pickled journal on its own
+            os.remove(pickleFilename)
+            self.assertRaises(raceformat.RaceFormatException,
+                              RaceRecoveryManager(pickleFilename, None).recoverRaceManager)
+        finally:
+            shutil.rmtree(directory)
+
+    def testMigratePickledRecoveryFile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            pickleFilename = os.path.join(directory, "currentRace.dmp")
+            self.writePickledRecoveryFiles(pickleFilename)
+            self.assertEqual(migrateRecoveryFiles(pickleFilename), [pickleFilename, pickleFilename + ".journal"])
+            self.assertTrue(os.path.exists(pickleFilename + ".pickled"))
+            recovered = RaceRecoveryManager(pickleFilename, None).recoverRaceManager()
+            self.assertEqual([finish.finishId for finish in recovered.finishes],
+                             [self.raceManager.finishes[0].finishId])
+            # migrating again does nothing
+            self.assertEqual(migrateRecoveryFiles(pickleFilename), [])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
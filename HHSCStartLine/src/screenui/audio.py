@@ -13,6 +13,7 @@ You will need to download PyAudio, see http://people.csail.mit.edu/hubert/pyaudi
 import pyaudio
 import wave
 import Queue
+from screenui.clipqueue import ClipQueue
 import time
 import logging
 
@@ -74,7 +75,8 @@ class AudioManager:
             self.audioClips[clipname] = AudioClip(wavFilename)
             
 
-        self.commandQueue = Queue.Queue()
+        # the clip queue arbitrates between the start lines sharing this audio manager
+        self.commandQueue = ClipQueue()
         self.isPlaying = False
         
         
@@ -118,10 +120,11 @@ class AudioManager:
         self.portAudio.terminate()
             
     #
-    # This method is called from within the Tkinter event thread.
+    # This method is called from within the Tkinter event thread. The source is the
+    # name of the start line queueing the clip, if there is more than one.
     #
-    def queueClip(self,clipName):
-        self.commandQueue.put(AudioManagerPlayClip(clipName))
+    def queueClip(self,clipName,source=None):
+        self.commandQueue.putClip(AudioManagerPlayClip(clipName),clipName,source)
         
     
     def stop(self):
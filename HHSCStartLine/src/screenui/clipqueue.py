@@ -0,0 +1,127 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+
+#
+# The clip queue is the command queue for the audio managers. It is shared by every
+# start line in the process, so it arbitrates between them:
+#
+# - guns are played before finish guns, which are played before warning beeps. This only
+#   matters when clips back up, e.g. two start lines firing at the same moment.
+# - a start or warning signal queued by one start line within mergeSeconds of the same
+#   signal queued by another start line, and still waiting to be played, is merged into it.
+#   Two courses starting on the same second hear one gun, not two guns a second and a half
+#   apart.
+#
+# Finish guns are never merged, so every finish gets its gun. Neither are clips queued
+# without a source, e.g. the race officer pressing the gun button, or clips from the same
+# source.
+#
+# The queue has the same get/put/qsize interface as Queue.Queue, and get raises
+# Queue.Empty on a timeout.
+#
+
+import heapq
+import threading
+import Queue
+
+from model.clock import monotonicSeconds
+
+CLIP_PRIORITIES = {"gun": 0, "startgun": 0, "finishgun": 1, "warning": 2}
+DEFAULT_PRIORITY = 1
+# the start sequence signals, which two courses starting together share
+MERGED_CLIPS = frozenset(["gun", "startgun", "warning"])
+# other commands, e.g. stop, go after any clips already queued
+COMMAND_PRIORITY = 10
+
+
+class ClipQueue(object):
+
+    # signals queued this close together are due at the same time
+    mergeSeconds = 0.5
+
+    def __init__(self):
+        self.heap = []
+        self.nextSequence = 0
+        self.condition = threading.Condition()
+        # the times the waiting clips were queued, oldest first, by (clipName, source)
+        self.pendingClips = {}
+        self.mergedCount = 0
+
+    #
+    # Queue a command to play a clip. Returns False if the clip was merged with the
+    # same signal already queued by another source.
+    #
+    def putClip(self, command, clipName, source=None):
+        self.condition.acquire()
+        try:
+            queuedSeconds = monotonicSeconds()
+            if self.isMerged(clipName, source, queuedSeconds):
+                self.mergedCount = self.mergedCount + 1
+                return False
+            key = (clipName, source)
+            self.pendingClips.setdefault(key, []).append(queuedSeconds)
+            self.push(CLIP_PRIORITIES.get(clipName, DEFAULT_PRIORITY), command, key)
+            return True
+        finally:
+            self.condition.release()
+
+    def isMerged(self, clipName, source, queuedSeconds):
+        if source is None or not clipName in MERGED_CLIPS:
+            return False
+        for ((pendingClipName, pendingSource), pendingQueuedSeconds) in self.pendingClips.items():
+            if pendingClipName == clipName and pendingSource is not None and pendingSource != source:
+                for pendingSeconds in pendingQueuedSeconds:
+                    if abs(queuedSeconds - pendingSeconds) <= self.mergeSeconds:
+                        return True
+        return False
+
+    def put(self, command):
+        self.condition.acquire()
+        try:
+            self.push(COMMAND_PRIORITY, command, None)
+        finally:
+            self.condition.release()
+
+    def push(self, priority, command, key):
+        heapq.heappush(self.heap, (priority, self.nextSequence, command, key))
+        self.nextSequence = self.nextSequence + 1
+        self.condition.notify()
+
+    def get(self, block=True, timeout=None):
+        self.condition.acquire()
+        try:
+            if block:
+                deadline = None
+                if timeout is not None:
+                    deadline = monotonicSeconds() + timeout
+                while not self.heap:
+                    if deadline is None:
+                        # wait with a timeout so that the thread can be interrupted
+                        self.condition.wait(1)
+                    else:
+                        remaining = deadline - monotonicSeconds()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+            if not self.heap:
+                raise Queue.Empty()
+
+            (priority, sequence, command, key) = heapq.heappop(self.heap)
+            if key:
+                # clips with the same key are played in the order they were queued
+                del self.pendingClips[key][0]
+                if not self.pendingClips[key]:
+                    del self.pendingClips[key]
+            return command
+        finally:
+            self.condition.release()
+
+    def qsize(self):
+        self.condition.acquire()
+        try:
+            return len(self.heap)
+        finally:
+            self.condition.release()
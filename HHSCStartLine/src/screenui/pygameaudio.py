@@ -21,6 +21,7 @@ the pygame video module which we don't want to do.
 '''
 import pygame
 import Queue
+from screenui.clipqueue import ClipQueue
 import logging
 
 
@@ -68,7 +69,8 @@ class AudioManager:
             self.audioClips[clipname] = AudioClip(wavFilename)
             
 
-        self.commandQueue = Queue.Queue()
+        # the clip queue arbitrates between the start lines sharing this audio manager
+        self.commandQueue = ClipQueue()
         self.isPlaying = False
         
         
@@ -103,10 +105,11 @@ class AudioManager:
         pygame.mixer.quit()
             
     #
-    # This method is called from within the Tkinter event thread.
+    # This method is called from within the Tkinter event thread. The source is the
+    # name of the start line queueing the clip, if there is more than one.
     #
-    def queueClip(self,clipName):
-        self.commandQueue.put(AudioManagerPlayClip(clipName))
+    def queueClip(self,clipName,source=None):
+        self.commandQueue.putClip(AudioManagerPlayClip(clipName),clipName,source)
         
     
     def stop(self):
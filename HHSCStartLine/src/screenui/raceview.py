@@ -23,7 +23,10 @@ class StartLineFrame(Frame):
         '''
         Constructor
         '''
-        self.tk = Tk()
+        # we are the main window unless we are given a master, e.g. a Toplevel for a second course
+        if master is None:
+            master = Tk()
+        self.tk = master
         self.fontSize=fontSize
         
         self.tk.attributes('-fullscreen',fullScreen)
@@ -166,6 +169,13 @@ class StartLineFrame(Frame):
         self.gunButton.grid(row=1,column=6,sticky=W+E+N+S)
         
         
+        #
+        # export results button
+        #
+        self.exportResultsButton = Button(self,
+                                          text="Export\nresults")
+        self.exportResultsButton.grid(row=3,column=6,sticky=W+E+N+S)
+        
         #
         # remove finish button
         #
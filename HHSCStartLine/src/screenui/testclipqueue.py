@@ -0,0 +1,75 @@
+'''
+Created on 18 Oct 2026
+
+@author: MBradley
+'''
+import unittest
+import Queue
+
+from screenui import clipqueue
+from screenui.clipqueue import ClipQueue
+
+
+class ClipQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = ClipQueue()
+
+    def testGunsBeforeWarnings(self):
+        self.queue.putClip("warning1", "warning", "Inner")
+        self.queue.putClip("finishgun1", "finishgun", "Inner")
+        self.queue.putClip("gun1", "gun", "Inner")
+        self.queue.put("stop")
+
+        self.assertEqual(["gun1", "finishgun1", "warning1", "stop"],
+                         [self.queue.get(block=False) for i in range(4)])
+
+    def testSameClipFromTwoCoursesMerged(self):
+        self.assertTrue(self.queue.putClip("gun1", "gun", "Inner"))
+        self.assertFalse(self.queue.putClip("gun2", "gun", "Outer"))
+
+        self.assertEqual(1, self.queue.qsize())
+        self.assertEqual(1, self.queue.mergedCount)
+
+        # once played, the next gun from the other course is queued
+        self.queue.get(block=False)
+        self.assertTrue(self.queue.putClip("gun3", "gun", "Outer"))
+
+    def testFinishGunsNotMerged(self):
+        # boats finishing on two courses each get their gun
+        self.assertTrue(self.queue.putClip("finishgun1", "finishgun", "Inner"))
+        self.assertTrue(self.queue.putClip("finishgun2", "finishgun", "Outer"))
+
+        self.assertEqual(2, self.queue.qsize())
+        self.assertEqual(0, self.queue.mergedCount)
+
+    def testSignalsDueAtDifferentTimesNotMerged(self):
+        queuedSeconds = [100.0]
+        self.patchMonotonicSeconds(lambda: queuedSeconds[0])
+        self.assertTrue(self.queue.putClip("warning1", "warning", "Inner"))
+        queuedSeconds[0] = 101.0
+        self.assertTrue(self.queue.putClip("warning2", "warning", "Outer"))
+        queuedSeconds[0] = 101.2
+        self.assertFalse(self.queue.putClip("warning3", "warning", "Middle"))
+
+        self.assertEqual(2, self.queue.qsize())
+
+    def patchMonotonicSeconds(self, monotonicSeconds):
+        originalMonotonicSeconds = clipqueue.monotonicSeconds
+        clipqueue.monotonicSeconds = monotonicSeconds
+        self.addCleanup(setattr, clipqueue, "monotonicSeconds", originalMonotonicSeconds)
+
+    def testSameSourceNotMerged(self):
+        self.queue.putClip("gun1", "gun", "Inner")
+        self.queue.putClip("gun2", "gun", "Inner")
+        self.queue.putClip("gun3", "gun")
+        self.queue.putClip("gun4", "gun")
+
+        self.assertEqual(4, self.queue.qsize())
+
+    def testGetTimesOut(self):
+        self.assertRaises(Queue.Empty, self.queue.get, True, 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()